@@ -0,0 +1,317 @@
+"""Ad-hoc benchmarks. Run with: python tests/benchmarks.py [name ...]"""
+import os
+import pickle
+import random
+import string
+import sys
+import time
+import tracemalloc
+from email.utils import formatdate
+
+from twitter.models import User
+
+from twitterhal.models import Tweet, TweetList
+from twitterhal.util import strip_phrase, strip_phrases
+
+
+random.seed(1337)
+# Used by the Redis benchmarks, which use (and then delete) the key
+# "twitterhal:benchmark"
+REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/15")
+WORDS = ["".join(random.choice(string.ascii_lowercase) for _ in range(random.randint(1, 9))) for _ in range(5000)]
+
+
+def random_text(max_words=40):
+    text = " ".join(random.choice(WORDS) for _ in range(random.randint(1, max_words)))
+    if random.random() < 0.3:
+        text = "@" + random.choice(WORDS) + " " + text
+    if random.random() < 0.2:
+        text += " https://t.co/" + "".join(random.choice(string.ascii_letters) for _ in range(10))
+    if random.random() < 0.2:
+        text += " #" + random.choice(WORDS)
+    return text
+
+
+def random_tweets(count):
+    now = int(time.time())
+    users = [
+        User(
+            id=idx, screen_name=f"user_{idx}", name=f"User {idx}", description=random_text(20),
+            followers_count=random.randint(0, 10000), friends_count=random.randint(0, 1000),
+            created_at=formatdate(now - 10 ** 8), location="Somewhere", lang="en",
+        )
+        for idx in range(200)
+    ]
+    return [
+        Tweet(
+            id=10 ** 18 + idx,
+            full_text=random_text(),
+            user=random.choice(users),
+            in_reply_to_status_id=10 ** 18 + random.randint(0, idx) if idx and random.random() < 0.5 else None,
+            created_at=formatdate(now - (count - idx) * 60),
+            lang="en",
+            source="TwitterHAL",
+        )
+        for idx in range(count)
+    ]
+
+
+def measure(func):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size, elapsed
+
+
+def bench_tweet_storage(count=20000):
+    """Resident memory and pickle size of TweetList, full Tweets vs TweetRecords"""
+    tweets = random_tweets(count)
+    # Round-trip through pickle, so we measure what a freshly opened DB holds
+    full_pickle = pickle.dumps(TweetList(tweets, unique=True, compact=False))
+    compact_pickle = pickle.dumps(TweetList(tweets, unique=True))
+    del tweets
+    _, full_mem, full_time = measure(lambda: pickle.loads(full_pickle))
+    _, compact_mem, compact_time = measure(lambda: pickle.loads(compact_pickle))
+    print(f"{count} tweets:")
+    print(f"  Tweet:       {full_mem / 2 ** 20:7.1f} MiB in RAM, {len(full_pickle) / 2 ** 20:7.1f} MiB pickled, "
+          f"unpickled in {full_time:.2f} s")
+    print(f"  TweetRecord: {compact_mem / 2 ** 20:7.1f} MiB in RAM, {len(compact_pickle) / 2 ** 20:7.1f} MiB pickled, "
+          f"unpickled in {compact_time:.2f} s")
+
+
+def bench_strip_phrase(count=100000):
+    """Throughput of util.strip_phrase(), uncached, vs util.strip_phrases()"""
+    texts = []
+    for _ in range(count):
+        text = random_text()
+        if random.random() < 0.2:
+            text += " " + random.choice(["\U0001F600", "\U0001F44D\U0001F3FD", "\u2764\ufe0f", "&amp;", "\u2026"])
+        if random.random() < 0.1:
+            text = text.replace(" ", "\n", 1)
+        texts.append(text)
+    start = time.perf_counter()
+    for text in texts:
+        strip_phrase.__wrapped__(text)
+    single_time = time.perf_counter() - start
+    start = time.perf_counter()
+    strip_phrases(texts)
+    batch_time = time.perf_counter() - start
+    print(f"{count} tweets:")
+    print(f"  strip_phrase():  {single_time:.2f} s, {count / single_time:9.0f} tweets/s")
+    print(f"  strip_phrases(): {batch_time:.2f} s, {count / batch_time:9.0f} tweets/s")
+
+
+def bench_redis_list(size=1000, repeat=50):
+    """Round trips & latency per RedisList operation, against a local Redis (REDIS_URL)"""
+    from redis import Connection, ConnectionPool, Redis
+
+    from twitterhal.database import RedisList
+
+    class CountingConnection(Connection):
+        # One packed command per round trip, also for pipelines
+        round_trips = 0
+
+        def send_packed_command(self, *args, **kwargs):
+            CountingConnection.round_trips += 1
+            super().send_packed_command(*args, **kwargs)
+
+    def batched(func):
+        def run():
+            with redis_list.batch():
+                func()
+        return run
+
+    redis = Redis(connection_pool=ConnectionPool.from_url(REDIS_URL, connection_class=CountingConnection))
+    redis_list = RedisList(redis, "twitterhal:benchmark")
+    items = [random_text() for _ in range(size)]
+    operations = {
+        "append": lambda: redis_list.append(items[0]),
+        "insert(middle)": lambda: redis_list.insert(size // 2, items[0]),
+        "[middle] = ": lambda: redis_list.__setitem__(size // 2, items[0]),
+        "[::10]": lambda: redis_list[::10],
+        "del [middle]": lambda: redis_list.__delitem__(size // 2),
+        "del [10:20]": lambda: redis_list.__delitem__(slice(10, 20)),
+        "del [:50:5]": lambda: redis_list.__delitem__(slice(None, 50, 5)),
+        "pop()": lambda: redis_list.pop(),
+        "pop(middle)": lambda: redis_list.pop(size // 2),
+        "10 x append": lambda: [redis_list.append(items[0]) for _ in range(10)],
+        "10 x append, batched": batched(lambda: [redis_list.append(items[0]) for _ in range(10)]),
+        "10 x del [middle], batched": batched(lambda: [redis_list.__delitem__(size // 2) for _ in range(10)]),
+    }
+    print(f"List of {size} items, {repeat} repeats:")
+    try:
+        for name, operation in operations.items():
+            redis_list.data = items
+            # Makes sure any Lua scripts are loaded
+            operation()
+            CountingConnection.round_trips = 0
+            start = time.perf_counter()
+            for _ in range(repeat):
+                operation()
+            elapsed = time.perf_counter() - start
+            print(f"  {name:27} {CountingConnection.round_trips / repeat:5.1f} round trips, "
+                  f"{elapsed / repeat * 1000:7.3f} ms")
+    finally:
+        redis.delete(redis_list.key, redis_list.version_key)
+
+
+def bench_redis_stream(counts=(100000, 1000000), page_size=1000):
+    """Peak memory of iterating over a RedisList, paged vs in one LRANGE, against a local Redis (REDIS_URL)"""
+    from redis import Redis
+
+    from twitterhal.database import RedisList
+
+    def peak(func):
+        tracemalloc.start()
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        size = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return size, elapsed
+
+    def consume(iterable):
+        for _ in iterable:
+            pass
+
+    redis = Redis.from_url(REDIS_URL)
+    redis_list = RedisList(redis, "twitterhal:benchmark", page_size=page_size)
+    texts = [pickle.dumps(random_text(10)) for _ in range(1000)]
+    try:
+        for count in counts:
+            redis.delete(redis_list.key)
+            for start in range(0, count, 10000):
+                redis.rpush(redis_list.key, *[texts[idx % 1000] for idx in range(start, min(start + 10000, count))])
+            full_mem, full_time = peak(
+                lambda: consume(pickle.loads(i) for i in redis.lrange(redis_list.key, 0, -1)))
+            paged_mem, paged_time = peak(lambda: consume(redis_list.stream()))
+            print(f"{count} items:")
+            print(f"  {'LRANGE 0 -1:':30} {full_mem / 2 ** 20:8.2f} MiB peak, {full_time:.2f} s")
+            label = f"stream(), {page_size} items/page:"
+            print(f"  {label:30} {paged_mem / 2 ** 20:8.2f} MiB peak, {paged_time:.2f} s")
+    finally:
+        redis.delete(redis_list.key, redis_list.version_key)
+
+
+def bench_log_database(count=100000):
+    """Open time & memory of LogDatabase vs ShelveDatabase holding `count` tweets"""
+    import shutil
+    import tempfile
+
+    from twitterhal.database import LogDatabase, ShelveDatabase
+
+    def open_db(db):
+        db.add_key("posted_tweets", TweetList, unique=True)
+        db.open()
+        return db
+
+    tmp = tempfile.mkdtemp()
+    try:
+        tweets = random_tweets(count)
+        dbs = {
+            "ShelveDatabase": lambda: ShelveDatabase(os.path.join(tmp, "shelve")),
+            "LogDatabase": lambda: LogDatabase(os.path.join(tmp, "log")),
+        }
+        print(f"{count} tweets:")
+        for name, db_class in dbs.items():
+            db = open_db(db_class())
+            db.posted_tweets.extend(tweets)
+            db.close()
+            # tracemalloc slows it down, so time it separately
+            start = time.perf_counter()
+            open_db(db_class()).close()
+            elapsed = time.perf_counter() - start
+            db, size, _ = measure(lambda: open_db(db_class()))
+            print(f"  {name + ':':16} opened in {elapsed:.2f} s, {size / 2 ** 20:7.1f} MiB in RAM")
+            db.close()
+    finally:
+        shutil.rmtree(tmp)
+
+
+def bench_codecs(count=20000):
+    """Bytes per tweet & encode/decode throughput of each codec, per TweetRecord and per TweetList"""
+    from twitterhal.serialization import PickleCodec, TweetCodec
+
+    records = TweetList(random_tweets(count), unique=True).data
+    tweet_list = TweetList(records, unique=True)
+    codecs = {
+        "PickleCodec": PickleCodec(),
+        "PickleCodec, zlib": PickleCodec(compress_level=6),
+        "TweetCodec": TweetCodec(),
+        "TweetCodec, zlib": TweetCodec(compress_level=6),
+    }
+    print(f"{count} tweets:")
+    for name, codec in codecs.items():
+        # One value per tweet, like RedisDatabase, SQLiteDatabase and
+        # LogDatabase store them
+        start = time.perf_counter()
+        encoded = [codec.dumps(record) for record in records]
+        encode_time = time.perf_counter() - start
+        start = time.perf_counter()
+        for data in encoded:
+            codec.loads(data)
+        decode_time = time.perf_counter() - start
+        size = sum(len(data) for data in encoded)
+        print(f"  {name + ', per tweet:':30} {size / count:6.1f} bytes/tweet, encodes "
+              f"{count / encode_time:7.0f} tweets/s, decodes {count / decode_time:7.0f} tweets/s")
+        # The whole list as one value, like ShelveDatabase stores it
+        start = time.perf_counter()
+        encoded = codec.dumps(tweet_list)
+        encode_time = time.perf_counter() - start
+        start = time.perf_counter()
+        codec.loads(encoded)
+        decode_time = time.perf_counter() - start
+        print(f"  {name + ', per list:':30} {len(encoded) / count:6.1f} bytes/tweet, encodes "
+              f"{count / encode_time:7.0f} tweets/s, decodes {count / decode_time:7.0f} tweets/s")
+
+
+def bench_megahal_processes(replies=24, processes=(1, 2, 4), timeout=0.25):
+    """Reply throughput of MegaHAL in this process vs ProcessPoolGenerator with 1, 2 and 4 workers"""
+    import shutil
+    import tempfile
+    from concurrent.futures import ThreadPoolExecutor
+
+    from twitterhal.generation import create_megahal, process_pool_supported, ProcessPoolGenerator
+
+    tmp = tempfile.mkdtemp()
+    kwargs = {"brainfile": os.path.join(tmp, "brain"), "timeout": timeout}
+    try:
+        phrases = [random_text() for _ in range(2000)]
+        brain = create_megahal(**kwargs)
+        for phrase in phrases:
+            brain.learn(phrase)
+        # Generation takes `timeout` seconds per reply, during which MegaHAL
+        # generates as many candidates as it can, so replies/s shows how many
+        # run in parallel
+        start = time.perf_counter()
+        for phrase in phrases[:replies]:
+            brain.get_reply_nolearn(phrase)
+        elapsed = time.perf_counter() - start
+        brain.close()
+        print(f"{replies} replies, {os.cpu_count()} CPUs:")
+        print(f"  {'In this process:':22} {elapsed:6.2f} s, {replies / elapsed:5.1f} replies/s")
+        if not process_pool_supported():
+            print("  Worker processes require megahal < 0.4.0")
+            return
+        for count in processes:
+            generator = ProcessPoolGenerator(count, **kwargs)
+            # Start the workers before timing
+            list(ThreadPoolExecutor(count).map(generator.get_reply_nolearn, phrases[:count]))
+            start = time.perf_counter()
+            for future in [generator.submit(phrase) for phrase in phrases[:replies]]:
+                future.result()
+            elapsed = time.perf_counter() - start
+            generator.close()
+            print(f"  {f'{count} worker processes:':22} {elapsed:6.2f} s, {replies / elapsed:5.1f} replies/s")
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or [k[6:] for k in list(globals()) if k.startswith("bench_")]
+    for name in names:
+        print(f"--- {name}: {globals()['bench_' + name].__doc__}")
+        globals()["bench_" + name]()
@@ -0,0 +1,145 @@
+"""Stress test for generation.ConcurrentMegaHAL and generation.ReadWriteLock
+
+Many threads generate replies while others learn, with a fake MegaHAL that
+records whether generation and learning ever overlap. Also checks that
+learn_many() keeps a real megahal brain file in sync. Run with:
+python tests/test_concurrent_megahal.py
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from twitterhal.generation import ConcurrentMegaHAL, create_megahal, ReadWriteLock
+
+
+class FakeReply:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeMegaHAL:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.readers = 0
+        self.max_readers = 0
+        self.writers = 0
+        self.errors = []
+        self.learned = []
+
+    def get_reply_nolearn(self, phrase, max_length=None):
+        with self.lock:
+            if self.writers:
+                self.errors.append("Generating while learning")
+            self.readers += 1
+            self.max_readers = max(self.max_readers, self.readers)
+        time.sleep(0.001)
+        with self.lock:
+            self.readers -= 1
+        return FakeReply(phrase[::-1])
+
+    def learn(self, phrase):
+        with self.lock:
+            if self.readers or self.writers:
+                self.errors.append("Learning while generating or learning")
+            self.writers += 1
+        time.sleep(0.0005)
+        with self.lock:
+            self.writers -= 1
+            self.learned.append(phrase)
+
+    def close(self):
+        pass
+
+
+def test_stress(threads=32, replies=2000):
+    fake = FakeMegaHAL()
+    megahal = ConcurrentMegaHAL(fake, lock_timeout=30)
+
+    def work(n):
+        phrase = f"phrase {n}"
+        if n % 4:
+            reply = megahal.get_reply_nolearn(phrase)
+        else:
+            reply = megahal.get_reply(phrase)
+        assert reply.text == phrase[::-1]
+
+    with ThreadPoolExecutor(threads) as executor:
+        list(executor.map(work, range(replies)))
+    megahal.close()
+
+    assert not fake.errors, fake.errors[:5]
+    # Generation did run concurrently
+    assert fake.max_readers > 1
+    # Every phrase was learned exactly once, and some of them together
+    assert sorted(fake.learned) == sorted(f"phrase {n}" for n in range(0, replies, 4))
+    assert megahal.learned_count == len(fake.learned)
+    assert megahal.batch_count < megahal.learned_count
+    assert not megahal.learn_queue
+
+
+def test_learn_many():
+    fake = FakeMegaHAL()
+    megahal = ConcurrentMegaHAL(fake)
+    assert megahal.learn_many([]) == 0
+    assert megahal.learn_many(["a", "b", "c"]) == 3
+    assert fake.learned == ["a", "b", "c"]
+    assert megahal.batch_count == 1
+
+
+def test_learn_many_syncs(tmp_path):
+    kwargs = {"brainfile": str(tmp_path / "brain"), "timeout": 0.1}
+    megahal = ConcurrentMegaHAL(create_megahal(**kwargs))
+    # Every batch is synced, not only the first one
+    megahal.learn_many(["the quick brown fox jumps over the lazy dog"])
+    megahal.learn_many(["a completely different sentence about cheese"])
+    megahal.learn_many(["penguins are birds that cannot fly"])
+    megahal.close()
+    megahal = create_megahal(**kwargs)
+    for word in ("fox", "cheese", "penguins"):
+        assert word in megahal.get_reply_nolearn(word).text.lower()
+    megahal.close()
+
+
+def test_writer_not_starved():
+    lock = ReadWriteLock()
+    stop = threading.Event()
+
+    def read():
+        while not stop.is_set():
+            with lock.read():
+                time.sleep(0.001)
+
+    readers = [threading.Thread(target=read) for _ in range(8)]
+    for thread in readers:
+        thread.start()
+    try:
+        assert lock.acquire_write(timeout=5)
+        lock.release_write()
+    finally:
+        stop.set()
+        for thread in readers:
+            thread.join()
+
+
+def test_timeout():
+    lock = ReadWriteLock()
+    with lock.read():
+        assert not lock.acquire_write(timeout=0.01)
+        # A writer that timed out doesn't keep blocking readers
+        assert lock.acquire_read(timeout=0.01)
+        lock.release_read()
+    with lock.write():
+        assert not lock.acquire_read(timeout=0.01)
+
+
+if __name__ == "__main__":
+    import tempfile
+    from pathlib import Path
+
+    test_stress()
+    test_learn_many()
+    with tempfile.TemporaryDirectory() as tmp:
+        test_learn_many_syncs(Path(tmp))
+    test_writer_not_starved()
+    test_timeout()
+    print("OK")
@@ -0,0 +1,36 @@
+"""Tests for generation.create_megahal()
+
+Covers the brain database of megahal >= 0.4.0 sharing our Redis connection
+pool. That version isn't released yet, so megahal.MegaHAL is replaced by a
+class that only keeps what it's given. Run with:
+python -m pytest tests/test_create_megahal.py
+"""
+import megahal
+
+from twitterhal.database import get_redis_pool, RedisDatabase
+from twitterhal.generation import create_megahal
+
+
+class BrainDatabase(RedisDatabase):
+    pass
+
+
+class KeepingMegaHAL:
+    def __init__(self, db=None, **kwargs):
+        self.db = db
+        self.kwargs = kwargs
+
+
+def test_redis_pool_shared(monkeypatch):
+    monkeypatch.setattr(megahal, "VERSION", (0, 4, 0), raising=False)
+    monkeypatch.setattr(megahal, "MegaHAL", KeepingMegaHAL)
+    options = {"host": "localhost", "port": 6399, "namespace": "megahal", "pickle_protocol": 4, "cache": False}
+    pool = get_redis_pool(host="localhost", port=6399)
+    for Database in (RedisDatabase, BrainDatabase):
+        brain = create_megahal(Database, options, max_length=100)
+        assert isinstance(brain.db, Database)
+        assert brain.db._redis.connection_pool is pool
+        assert brain.kwargs == {"max_length": 100}
+    # Other connection parameters, other pool
+    brain = create_megahal(RedisDatabase, dict(options, socket_timeout=5))
+    assert brain.db._redis.connection_pool is not pool
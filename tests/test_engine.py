@@ -0,0 +1,299 @@
+"""Tests for engine.TwitterHAL, without Twitter
+
+TwitterHAL gets a shelve database in a temporary directory, and a MegaHAL
+stand-in that returns the replies it's given, in order. Covers how
+generate_tweet() screens candidates and falls back when it finds no unique
+one, how mentions it gave up on are retried, the random tweet pool,
+deferred learning in batches, MegaHAL worker processes getting fresh copies
+of the brain at checkpoints, and fetching our own timeline only once at
+startup. Run with:
+python -m pytest tests/test_engine.py
+"""
+import time
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import pytest
+from twitter.models import User
+
+from twitterhal.conf import settings
+from twitterhal.engine import TwitterHAL
+from twitterhal.generation import ConcurrentMegaHAL, create_megahal, process_pool_supported
+from twitterhal.gracefulkiller import killer
+from twitterhal.models import Tweet
+
+
+settings.setup(settings_dict={"SCREEN_NAME": "twitterhal"})
+
+
+class ScriptedMegaHAL:
+    """Returns `replies` in order, then empty replies"""
+
+    def __init__(self, replies=()):
+        self.replies = list(replies)
+        self.learned = []
+        self.generated = 0
+
+    def learn(self, phrase):
+        self.learned.append(phrase)
+
+    def get_reply_nolearn(self, phrase, max_length=None):
+        self.generated += 1
+        text = self.replies.pop(0) if self.replies else ""
+        return SimpleNamespace(text=text) if text else None
+
+    def close(self):
+        pass
+
+
+class TimelineApi:
+    """Twitter API stand-in with an empty timeline and no mentions, which
+    fails `failures` times before that
+    """
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.calls = []
+
+    def GetUserTimeline(self, **kwargs):
+        self.calls.append("GetUserTimeline")
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("Failing on purpose")
+        return []
+
+    def GetMentions(self, **kwargs):
+        self.calls.append("GetMentions")
+        return []
+
+
+@contextmanager
+def override_settings(**kwargs):
+    old = {key: getattr(settings, key) for key in kwargs}
+    for key, value in kwargs.items():
+        setattr(settings, key, value)
+    try:
+        yield
+    finally:
+        for key, value in old.items():
+            setattr(settings, key, value)
+
+
+def make_hal(path, replies=()):
+    with override_settings(DATABASE={"options": {"db_path": str(path / "db")}}):
+        hal = TwitterHAL()
+    hal.init_db()
+    hal._megahal = ConcurrentMegaHAL(ScriptedMegaHAL(replies))
+    hal.megahal_open = True
+    return hal
+
+
+def make_mention(id=100, text="@twitterhal what do you think about cheese"):
+    return Tweet(id=id, text=text, user=User(id=1, screen_name="someone"))
+
+
+def test_generate_tweet_one_at_a_time(tmp_path):
+    hal = make_hal(tmp_path, ["", "an old reply", "a brand new reply", "never generated"])
+    hal.db.posted_tweets.append(Tweet(id=1, text="an old reply"))
+    mention = make_mention()
+    with override_settings(TWEET_GENERATION={"batch_size": 4, "fallback": "skip"}):
+        tweet = hal.generate_tweet(in_reply_to=mention)
+    assert tweet.text == "@someone a brand new reply"
+    assert tweet.in_reply_to_status_id == 100
+    # Without worker processes, candidates are screened as they come
+    assert hal.megahal.generated == 3
+    assert hal.megahal.learned == [mention.filtered_text]
+    assert hal.generation_stats["attempts"] == 3
+    hal.close()
+
+
+def test_generate_tweet_fallbacks(tmp_path):
+    duplicates = ["an old reply!", "an old reply", "an old reply!!"]
+    for fallback in ("best", "skip", "queue"):
+        (tmp_path / fallback).mkdir()
+        hal = make_hal(tmp_path / fallback, duplicates)
+        hal.db.posted_tweets.append(Tweet(id=1, text="an old reply"))
+        with override_settings(TWEET_GENERATION={"max_attempts": 3, "fallback": fallback}):
+            tweet = hal.generate_tweet(in_reply_to=make_mention())
+        assert hal.generation_stats["fallbacks"] == 1
+        if fallback == "best":
+            assert tweet.text == "@someone an old reply!!"
+        else:
+            assert tweet is None
+        assert len(hal.deferred_mentions) == (fallback == "queue")
+        hal.close()
+
+
+def test_generate_tweet_best_needs_something(tmp_path):
+    # With "best", all-empty candidates don't count as something to fall
+    # back on
+    hal = make_hal(tmp_path, ["", "", "", "", "finally"])
+    with override_settings(TWEET_GENERATION={"max_attempts": 2, "fallback": "best"}):
+        tweet = hal.generate_tweet()
+    assert tweet.text == "finally"
+    assert hal.megahal.generated == 5
+    hal.close()
+
+
+def test_requeue_deferred_mentions(tmp_path):
+    hal = make_hal(tmp_path, ["a reply", "another reply"])
+    hal.force = True
+    mentions = [make_mention(id=100), make_mention(id=101)]
+    hal.db.mentions.extend(mentions)
+    # Captured when generate_tweet() gave up, and answered since then
+    hal.deferred_mentions.append((0, make_mention(id=100)))
+    hal.db.mentions.get_by_id(100).is_answered = True
+    hal.deferred_mentions.append((0, make_mention(id=101)))
+    hal.deferred_mentions.append((time.time() + 600, make_mention(id=102)))
+    hal.requeue_deferred_mentions()
+    assert [m[1].id for m in hal.deferred_mentions] == [102]
+    assert hal.mention_queue.qsize() == 1
+    # The retried mention was learned from the first time around
+    hal.pop_mention_and_generate_reply()
+    assert hal.post_queue.get_nowait().in_reply_to_status_id == 101
+    assert hal.megahal.learned == []
+    assert not hal.retried_mention_ids
+    hal.mention_queue.put(mentions[1])
+    hal.pop_mention_and_generate_reply()
+    assert hal.megahal.learned == [mentions[1].filtered_text]
+    hal.close()
+
+
+def test_pop_random_tweet(tmp_path):
+    hal = make_hal(tmp_path, ["a generated tweet"])
+    hal.force = True
+    hal.db.posted_tweets.append(Tweet(id=1, text="an old reply"))
+    hal.db.random_tweet_pool.extend(["an old reply!", "a pooled tweet", "another pooled tweet"])
+    # Has become a duplicate since it was generated
+    assert hal.pop_random_tweet().text == "a pooled tweet"
+    assert hal.random_tweet_pool_stats == {"hits": 1, "misses": 0, "discarded": 1}
+    hal.generate_random()
+    assert hal.post_queue.get_nowait().text == "another pooled tweet"
+    assert hal.megahal.generated == 0
+    hal.generate_random_lock.release()
+    # Generated on the spot when the pool is empty
+    hal.generate_random()
+    assert hal.post_queue.get_nowait().text == "a generated tweet"
+    assert hal.random_tweet_pool_stats == {"hits": 2, "misses": 1, "discarded": 1}
+    assert hal.pop_random_tweet() is None
+    hal.close()
+
+
+def test_random_tweet_pool_worker(tmp_path, monkeypatch):
+    hal = make_hal(tmp_path, ["one", "two", "two", "an old reply", "three", "never generated"])
+    hal.db.posted_tweets.append(Tweet(id=1, text="an old reply"))
+    hal.db.random_tweet_pool.append("one")
+    monkeypatch.setattr(killer, "kill_now", False)
+    # Stop once the pool is full
+    monkeypatch.setattr(killer, "sleep", lambda seconds: setattr(killer, "kill_now", True))
+    with override_settings(RANDOM_TWEET_POOL_SIZE=3):
+        hal.random_tweet_pool_worker()
+    # Neither duplicates of posted tweets nor of pooled ones are added
+    assert hal.db.random_tweet_pool == ["one", "two", "three"]
+    assert hal.megahal.generated == 5
+    hal.close()
+
+
+def test_learn_from_queue(tmp_path):
+    hal = make_hal(tmp_path, ["a reply"])
+    mention = make_mention()
+    with override_settings(DEFERRED_LEARNING={"enabled": True, "batch_size": 10}):
+        assert hal.generate_tweet(in_reply_to=mention).text == "@someone a reply"
+        assert hal.megahal.learned == []
+        hal.db.learn_queue.extend(["one", "two", "three", "four", "five"])
+        assert hal.learn_from_queue(batch_size=4) == 4
+        assert hal.megahal.learned == [mention.filtered_text, "one", "two", "three"]
+        assert hal.db.learn_queue == ["four", "five"]
+        # Nothing is removed if learning fails
+        learn = hal.megahal.megahal.learn
+        hal.megahal.megahal.learn = lambda phrase: 1 / 0
+        assert hal.learn_from_queue() == 0
+        assert hal.db.learn_queue == ["four", "five"]
+        hal.megahal.megahal.learn = learn
+        # Up to DEFERRED_LEARNING["batch_size"] by default
+        assert hal.learn_from_queue() == 2
+        assert hal.megahal.learned[-2:] == ["four", "five"]
+        assert hal.learn_from_queue() == 0
+    assert hal.megahal.batch_count == 2
+    hal.close()
+
+
+def test_learning_worker(tmp_path, monkeypatch):
+    hal = make_hal(tmp_path)
+    hal.db.learn_queue.extend(str(i) for i in range(7))
+    sleeps = []
+
+    def sleep(seconds):
+        # Stop after three rounds
+        sleeps.append(seconds)
+        if len(sleeps) % 3 == 0:
+            killer.kill_now = True
+
+    monkeypatch.setattr(killer, "kill_now", False)
+    monkeypatch.setattr(killer, "sleep", sleep)
+    with override_settings(DEFERRED_LEARNING={"batch_size": 3, "flush_seconds": 600}):
+        hal.learning_worker()
+    # Full batches only, until flush_seconds have passed
+    assert hal.megahal.learned == [str(i) for i in range(6)]
+    assert hal.db.learn_queue == ["6"]
+    killer.kill_now = False
+    with override_settings(DEFERRED_LEARNING={"batch_size": 3, "flush_seconds": 0}):
+        hal.learning_worker()
+    assert hal.megahal.learned == [str(i) for i in range(7)]
+    assert hal.megahal.batch_count == 3
+    hal.close()
+
+
+def test_own_tweets_fetched_once(tmp_path):
+    for failures in (0, 1):
+        (tmp_path / str(failures)).mkdir()
+        hal = make_hal(tmp_path / str(failures))
+        hal.api = TimelineApi(failures)
+        hal.register_workers = hal.register_loop_tasks = lambda: None
+        # As done by open()
+        hal._init_post_status_limit()
+        hal.prepare_runner()
+        # Fetched again only if it failed the first time
+        assert hal.api.calls.count("GetUserTimeline") == 1 + failures
+        hal.close()
+
+
+@pytest.mark.skipif(not process_pool_supported(), reason="requires megahal < 0.4.0")
+def test_worker_processes(tmp_path):
+    # megahal 0.3 fails on empty candidates with a max_length, which a brain
+    # this small generates
+    megahal_api = {"brainfile": str(tmp_path / "brain"), "timeout": 0.1, "max_length": None}
+    hal = make_hal(tmp_path)
+    with override_settings(MEGAHAL_API=megahal_api, MEGAHAL_PROCESSES=2):
+        hal._megahal = ConcurrentMegaHAL(create_megahal(**settings.MEGAHAL_API))
+        hal.megahal.learn_many(["the quick brown fox jumps over the lazy dog"])
+        generator = hal.generator
+        assert generator.processes == 2 and generator.learned_count == 1
+        # Learned from by the main process, generated by the workers, who
+        # don't know about it yet
+        replies = hal._get_reply_texts("a completely different sentence about cheese", None, count=2)
+        assert len(replies) == 2 and not any("cheese" in reply.lower() for reply in replies)
+        tmpdir = generator._tmpdir
+        hal.checkpoint()
+        assert generator._tmpdir != tmpdir and generator.learned_count == 2
+        assert "cheese" in generator.get_reply_nolearn("cheese").lower()
+        # Nothing new learned, nothing to refresh
+        tmpdir = generator._tmpdir
+        hal.checkpoint()
+        assert generator._tmpdir == tmpdir
+        hal.close()
+    assert hal._generator is None
+
+
+if __name__ == "__main__":
+    import tempfile
+    from pathlib import Path
+
+    for test in (
+        test_generate_tweet_one_at_a_time, test_generate_tweet_fallbacks, test_generate_tweet_best_needs_something,
+        test_requeue_deferred_mentions, test_pop_random_tweet, test_learn_from_queue, test_own_tweets_fetched_once,
+        test_worker_processes,
+    ):
+        with tempfile.TemporaryDirectory() as tmp:
+            test(Path(tmp))
+    print("OK")
@@ -0,0 +1,50 @@
+"""Lazy import checks for CLI startup
+
+`import twitterhal`, and the startup of `twitterhal --version` and
+`--print-config`, should not import megahal, twitter, emoji, Levenshtein or
+redis, nor the modules that need them. Each check runs in a fresh
+interpreter, so nothing imported by other tests gets in the way. Run with:
+python -m pytest tests/test_lazy_imports.py
+"""
+import os
+import subprocess
+import sys
+
+
+HEAVY_MODULES = [
+    "megahal", "twitter", "emoji", "Levenshtein", "redis", "twitterhal.database", "twitterhal.engine",
+    "twitterhal.generation", "twitterhal.models",
+]
+STARTUP_CODE = (
+    "import twitterhal.command_line, twitterhal.util; "
+    "from twitterhal.conf import settings; settings.setup(); str(settings)"
+)
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def get_imported(code):
+    """Heavy modules in sys.modules after running `code` in a subprocess"""
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    env.pop("TWITTERHAL_SETTINGS_MODULE", None)
+    result = subprocess.run(
+        [sys.executable, "-c", f"import sys; {code}; print(' '.join(sys.modules))"],
+        env=env, cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, check=True
+    )
+    modules = result.stdout.split()
+    return [m for m in HEAVY_MODULES if m in modules]
+
+
+def test_import_twitterhal():
+    imported = get_imported("import twitterhal")
+    assert not imported, f"import twitterhal imports {', '.join(imported)}"
+
+
+def test_cli_startup():
+    imported = get_imported(STARTUP_CODE)
+    assert not imported, f"CLI startup imports {', '.join(imported)}"
+
+
+if __name__ == "__main__":
+    test_import_twitterhal()
+    test_cli_startup()
+    print("OK")
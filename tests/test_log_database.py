@@ -0,0 +1,146 @@
+"""Tests for database.LogDatabase, SegmentLog, LogList and LogTweetStore
+
+Covers reopening logs that span several segments, compaction by sync(), and
+recovering from a record that was cut short or garbled at the end of the
+log (as by a crash while writing). Run with:
+python -m pytest tests/test_log_database.py
+"""
+import os
+from email.utils import formatdate
+
+from twitterhal.database import LOG_HEADER, LogDatabase, LogList, LogTweetStore
+from twitterhal.models import Tweet, TweetList
+
+
+def make_tweets(count, start=1):
+    return [
+        Tweet(id=id, text=f"tweet number {id}", created_at=formatdate(1000 + id),
+              in_reply_to_status_id=id - 1 if id % 3 == 0 else None)
+        for id in range(start, start + count)
+    ]
+
+
+def open_db(path, **kwargs):
+    db = LogDatabase(db_path=str(path), **kwargs)
+    db.add_key("posted_tweets", TweetList, unique=True)
+    db.add_key("learn_queue", list)
+    db.open()
+    return db
+
+
+def last_segment(db, key):
+    log = db._get_log(key)
+    return log._segment_path(log.segments[-1])
+
+
+def test_reopen_after_rollover(tmp_path):
+    db = open_db(tmp_path, segment_size=512)
+    assert isinstance(db.posted_tweets.data, LogTweetStore)
+    assert isinstance(db.learn_queue, LogList)
+    db.posted_tweets.extend(make_tweets(20))
+    db.posted_tweets.get_by_id(4).is_answered = True
+    db.learn_queue.extend([f"phrase {n}" for n in range(50)])
+    db.learn_queue.insert(1, "inserted")
+    del db.learn_queue[10:]
+    assert len(db._get_log("posted_tweets").segments) > 1
+    assert len(db._get_log("learn_queue").segments) > 1
+    db.close()
+
+    db = open_db(tmp_path, segment_size=512)
+    assert [t.id for t in db.posted_tweets] == list(range(1, 21))
+    assert [t.id for t in db.posted_tweets.answered] == [4]
+    assert [t.id for t in db.posted_tweets.replies] == [3, 6, 9, 12, 15, 18]
+    assert [t.id for t in db.posted_tweets.between(1005, 1008)] == [5, 6, 7]
+    assert list(db.learn_queue) == ["phrase 0", "inserted", *[f"phrase {n}" for n in range(1, 9)]]
+    # Appending goes on in the last segment
+    db.posted_tweets.append(make_tweets(1, start=21)[0])
+    db.close()
+
+    db = open_db(tmp_path, segment_size=512)
+    assert [t.id for t in db.posted_tweets][-2:] == [20, 21]
+    db.close()
+
+
+def test_compaction(tmp_path):
+    db = open_db(tmp_path, segment_size=1024, compact_ratio=0.5)
+    db.posted_tweets.extend(make_tweets(30))
+    db.learn_queue.extend([f"phrase {n}" for n in range(30)])
+    for id in range(1, 31):
+        db.posted_tweets.get_by_id(id).is_processed = True
+    db.posted_tweets.remove_older_than(1025)
+    del db.learn_queue[:25]
+    for key in ("posted_tweets", "learn_queue"):
+        assert db._lists[key].garbage > 0.5
+    sizes = {key: db._get_log(key).size for key in ("posted_tweets", "learn_queue")}
+    db.sync()
+    for key in ("posted_tweets", "learn_queue"):
+        assert db._lists[key].garbage == 0.0
+        assert db._get_log(key).size < sizes[key] / 2
+        assert not os.path.exists(db._get_log(key).path + ".new")
+    assert [t.id for t in db.posted_tweets] == [25, 26, 27, 28, 29, 30]
+    # Items are still readable after the rewrite, and so is the log after
+    # appending to it
+    assert db.posted_tweets.get_by_id(27).is_processed
+    db.learn_queue.append("new")
+    db.close()
+
+    db = open_db(tmp_path, segment_size=1024)
+    assert [t.id for t in db.posted_tweets.processed] == [25, 26, 27, 28, 29, 30]
+    assert list(db.learn_queue) == [f"phrase {n}" for n in range(25, 30)] + ["new"]
+    db.close()
+
+
+def test_truncated_tail(tmp_path):
+    db = open_db(tmp_path)
+    db.posted_tweets.extend(make_tweets(3))
+    db.learn_queue.extend(["a", "b"])
+    path = last_segment(db, "posted_tweets")
+    db.close()
+    # Cut the last record short, in the middle of its body
+    size = os.path.getsize(path)
+    with open(path, "r+b") as f:
+        f.truncate(size - 5)
+
+    db = open_db(tmp_path)
+    assert [t.id for t in db.posted_tweets] == [1, 2]
+    assert list(db.learn_queue) == ["a", "b"]
+    # The remains of the record are gone, so new ones are readable
+    assert os.path.getsize(path) < size - 5
+    db.posted_tweets.append(make_tweets(1, start=3)[0])
+    db.close()
+
+    db = open_db(tmp_path)
+    assert [t.id for t in db.posted_tweets] == [1, 2, 3]
+    db.close()
+
+
+def test_corrupt_tail(tmp_path):
+    db = open_db(tmp_path)
+    db.learn_queue.extend(["a", "b"])
+    path = last_segment(db, "learn_queue")
+    db.close()
+    size = os.path.getsize(path)
+    # A whole header's worth of garbage, then half a header
+    with open(path, "ab") as f:
+        f.write(b"\xff" * LOG_HEADER.size)
+        f.write(b"\x01" * (LOG_HEADER.size // 2))
+
+    db = open_db(tmp_path)
+    assert list(db.learn_queue) == ["a", "b"]
+    assert os.path.getsize(path) == size
+    db.learn_queue.append("c")
+    db.close()
+
+    db = open_db(tmp_path)
+    assert list(db.learn_queue) == ["a", "b", "c"]
+    db.close()
+
+
+if __name__ == "__main__":
+    import tempfile
+    from pathlib import Path
+
+    for test in (test_reopen_after_rollover, test_compaction, test_truncated_tail, test_corrupt_tail):
+        with tempfile.TemporaryDirectory() as tmp:
+            test(Path(tmp))
+    print("OK")
@@ -0,0 +1,138 @@
+"""Tests for BaseDatabase.migrate_to()
+
+Covers migrating a ShelveDatabase to each of the other backends (Redis
+through fakeredis) in batches, resuming an interrupted migration from its
+checkpoint file, and the verification catching keys that weren't copied.
+Run with:
+python -m pytest tests/test_migration.py
+"""
+import json
+import os
+from email.utils import formatdate
+
+import fakeredis
+import pytest
+
+from twitterhal import database
+from twitterhal.database import LogDatabase, RedisDatabase, ShelveDatabase, SQLiteDatabase
+from twitterhal.models import Tweet, TweetList
+
+
+def make_tweets(count, start=1):
+    return [
+        Tweet(id=id, text=f"tweet number {id}", created_at=formatdate(1000 + id),
+              in_reply_to_status_id=id - 1 if id % 3 == 0 else None)
+        for id in range(start, start + count)
+    ]
+
+
+def add_keys(db):
+    db.add_key("mentions", TweetList, unique=True)
+    db.add_key("learn_queue", list)
+    db.add_key("last_run", int, default=0)
+    db.add_key("posted_tweets", TweetList, unique=True)
+    return db
+
+
+def make_source(path):
+    db = add_keys(ShelveDatabase(db_path=str(path)))
+    db.open()
+    db.posted_tweets.extend(make_tweets(25))
+    db.mentions.extend(make_tweets(5, start=100))
+    db.mentions.get_by_id(101).is_answered = True
+    db.learn_queue.extend(["a", "b", "c"])
+    db.last_run = 123
+    db.close()
+    return add_keys(ShelveDatabase(db_path=str(path)))
+
+
+def make_targets(path):
+    pool = fakeredis.FakeRedis(server=fakeredis.FakeServer()).connection_pool
+    return {
+        "sqlite": add_keys(SQLiteDatabase(db_path=str(path / "db.sqlite3"))),
+        "log": add_keys(LogDatabase(db_path=str(path / "db.log"))),
+        "redis": add_keys(RedisDatabase(namespace="test", connection_pool=pool, tweet_store=True, bgsave=())),
+    }
+
+
+def check_migrated(db):
+    assert [t.id for t in db.posted_tweets] == list(range(1, 26))
+    assert [t.id for t in db.posted_tweets.replies] == list(range(3, 26, 3))
+    assert [t.id for t in db.mentions.answered] == [101]
+    assert list(db.learn_queue) == ["a", "b", "c"]
+    assert db.last_run == 123
+
+
+def test_migrate_to(tmp_path):
+    for name, target in make_targets(tmp_path).items():
+        source = make_source(tmp_path / f"{name}.db")
+        calls = []
+        # Leftovers are replaced
+        target.open()
+        target.learn_queue.append("old")
+        counts = source.migrate_to(target, batch_size=10, progress=lambda *args: calls.append(args))
+        assert counts == {"mentions": 5, "learn_queue": 3, "last_run": 1, "posted_tweets": 25}
+        assert [c for c in calls if c[0] == "posted_tweets"] == [
+            ("posted_tweets", 10, 25), ("posted_tweets", 20, 25), ("posted_tweets", 25, 25),
+        ]
+        assert ("last_run", 1, 1) in calls
+        # Left open, as it was
+        check_migrated(target)
+        if name != "redis":
+            target.close()
+            target.open()
+            check_migrated(target)
+            target.close()
+
+
+def test_resume(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "MIGRATION_CHECKPOINT_SECONDS", 0)
+    source = make_source(tmp_path / "source.db")
+    target = make_targets(tmp_path)["sqlite"]
+    checkpoint_path = str(tmp_path / "migration.json")
+
+    def interrupt(key, copied, total):
+        if key == "posted_tweets" and copied == 20:
+            raise KeyboardInterrupt()
+
+    with pytest.raises(KeyboardInterrupt):
+        source.migrate_to(target, batch_size=10, checkpoint_path=checkpoint_path, progress=interrupt)
+    assert not source._is_open and not target._is_open
+    # The second batch was copied, but not checkpointed
+    with open(checkpoint_path) as f:
+        state = json.load(f)
+    assert state["posted_tweets"] == {"done": False, "copied": 10, "length": 10}
+    target.open()
+    assert len(target.posted_tweets) == 20
+    target.close()
+
+    calls = []
+    source.migrate_to(target, 10, checkpoint_path, progress=lambda *args: calls.append(args))
+    # Keys that were done are skipped, the rest continued
+    assert calls == [("posted_tweets", 20, 25), ("posted_tweets", 25, 25)]
+    assert not os.path.exists(checkpoint_path)
+    target.open()
+    check_migrated(target)
+    target.close()
+
+
+def test_verify(tmp_path):
+    source = make_source(tmp_path / "source.db")
+    target = make_targets(tmp_path)["log"]
+    checkpoint_path = str(tmp_path / "migration.json")
+    # Says a key is done that isn't
+    with open(checkpoint_path, "w") as f:
+        json.dump({"mentions": {"done": True, "copied": 5, "length": 5}}, f)
+    with pytest.raises(ValueError, match="'mentions'"):
+        source.migrate_to(target, checkpoint_path=checkpoint_path)
+    assert os.path.exists(checkpoint_path)
+
+
+if __name__ == "__main__":
+    import tempfile
+    from pathlib import Path
+
+    for test in (test_migrate_to, test_verify):
+        with tempfile.TemporaryDirectory() as tmp:
+            test(Path(tmp))
+    print("OK")
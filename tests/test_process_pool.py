@@ -0,0 +1,65 @@
+"""Tests for generation.ProcessPoolGenerator, with the installed megahal
+
+Covers workers generating from copies of the brain, which don't see what the
+main process learns until refresh(), and leave the main process's brain
+alone. Run with:
+python -m pytest tests/test_process_pool.py
+"""
+import os
+
+import megahal
+import pytest
+
+from twitterhal.generation import (
+    ConcurrentMegaHAL, create_megahal, process_pool_supported, ProcessPoolGenerator,
+)
+
+
+PHRASE = "the quick brown fox jumps over the lazy dog"
+
+
+@pytest.mark.skipif(not process_pool_supported(), reason="requires megahal < 0.4.0")
+def test_brain_copies(tmp_path):
+    kwargs = {"brainfile": str(tmp_path / "brain"), "timeout": 0.1}
+    brain = ConcurrentMegaHAL(create_megahal(**kwargs))
+    generator = ProcessPoolGenerator(2, brain, **kwargs)
+    tmpdir = generator._tmpdir
+    try:
+        # Nothing learned yet
+        assert generator.get_reply_nolearn("fox") == ""
+        brain.learn_many([PHRASE])
+        assert generator.get_reply_nolearn("fox") == ""
+        generator.refresh(brain)
+        assert generator.learned_count == 1
+        # The old workers' copies are gone
+        assert not os.path.exists(tmpdir)
+        replies = [f.result() for f in [generator.submit("fox") for _ in range(4)]]
+        assert all("fox" in reply.lower() for reply in replies), replies
+        # Workers don't get in the way of the main process learning
+        brain.learn_many(["a completely different sentence about cheese"])
+        assert "cheese" in brain.get_reply_nolearn("cheese").text.lower()
+        tmpdir = generator._tmpdir
+    finally:
+        generator.close()
+        brain.close()
+    assert not os.path.exists(tmpdir)
+
+    brain = create_megahal(**kwargs)
+    assert "cheese" in brain.get_reply_nolearn("cheese").text.lower()
+    brain.close()
+
+
+def test_unsupported(monkeypatch):
+    monkeypatch.setattr(megahal, "VERSION", (0, 4, 0), raising=False)
+    assert not process_pool_supported()
+    with pytest.raises(ValueError):
+        ProcessPoolGenerator(2)
+
+
+if __name__ == "__main__":
+    import tempfile
+    from pathlib import Path
+
+    with tempfile.TemporaryDirectory() as tmp:
+        test_brain_copies(Path(tmp))
+    print("OK")
@@ -1,32 +1,264 @@
-import shelve
-
-from redis import Redis
-
-# from twitterhal.conf import settings
-from twitterhal.models import RedisList
-
-
-r = Redis()
-db = shelve.open("twitterhal")
-tweets = db["posted_tweets"]
-tweets = RedisList.wrap(tweets, r, "posted_tweets")
-print(tweets)
-
-
-# lst = RedisList(r, "testlist", settings.RANDOM_POST_TIMES)
-lst = RedisList(r, "testlist")
-print(lst)
-print(len(lst))
-item = lst[-1]
-del lst[1]
-print(lst)
-print(len(lst))
-lst.append("hej")
-print(lst)
-lst.insert(1, "nytt värde på pos 1")
-print(lst.pop())
-print(lst)
-lst += lst
-print(lst)
-lst *= 2
-print(lst)
+"""Tests for database.RedisList, run against fakeredis
+
+Covers the version counter every mutation increments, the local cache that
+counter keeps valid, two RedisLists (as in two processes) sharing one key,
+the Lua scripts that do insert(), pop(), deletion and slicing on the server
+(checked against a plain list), and batch(). Also covers RedisTweetStore:
+its indexes, migration from a RedisList, and two TweetLists sharing one.
+Run with:
+python -m pytest tests/test_redis.py
+"""
+from email.utils import formatdate
+
+import fakeredis
+import pytest
+from redis.exceptions import ResponseError
+
+from twitterhal.database import RedisDatabase, RedisList, RedisTweetStore
+from twitterhal.models import Tweet, TweetList
+
+
+def make_redis():
+    return fakeredis.FakeRedis(server=fakeredis.FakeServer())
+
+
+def count_fetches(redis_list):
+    """Make redis_list count how many times it fetches all its items"""
+    fetch = redis_list._fetch
+    redis_list.fetches = 0
+
+    def counting_fetch():
+        redis_list.fetches += 1
+        return fetch()
+
+    redis_list._fetch = counting_fetch
+
+
+def test_version():
+    lst = RedisList(make_redis(), "test")
+    assert lst.version() == 0
+    lst.append("a")
+    lst.extend(["b", "c"])
+    lst.insert(0, "z")
+    lst[1] = "A"
+    del lst[1]
+    lst.pop()
+    assert lst.version() == 6
+    assert list(lst) == ["z", "b"]
+    lst.clear()
+    assert lst.version() == 7
+    assert lst.version() == int(lst.redis.get("test:version"))
+
+
+def test_cache():
+    lst = RedisList(make_redis(), "test", initlist=["a", "b", "c"], overwrite=True, cache=True)
+    count_fetches(lst)
+    assert list(lst) == ["a", "b", "c"]
+    assert lst[1] == "b" and len(lst) == 3 and "c" in lst
+    assert lst.fetches == 1
+    # Own mutations are applied to the cache, without fetching again
+    lst.append("d")
+    lst.insert(1, "x")
+    del lst[0]
+    lst[0] = "y"
+    assert lst.pop() == "d"
+    assert list(lst) == ["y", "b", "c"]
+    assert lst.fetches == 1
+    assert lst._cache_version == lst.version()
+    # Reads return the same objects every time, like a list would
+    lst.append({"key": "value"})
+    assert lst[-1] is lst[-1]
+
+
+def test_cache_without_update():
+    lst = RedisList(make_redis(), "test", initlist=["a", "b", "a"], overwrite=True, cache=True)
+    count_fetches(lst)
+    list(lst)
+    # remove() has no cache update, so the cache is dropped
+    lst.remove("a")
+    assert list(lst) == ["b", "a"]
+    assert lst.fetches == 2
+
+
+def test_two_instances():
+    redis = make_redis()
+    for cache in (False, True):
+        redis.flushall()
+        a = RedisList(redis, "test", initlist=["a", "b"], overwrite=True, cache=cache)
+        b = RedisList(redis, "test", cache=cache)
+        a.track_version()
+        assert list(b) == ["a", "b"]
+        b.append("c")
+        assert a.is_stale()
+        assert list(a) == ["a", "b", "c"]
+        a.track_version()
+        # Our own mutations don't make it stale
+        a.append("d")
+        a.insert(0, "z")
+        assert not a.is_stale()
+        assert list(b) == ["z", "a", "b", "c", "d"]
+        # Nor does one by someone else slip by between two of ours
+        b.pop(0)
+        a.append("e")
+        assert a.is_stale()
+        assert list(a) == list(b) == ["a", "b", "c", "d", "e"]
+
+
+def test_scripts():
+    slices = [
+        slice(None), slice(2, None), slice(None, -3), slice(1, 8, 2), slice(None, None, -1), slice(-2, 1, -3),
+        slice(20, 30), slice(None, None, 4),
+    ]
+    for cache in (False, True):
+        redis = make_redis()
+        for i in slices:
+            expected = list(range(10))
+            lst = RedisList(redis, "test", initlist=expected, overwrite=True, cache=cache)
+            assert lst[i] == expected[i]
+            del lst[i]
+            del expected[i]
+            assert list(lst) == expected
+        expected = list(range(10))
+        lst = RedisList(redis, "test", initlist=expected, overwrite=True, cache=cache)
+        for i in (0, 3, -1, -4, 20, -20):
+            lst.insert(i, "x")
+            expected.insert(i, "x")
+        assert list(lst) == expected
+        for i in (0, -1, 4, -3):
+            assert lst.pop(i) == expected.pop(i)
+            del lst[i]
+            del expected[i]
+        assert list(lst) == expected
+        lst *= 3
+        expected *= 3
+        assert list(lst) == expected
+        for i in (len(expected), -len(expected) - 1):
+            with pytest.raises(IndexError):
+                lst.pop(i)
+            with pytest.raises(IndexError):
+                del lst[i]
+        lst *= 0
+        assert list(lst) == []
+        with pytest.raises(IndexError):
+            lst.pop()
+        assert lst.version() == int(redis.get("test:version"))
+
+
+def test_batch():
+    for cache in (False, True):
+        lst = RedisList(make_redis(), "test", initlist=["a", "b", "c"], overwrite=True, cache=cache)
+        version = lst.version()
+        with lst.batch():
+            lst.append("d")
+            with lst.batch():
+                lst.insert(0, "z")
+            del lst[1]
+            # Not executed yet
+            assert list(lst) == ["a", "b", "c"]
+        assert list(lst) == ["z", "b", "c", "d"]
+        assert lst.version() == version + 3
+        # pop() needs its result, so it executes what's queued first
+        with lst.batch():
+            lst.append("e")
+            assert lst.pop(0) == "z"
+        assert list(lst) == ["b", "c", "d", "e"]
+        # Discarded if the block raises
+        with pytest.raises(KeyError):
+            with lst.batch():
+                lst.clear()
+                raise KeyError()
+        assert list(lst) == ["b", "c", "d", "e"]
+        # The first error is raised, but the rest is executed anyway
+        with pytest.raises(ResponseError):
+            with lst.batch():
+                lst[10] = "x"
+                lst.append("f")
+        assert list(lst) == ["b", "c", "d", "e", "f"]
+
+
+def make_tweets(count, start=1):
+    return [
+        Tweet(id=id, text=f"tweet number {id}", created_at=formatdate(1000 + id),
+              in_reply_to_status_id=id - 1 if id % 3 == 0 else None)
+        for id in range(start, start + count)
+    ]
+
+
+def test_tweet_store():
+    redis = make_redis()
+    for cache in (False, True):
+        redis.flushall()
+        store = RedisTweetStore(redis, "tweets", initlist=make_tweets(5), overwrite=True, cache=cache)
+        # Stored IDs are skipped
+        store.extend(make_tweets(3, start=4))
+        store.insert(0, make_tweets(1, start=2)[0])
+        store.insert(0, Tweet(id=0, text="first", created_at=formatdate(1010)))
+        assert [t.id for t in store] == [0, 1, 2, 3, 4, 5, 6]
+        with pytest.raises(ValueError):
+            store[1] = make_tweets(1, start=5)[0]
+        store[1] = Tweet(id=10, text="replaced", created_at=formatdate(999))
+        assert not store.contains_id(1) and store.contains_id(10)
+        assert store.pop().id == 6
+        store.remove(Tweet(id=2))
+        with pytest.raises(ValueError):
+            store.remove(Tweet(id=2))
+        assert [t.id for t in store] == [0, 10, 3, 4, 5]
+        assert [t.id for t in store.get_many([5, 99, 0])] == [5, 0]
+        assert [t.id for t in store.between(1000, 1005)] == [3, 4]
+        assert (store.earliest_ts(), store.latest_ts()) == (999, 1010)
+        assert [t.id for t in store.flagged("reply")] == [3]
+        record = store.get_by_id(4)
+        record.is_answered = True
+        assert store.update_item(record)
+        assert not store.update_item(Tweet(id=99))
+        assert [t.id for t in store.flagged("answered")] == [4]
+        assert [t.id for t in store.flagged("answered", False)] == [0, 10, 3, 5]
+        assert store.remove_older_than(1004) == 2
+        assert [t.id for t in store] == [0, 4, 5]
+        # Deleted IDs are gone from every index
+        assert not store.flagged("reply") and store.earliest_ts() == 1004
+        assert store.version() == int(redis.get("tweets:version"))
+
+
+def test_tweet_store_migration():
+    redis = make_redis()
+    tweets = make_tweets(3)
+    RedisList(redis, "posted_tweets", initlist=tweets + tweets[:1], overwrite=True)
+    store = RedisTweetStore(redis, "posted_tweets")
+    assert [t.id for t in store] == [1, 2, 3]
+    assert redis.type("posted_tweets:list-backup") == b"list"
+    assert not redis.exists("posted_tweets")
+    assert [t.id for t in store.flagged("reply")] == [3]
+
+
+def test_tweet_store_two_instances():
+    pool = make_redis().connection_pool
+    a, b = [RedisDatabase(namespace="test", connection_pool=pool, tweet_store=True) for _ in range(2)]
+    for db in (a, b):
+        db.add_key("posted_tweets", TweetList, unique=True)
+        db.open()
+    a.posted_tweets.extend(make_tweets(3))
+    assert isinstance(b.posted_tweets.data, RedisTweetStore)
+    # The same ID can't be added twice, whoever adds it
+    b.posted_tweets.extend(make_tweets(4, start=2))
+    a.posted_tweets.append(make_tweets(1, start=5)[0])
+    assert [t.id for t in a.posted_tweets] == [t.id for t in b.posted_tweets] == [1, 2, 3, 4, 5]
+    a.posted_tweets.get_by_id(2).is_processed = True
+    assert [t.id for t in b.posted_tweets.processed] == [2]
+    assert b.posted_tweets.get_by_id(2).is_processed
+    del b.posted_tweets[0]
+    assert Tweet(id=1) not in a.posted_tweets
+    assert a.posted_tweets.earliest_ts == 1002
+
+
+if __name__ == "__main__":
+    test_version()
+    test_cache()
+    test_cache_without_update()
+    test_two_instances()
+    test_scripts()
+    test_batch()
+    test_tweet_store()
+    test_tweet_store_migration()
+    test_tweet_store_two_instances()
+    print("OK")
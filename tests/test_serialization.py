@@ -0,0 +1,159 @@
+"""Tests for twitterhal.serialization
+
+Covers TweetCodec's binary format for TweetRecords and TweetLists (including
+records it has to pickle), zlib compression, values encoded by one codec
+being read by the other, and plain pickles as stored by databases before
+codecs existed. Run with:
+python -m pytest tests/test_serialization.py
+"""
+import os
+import pickle
+import shelve
+from email.utils import formatdate
+
+import pytest
+
+from twitterhal.database import ShelveDatabase
+from twitterhal.models import Tweet, TweetList, TweetRecord
+from twitterhal.serialization import (
+    loads, PickleCodec, TAG_PREFIX, TAG_RECORD, TAG_TWEET_LIST, TAG_ZLIB, TweetCodec,
+)
+
+
+def make_tweets(count, start=1):
+    return [
+        Tweet(id=id, text=f"tweet number {id}", created_at=formatdate(1000 + id),
+              in_reply_to_status_id=id - 1 if id % 3 == 0 else None)
+        for id in range(start, start + count)
+    ]
+
+
+def fields(record):
+    """All of a TweetRecord's fields, as pickled"""
+    return record.__reduce__()[1]
+
+
+def test_record_round_trip():
+    codec = TweetCodec()
+    records = [
+        TweetRecord(),
+        TweetRecord(id=1, text="hello", is_answered=True),
+        TweetRecord(
+            id=2 ** 63 - 1, text="Ünïcödé 🧀 tweet", filtered_text="unicode tweet", user_id=42,
+            user_screen_name="someone", in_reply_to_status_id=-5, created_at_in_seconds=0, is_processed=True,
+        ),
+    ]
+    for record in records:
+        data = codec.dumps(record)
+        assert data[:2] == TAG_PREFIX + TAG_RECORD
+        assert fields(codec.loads(data)) == fields(record)
+        # Way smaller than a pickle
+        assert len(data) < len(pickle.dumps(record)) - 40
+    # Types the format doesn't cover are pickled
+    record = TweetRecord(id=3, created_at_in_seconds=1000.5)
+    data = codec.dumps(record)
+    assert data[:1] != TAG_PREFIX
+    assert fields(codec.loads(data)) == fields(record)
+
+
+def test_tweet_list_round_trip():
+    codec = TweetCodec()
+    for unique in (False, True):
+        tweets = TweetList(make_tweets(5), unique=unique)
+        tweets[1].is_answered = True
+        # Pickled inside the list
+        tweets.append(TweetRecord(id=10, created_at_in_seconds=1010.5))
+        data = codec.dumps(tweets)
+        assert data[:2] == TAG_PREFIX + TAG_TWEET_LIST
+        decoded = codec.loads(data)
+        assert (decoded.unique, decoded.compact) == (unique, True)
+        assert [fields(t) for t in decoded] == [fields(t) for t in tweets]
+        assert [t.id for t in decoded.answered] == [2]
+    # Non-compact lists of Tweets are pickled
+    tweets = TweetList(make_tweets(3), unique=True, compact=False)
+    decoded = codec.loads(codec.dumps(tweets))
+    assert not decoded.compact and all(isinstance(t, Tweet) for t in decoded)
+    assert [t.id for t in decoded.replies] == [3]
+
+
+def test_compression():
+    for codec_class in (PickleCodec, TweetCodec):
+        codec = codec_class(compress_level=6)
+        tweets = TweetList(make_tweets(100))
+        data = codec.dumps(tweets)
+        assert data[:2] == TAG_PREFIX + TAG_ZLIB
+        assert len(data) < len(codec.encode(tweets)) / 2
+        assert [fields(t) for t in codec.loads(data)] == [fields(t) for t in tweets]
+        # Too small to bother
+        assert codec.dumps("hello") == codec.encode("hello")
+        assert codec.dumps(list(range(1000))) != codec.encode(list(range(1000)))
+        # Nor if it doesn't help
+        noise = os.urandom(1000)
+        assert codec.dumps(noise) == codec.encode(noise)
+
+
+def test_mixed():
+    values = ["hello", {"key": [1, 2]}, TweetRecord(id=1, text="hello"), TweetList(make_tweets(50))]
+    codecs = [PickleCodec(), PickleCodec(compress_level=1), TweetCodec(), TweetCodec(compress_level=9)]
+    for writer in codecs:
+        for value in values:
+            data = writer.dumps(value)
+            for reader in codecs:
+                decoded = reader.loads(data)
+                if isinstance(value, TweetRecord):
+                    assert fields(decoded) == fields(value)
+                elif isinstance(value, TweetList):
+                    assert [fields(t) for t in decoded] == [fields(t) for t in value]
+                else:
+                    assert decoded == value
+    with pytest.raises(ValueError):
+        loads(TAG_PREFIX + b"?\x01")
+    with pytest.raises(ValueError):
+        loads(TAG_PREFIX + TAG_RECORD + b"\x7f")
+
+
+def test_plain_pickles(tmp_path):
+    tweets = TweetList(make_tweets(3), unique=True, compact=False)
+    tweets[0].is_answered = True
+    for protocol in range(2, pickle.HIGHEST_PROTOCOL + 1):
+        decoded = TweetCodec().loads(pickle.dumps(tweets, protocol=protocol))
+        assert [t.id for t in decoded] == [1, 2, 3]
+        assert [t.id for t in decoded.answered] == [1]
+
+    # As written by ShelveDatabase before codecs existed
+    path = str(tmp_path / "db")
+    with shelve.open(path) as raw:
+        raw["posted_tweets"] = tweets
+        raw["learn_queue"] = ["a", "b"]
+    db = ShelveDatabase(db_path=path, codec=TweetCodec(compress_level=6))
+    db.add_key("posted_tweets", TweetList, unique=True)
+    db.add_key("learn_queue", list)
+    db.open()
+    assert [t.id for t in db.posted_tweets] == [1, 2, 3]
+    assert db.learn_queue == ["a", "b"]
+    db.posted_tweets.append(make_tweets(1, start=4)[0])
+    db.close()
+
+    # Changed values are written in the new format, the others left alone
+    with shelve.open(path) as raw:
+        assert raw.dict[b"posted_tweets"][:1] == TAG_PREFIX
+        assert raw["learn_queue"] == ["a", "b"]
+    db = ShelveDatabase(db_path=path)
+    db.add_key("posted_tweets", TweetList, unique=True)
+    db.open()
+    assert [t.id for t in db.posted_tweets] == [1, 2, 3, 4]
+    assert [t.id for t in db.posted_tweets.answered] == [1]
+    db.close()
+
+
+if __name__ == "__main__":
+    import tempfile
+    from pathlib import Path
+
+    test_record_round_trip()
+    test_tweet_list_round_trip()
+    test_compression()
+    test_mixed()
+    with tempfile.TemporaryDirectory() as tmp:
+        test_plain_pickles(Path(tmp))
+    print("OK")
@@ -0,0 +1,89 @@
+"""Tests for database.ShelveDatabase
+
+Covers pending_changes() counting mutations of plain lists (which are held
+in a ChangeCountingList, but stored as plain lists) as well as TweetLists,
+and sync() writing only what has changed. Run with:
+python -m pytest tests/test_shelve.py
+"""
+import shelve
+from email.utils import formatdate
+
+from twitterhal.database import ChangeCountingList, ShelveDatabase
+from twitterhal.models import Tweet, TweetList
+
+
+def make_tweets(count, start=1):
+    return [
+        Tweet(id=id, text=f"tweet number {id}", created_at=formatdate(1000 + id))
+        for id in range(start, start + count)
+    ]
+
+
+def open_db(path):
+    db = ShelveDatabase(db_path=str(path))
+    db.add_key("posted_tweets", TweetList, unique=True)
+    db.add_key("learn_queue", list)
+    db.add_key("last_run", int, default=0)
+    db.open()
+    return db
+
+
+def test_pending_changes(tmp_path):
+    db = open_db(tmp_path / "db")
+    assert isinstance(db.learn_queue, ChangeCountingList)
+    assert db.pending_changes() == 0
+    queue = db.learn_queue
+    queue.append("a")
+    queue.extend(["b", "c"])
+    queue += ["d"]
+    assert db.is_dirty("learn_queue")
+    db.posted_tweets.extend(make_tweets(2))
+    assert db.pending_changes() == 4
+    db.sync()
+    assert db.pending_changes() == 0
+    assert not db.is_dirty("learn_queue")
+    del db.learn_queue[:2]
+    db.learn_queue.pop(0)
+    assert db.pending_changes() == 2
+    # Set ones are written right away, and held in a ChangeCountingList too
+    db.learn_queue = ["x", "y"]
+    db.last_run = 123
+    assert db.pending_changes() == 0
+    assert isinstance(db.learn_queue, ChangeCountingList)
+    db.learn_queue.append("z")
+    assert db.pending_changes() == 1
+    db.close()
+
+    with shelve.open(str(tmp_path / "db")) as raw:
+        assert type(raw["learn_queue"]) is list
+        assert raw["learn_queue"] == ["x", "y", "z"]
+
+    db = open_db(tmp_path / "db")
+    assert db.learn_queue == ["x", "y", "z"]
+    assert [t.id for t in db.posted_tweets] == [1, 2]
+    assert db.last_run == 123
+    db.close()
+
+
+def test_sync_writes_changed(tmp_path):
+    db = open_db(tmp_path / "db")
+    db.learn_queue.append("a")
+    db.sync()
+    assert db.sync_stats["keys"] == 1
+    # Unchanged lists aren't written again
+    db.sync()
+    assert db.sync_stats["keys"] == 0
+    db.learn_queue.sort()
+    db.sync()
+    assert db.sync_stats["keys"] == 1
+    db.close()
+
+
+if __name__ == "__main__":
+    import tempfile
+    from pathlib import Path
+
+    for test in (test_pending_changes, test_sync_writes_changed):
+        with tempfile.TemporaryDirectory() as tmp:
+            test(Path(tmp))
+    print("OK")
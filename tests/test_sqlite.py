@@ -0,0 +1,132 @@
+"""Tests for database.SQLiteDatabase, SQLiteList and SQLiteTweetStore
+
+Covers the tweet columns SQLiteTweetStore keeps, migrating rows written by
+a plain SQLiteList with fill_columns(), flag changes written back with
+update_item(), the timestamp queries, and reopening the database. Run with:
+python -m pytest tests/test_sqlite.py
+"""
+import sqlite3
+from email.utils import formatdate
+
+from twitterhal.database import SQLiteDatabase, SQLiteList, SQLiteTweetStore
+from twitterhal.models import Tweet, TweetList
+
+
+def make_tweets(count, start=1):
+    return [
+        Tweet(id=id, text=f"tweet number {id}", created_at=formatdate(1000 + id),
+              in_reply_to_status_id=id - 1 if id % 3 == 0 else None)
+        for id in range(start, start + count)
+    ]
+
+
+def open_db(path):
+    db = SQLiteDatabase(db_path=str(path))
+    db.add_key("posted_tweets", TweetList, unique=True)
+    db.add_key("learn_queue", list)
+    db.add_key("last_run", int, default=0)
+    db.open()
+    return db
+
+
+def test_tweet_columns(tmp_path):
+    db = open_db(tmp_path / "db.sqlite3")
+    assert isinstance(db.posted_tweets.data, SQLiteTweetStore)
+    assert isinstance(db.learn_queue, SQLiteList)
+    db.posted_tweets.extend(make_tweets(3))
+    # Already stored
+    db.posted_tweets.append(make_tweets(1, start=2)[0])
+    db.learn_queue.append("hello")
+    rows = db._connection.execute(
+        "SELECT key, id, created_at, in_reply_to_status_id, flag_answered, flag_processed, flag_reply "
+        "FROM list_items ORDER BY key, position").fetchall()
+    assert rows == [
+        ("learn_queue", None, None, None, None, None, None),
+        ("posted_tweets", 1, 1001.0, None, 0, 0, 0),
+        ("posted_tweets", 2, 1002.0, None, 0, 0, 0),
+        ("posted_tweets", 3, 1003.0, 2, 0, 0, 1),
+    ]
+    db.close()
+
+
+def test_fill_columns(tmp_path):
+    path = str(tmp_path / "db.sqlite3")
+    connection = sqlite3.connect(path, isolation_level=None)
+    SQLiteList.create_tables(connection)
+    # As stored by a plain SQLiteList, duplicate included
+    tweets = make_tweets(3)
+    SQLiteList(connection, "posted_tweets", initlist=tweets + tweets[:1], overwrite=True)
+    assert connection.execute("SELECT COUNT(*) FROM list_items WHERE id IS NULL").fetchone()[0] == 4
+    connection.close()
+
+    db = open_db(path)
+    assert [t.id for t in db.posted_tweets] == [1, 2, 3]
+    assert db._connection.execute("SELECT COUNT(*) FROM list_items WHERE id IS NULL").fetchone()[0] == 0
+    assert db.posted_tweets.get_by_id(3).in_reply_to_status_id == 2
+    assert [t.id for t in db.posted_tweets.replies] == [3]
+    db.close()
+
+
+def test_flags(tmp_path):
+    path = tmp_path / "db.sqlite3"
+    db = open_db(path)
+    db.posted_tweets.extend(make_tweets(4))
+    db.posted_tweets.get_by_id(2).is_answered = True
+    assert not db.posted_tweets.data.update_item(Tweet(id=99, text="not stored"))
+    assert [t.id for t in db.posted_tweets.answered] == [2]
+    db.close()
+
+    db = open_db(path)
+    assert [t.id for t in db.posted_tweets.answered] == [2]
+    assert [t.id for t in db.posted_tweets.unanswered] == [1, 3, 4]
+    db.close()
+
+
+def test_between_and_remove_older_than(tmp_path):
+    db = open_db(tmp_path / "db.sqlite3")
+    tweets = db.posted_tweets
+    tweets.extend(make_tweets(5, start=3))
+    # Out of order, and with the same timestamp as another
+    tweets.extend([
+        Tweet(id=2, text="early", created_at=formatdate(1002)),
+        Tweet(id=1, text="same time", created_at=formatdate(1004)),
+    ])
+    assert [t.id for t in tweets.between(1003, 1006)] == [3, 1, 4, 5]
+    assert [t.id for t in tweets.since(1006)] == [6, 7]
+    assert (tweets.earliest_ts, tweets.latest_ts) == (1002, 1007)
+    assert tweets.remove_older_than(1004) == 2
+    assert [t.id for t in tweets] == [4, 5, 6, 7, 1]
+    assert tweets.remove_older_than(1004) == 0
+    db.close()
+
+
+def test_reopen(tmp_path):
+    path = tmp_path / "db.sqlite3"
+    db = open_db(path)
+    db.posted_tweets.extend(make_tweets(3))
+    db.learn_queue.extend(["a", "b", "c"])
+    del db.learn_queue[1]
+    db.last_run = 123
+    db.close()
+
+    db = open_db(path)
+    assert [t.id for t in db.posted_tweets] == [1, 2, 3]
+    assert Tweet(id=2) in db.posted_tweets
+    assert list(db.learn_queue) == ["a", "c"]
+    assert db.last_run == 123
+    db.posted_tweets.append(make_tweets(1, start=4)[0])
+    db.close()
+
+    db = open_db(path)
+    assert [t.id for t in db.posted_tweets] == [1, 2, 3, 4]
+    db.close()
+
+
+if __name__ == "__main__":
+    import tempfile
+    from pathlib import Path
+
+    for test in (test_tweet_columns, test_fill_columns, test_flags, test_between_and_remove_older_than, test_reopen):
+        with tempfile.TemporaryDirectory() as tmp:
+            test(Path(tmp))
+    print("OK")
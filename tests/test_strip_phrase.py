@@ -0,0 +1,33 @@
+"""Checks util.strip_phrase() and util.strip_phrases() against a golden corpus
+
+The corpus (strip_phrase_corpus.json) is a list of [input, expected output]
+pairs, generated by the original, unoptimized strip_phrase(). Run with:
+python tests/test_strip_phrase.py
+"""
+import json
+import os
+
+from twitterhal.util import strip_phrase, strip_phrases
+
+
+with open(os.path.join(os.path.dirname(__file__), "strip_phrase_corpus.json"), encoding="utf-8") as f:
+    CORPUS = json.load(f)
+
+
+def test_strip_phrase():
+    for phrase, expected in CORPUS:
+        assert strip_phrase(phrase) == expected, f"strip_phrase({phrase!r}) != {expected!r}"
+
+
+def test_strip_phrases():
+    phrases = [phrase for phrase, _ in CORPUS]
+    expected = [expected for _, expected in CORPUS]
+    assert strip_phrases(phrases) == expected
+    # Generators and duplicates are fine too
+    assert strip_phrases(p for p in phrases + phrases) == expected + expected
+
+
+if __name__ == "__main__":
+    test_strip_phrase()
+    test_strip_phrases()
+    print(f"OK, {len(CORPUS)} phrases")
@@ -0,0 +1,213 @@
+"""Checks models.TweetList's indexes against what a plain scan gives
+
+Covers the status ID index (including the offset remove_older_than() keeps
+for removals at the start of the list), the flag sets and cached views, the
+Timeline, lists backed by a RedisList that someone else changes or that
+items are removed from by value, the fuzzy index of lists backed by tweet
+stores, and searching the fuzzy index while another thread adds to it. Run
+with:
+python -m pytest tests/test_tweetlist.py
+"""
+import threading
+from email.utils import formatdate
+
+import fakeredis
+import pytest
+
+from twitterhal.database import LogDatabase, RedisDatabase, SQLiteDatabase
+from twitterhal.models import FuzzyIndex, Tweet, TweetList
+
+
+def make_tweets(count, start=1):
+    return [
+        Tweet(id=id, text=f"tweet number {id}", created_at=formatdate(1000 + id),
+              in_reply_to_status_id=id - 1 if id % 3 == 0 else None)
+        for id in range(start, start + count)
+    ]
+
+
+def check_indexes(tweets):
+    """Assert that the indexes of a unique TweetList match its contents"""
+    for pos, tweet in enumerate(tweets.data):
+        if tweets._store is None:
+            assert tweets._position(tweet.id) == pos
+        assert tweets.get_by_id(tweet.id).id == tweet.id
+        assert tweet in tweets
+    if tweets._store is None:
+        assert len(tweets._index) == len(tweets.data)
+    assert [t.id for t in tweets.unanswered] == [t.id for t in tweets.data if not t.is_answered]
+    assert [t.id for t in tweets.answered] == [t.id for t in tweets.data if t.is_answered]
+    assert [t.id for t in tweets.replies] == [t.id for t in tweets.data if t.in_reply_to_status_id]
+    assert [t.id for t in tweets.original_posts] == [t.id for t in tweets.data if not t.in_reply_to_status_id]
+    timestamps = [t.created_at_in_seconds for t in tweets.data]
+    assert tweets.earliest_ts == min(timestamps, default=0)
+    assert tweets.latest_ts == max(timestamps, default=0)
+
+
+def test_unique():
+    tweets = TweetList(make_tweets(10), unique=True)
+    tweets.append(make_tweets(1, start=5)[0])
+    tweets.extend(make_tweets(5, start=8))
+    assert [t.id for t in tweets] == list(range(1, 13))
+    assert tweets.get_by_id(99) is None
+    check_indexes(tweets)
+    tweets.insert(0, Tweet(id=0, text="first", created_at=formatdate(1000)))
+    tweets.pop()
+    tweets.pop(3)
+    del tweets[2:4]
+    check_indexes(tweets)
+
+
+def test_flags_and_views():
+    originals = make_tweets(6)
+    tweets = TweetList(originals, unique=True)
+    unanswered = tweets.unanswered
+    assert tweets.unanswered is unanswered
+    # Changes to the original Tweets reach the records they are stored as
+    originals[1].is_answered = True
+    assert tweets.unanswered is not unanswered
+    assert tweets.get_by_id(2).is_answered
+    tweets.get_by_id(4).is_answered = True
+    check_indexes(tweets)
+    assert [t.id for t in tweets.answered] == [2, 4]
+
+
+def test_remove_older_than():
+    tweets = TweetList(make_tweets(10), unique=True)
+    # From the start of the list, which only moves the offset
+    assert tweets.remove_older_than(1004) == 3
+    assert tweets._offset == 3
+    check_indexes(tweets)
+    tweets.append(Tweet(id=50, text="old but last", created_at=formatdate(1)))
+    assert tweets.remove_older_than(1005) == 2
+    check_indexes(tweets)
+    assert [t.id for t in tweets.since(1008)] == [8, 9, 10]
+    assert [t.id for t in tweets.between(1006, 1008)] == [6, 7]
+
+
+def redis_db(pool, **kwargs):
+    db = RedisDatabase(namespace="test", connection_pool=pool, **kwargs)
+    db.add_key("posted_tweets", TweetList, unique=True)
+    db.open()
+    return db
+
+
+def test_redis_changed_by_someone_else():
+    pool = fakeredis.FakeRedis(server=fakeredis.FakeServer()).connection_pool
+    for kwargs in ({}, {"cache": False}, {"tweet_store": True}):
+        a, b = redis_db(pool, **kwargs), redis_db(pool, **kwargs)
+        a.posted_tweets.clear()
+        a.posted_tweets.extend(make_tweets(5))
+        check_indexes(a.posted_tweets)
+        assert not a.posted_tweets.fuzzy_duplicates("something else entirely")
+
+        b.posted_tweets.append(Tweet(id=20, text="something else entirely", created_at=formatdate(2000)))
+        assert Tweet(id=20) in a.posted_tweets
+        assert [t.id for t in a.posted_tweets.fuzzy_duplicates("something else entirely")] == [20]
+        assert a.posted_tweets.latest_ts == 2000
+
+        del b.posted_tweets[0]
+        assert a.posted_tweets.get_by_id(1) is None
+        assert a.posted_tweets.get_by_id(5).id == 5
+        b.posted_tweets.get_by_id(3).is_answered = True
+        assert [t.id for t in a.posted_tweets.answered] == [3]
+
+        # Our own changes don't make us rebuild the indexes (with a tweet
+        # store, the flag views above don't use them, so they are only
+        # rebuilt here)
+        assert Tweet(id=3) in a.posted_tweets
+        index = a.posted_tweets._index
+        a.posted_tweets.append(Tweet(id=21, text="ours", created_at=formatdate(2001)))
+        assert Tweet(id=21) in a.posted_tweets
+        assert a.posted_tweets._index is index
+        check_indexes(a.posted_tweets)
+
+
+def test_redis_remove():
+    pool = fakeredis.FakeRedis(server=fakeredis.FakeServer()).connection_pool
+    for kwargs in ({}, {"cache": False}, {"tweet_store": True}):
+        tweets = redis_db(pool, **kwargs).posted_tweets
+        tweets.clear()
+        tweets.extend(make_tweets(5))
+        # A Tweet, where the list stores a TweetRecord
+        tweets.remove(make_tweets(1, start=2)[0])
+        # A record whose encoded form has changed since it was stored
+        record = tweets.get_by_id(4)
+        assert record.filtered_text
+        tweets.remove(record)
+        with pytest.raises(ValueError):
+            tweets.remove(Tweet(id=2))
+        assert [t.id for t in tweets] == [1, 3, 5]
+        check_indexes(tweets)
+
+
+def check_store_fuzzy_duplicates(db):
+    tweets = db.posted_tweets
+    tweets.extend(make_tweets(3))
+    assert not tweets.fuzzy_duplicates("the quick brown fox")
+    # Added after the fuzzy index was built
+    tweets.append(Tweet(id=11, text="the quick brown fox!", created_at=formatdate(1011)))
+    tweets.extend([
+        Tweet(id=10, text="the quick brown fox?", created_at=formatdate(1010)),
+        Tweet(id=12, text="the quick brown fox", created_at=formatdate(1010)),
+    ])
+    # More than one hit, in the store's chronological order
+    assert [t.id for t in tweets.fuzzy_duplicates("the quick brown fox")] == [10, 12, 11]
+    assert tweets.pop().id == 12
+    tweets.remove_older_than(1011)
+    assert [t.id for t in tweets.fuzzy_duplicates("the quick brown fox")] == [11]
+    tweets[0] = Tweet(id=13, text="something else entirely", created_at=formatdate(1013))
+    assert not tweets.fuzzy_duplicates("the quick brown fox")
+
+
+def test_store_fuzzy_duplicates(tmp_path):
+    pool = fakeredis.FakeRedis(server=fakeredis.FakeServer()).connection_pool
+    for db in (
+        SQLiteDatabase(db_path=str(tmp_path / "db.sqlite3")),
+        LogDatabase(db_path=str(tmp_path / "log")),
+        RedisDatabase(namespace="test", connection_pool=pool, tweet_store=True),
+    ):
+        db.add_key("posted_tweets", TweetList, unique=True)
+        db.open()
+        assert db.posted_tweets._store is not None
+        check_store_fuzzy_duplicates(db)
+
+
+def test_fuzzy_index_threads():
+    index = FuzzyIndex()
+    tweets = TweetList(make_tweets(50), unique=True)
+    tweets.fuzzy_duplicates("warm up the index")
+    done = threading.Event()
+    errors = []
+
+    def write():
+        n = 0
+        while not done.is_set():
+            n += 1
+            # Varying lengths, so buckets come and go
+            index.add(n, "x" * (n % 40))
+            index.remove(n - 5)
+            if n < 3000:
+                tweets.append(Tweet(id=1000 + n, text="y" * (n % 40), created_at=formatdate(2000 + n)))
+
+    def read():
+        try:
+            for _ in range(200):
+                index.search("x" * 20)
+                index.max_ratio("x" * 25)
+                tweets.fuzzy_duplicates("y" * 30)
+                tweets.fuzzy_scores(["y" * 10])
+        except Exception as e:
+            errors.append(e)
+
+    writer = threading.Thread(target=write)
+    readers = [threading.Thread(target=read) for _ in range(4)]
+    writer.start()
+    for thread in readers:
+        thread.start()
+    for thread in readers:
+        thread.join()
+    done.set()
+    writer.join()
+    assert not errors, errors[0]
+    assert len(index) == 5
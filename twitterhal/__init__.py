@@ -1,7 +1,21 @@
-from twitterhal.engine import TwitterHAL
+import sys
+from typing import TYPE_CHECKING
 
 
 __version__ = "0.7.3"
 VERSION = tuple(map(int, __version__.split(".")))
 
 __all__ = ["TwitterHAL", "__version__", "VERSION"]
+
+
+if TYPE_CHECKING or sys.version_info < (3, 7):
+    from twitterhal.engine import TwitterHAL
+else:
+    def __getattr__(name):
+        # twitterhal.engine imports megahal, twitter etc, which takes a while.
+        # Only do it when TwitterHAL is actually requested, so that e.g.
+        # `twitterhal --version` doesn't have to wait for it.
+        if name == "TwitterHAL":
+            from twitterhal.engine import TwitterHAL
+            return TwitterHAL
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,9 +1,10 @@
 import argparse
+import importlib
+import json
 import logging
 
 from twitterhal import __version__
 from twitterhal.conf import settings
-from twitterhal.engine import TwitterHAL
 from twitterhal.runtime import runner
 
 
@@ -14,8 +15,11 @@ logger = logging.getLogger("twitterhal")
 
 
 class CommandLine:
-    def __init__(self, twitterhal_class=TwitterHAL, settings_module=None):
+    def __init__(self, twitterhal_class=None, settings_module=None):
+        # If None, twitterhal.engine.TwitterHAL will be imported when needed,
+        # so commands like --version don't have to wait for it
         self.TwitterHAL = twitterhal_class
+        self._hal = None
 
         if settings_module:
             settings.setup(settings_module=settings_module)
@@ -37,6 +41,10 @@ class CommandLine:
         self.parser.add_argument(
             "-t", "--test", action="store_true", help="Test mode; doesn't actually post anything"
         )
+        self.parser.add_argument(
+            "--migrate-options", metavar="JSON", default="{}",
+            help="Options for the --migrate-to database class, as a JSON object"
+        )
 
         self.mutex = self.parser.add_mutually_exclusive_group()
         self.mutex.add_argument("-r", "--run", action="store_true", help="Run the bot!")
@@ -44,6 +52,11 @@ class CommandLine:
         self.mutex.add_argument("--stats", action="store_true", help="Display some stats")
         self.mutex.add_argument("--print-config", action="store_true", help="Print current parsed config")
         self.mutex.add_argument("--post-random", action="store_true", help="Post a new random tweet")
+        self.mutex.add_argument(
+            "--migrate-to", metavar="DATABASE_CLASS",
+            help="Copy the database to a new one of this class (e.g. twitterhal.database.SQLiteDatabase). "
+                 "Resumes if interrupted."
+        )
         self.mutex.add_argument(
             "--version", action="version", version="%(prog)s " + __version__,
             help="Show program's version number and exit"
@@ -51,12 +64,25 @@ class CommandLine:
 
     def __enter__(self):
         self.setup()
-        self.hal = self.TwitterHAL(**self.get_hal_kwargs())
-        self.hal.open()
         return self
 
     def __exit__(self, *args, **kwargs):
-        self.hal.close()
+        if self._hal is not None:
+            self._hal.close()
+
+    @property
+    def hal(self):
+        """TwitterHAL instance, created and opened on first access"""
+        if self._hal is None:
+            self._hal = self.get_twitterhal_class()(**self.get_hal_kwargs())
+            self._hal.open()
+        return self._hal
+
+    def get_twitterhal_class(self):
+        if self.TwitterHAL is None:
+            from twitterhal.engine import TwitterHAL
+            self.TwitterHAL = TwitterHAL
+        return self.TwitterHAL
 
     def setup(self, *args, **kwargs):
         self.args = self.parser.parse_args()
@@ -77,6 +103,8 @@ class CommandLine:
             print(settings)
         elif self.args.post_random:
             self.hal.post_random_tweet()
+        elif self.args.migrate_to:
+            self.migrate()
         elif self.args.run:
             self.hal.prepare_runner()
             runner.sleep_seconds = settings.RUNNER_SLEEP_SECONDS
@@ -91,13 +119,37 @@ class CommandLine:
         """
         return False
 
+    def migrate(self):
+        """Copy the database to a new one of class --migrate-to, with
+        --migrate-options, checkpointing to "twitterhal-migration.json" so
+        an interrupted migration is resumed when run again
+        """
+        mod, klass = self.args.migrate_to.rsplit(".", maxsplit=1)
+        Database = getattr(importlib.import_module(mod), klass)
+        options = json.loads(self.args.migrate_options)
+        codec = settings.get_database_codec()
+        if codec is not None:
+            options["codec"] = codec
+        # Doesn't need the Twitter API, so don't open() it
+        self._hal = self.get_twitterhal_class()(**self.get_hal_kwargs())
+
+        def progress(key, copied, total):
+            logger.info(f"{key}: {copied}/{total}")
+
+        counts = self._hal.migrate_db(
+            Database(**options), checkpoint_path="twitterhal-migration.json", progress=progress)
+        for key, count in counts.items():
+            logger.info(f"{key}: {count} items migrated and verified")
+
     def print_stats(self):
-        print("Posted random tweets:         %d" % len(self.hal.db.posted_tweets.original_posts))
-        print("  - earliest date:            %s" % self.hal.db.posted_tweets.original_posts.earliest_date)
-        print("  - latest date:              %s" % self.hal.db.posted_tweets.original_posts.latest_date)
-        print("Posted reply tweets:          %d" % len(self.hal.db.posted_tweets.replies))
-        print("  - earliest date:            %s" % self.hal.db.posted_tweets.replies.earliest_date)
-        print("  - latest date:              %s" % self.hal.db.posted_tweets.replies.latest_date)
+        original_posts = self.hal.db.posted_tweets.original_posts
+        replies = self.hal.db.posted_tweets.replies
+        print("Posted random tweets:         %d" % len(original_posts))
+        print("  - earliest date:            %s" % original_posts.earliest_date)
+        print("  - latest date:              %s" % original_posts.latest_date)
+        print("Posted reply tweets:          %d" % len(replies))
+        print("  - earliest date:            %s" % replies.earliest_date)
+        print("  - latest date:              %s" % replies.latest_date)
         print("Mentions:                     %d" % len(self.hal.db.mentions))
         print("  - unanswered:               %d" % len(self.hal.db.mentions.unanswered))
 
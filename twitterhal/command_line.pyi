@@ -1,6 +1,6 @@
 from argparse import ArgumentParser, Namespace, _MutuallyExclusiveGroup
 from types import ModuleType
-from typing import Any, Dict, Generic, Type, TypeVar, Union
+from typing import Any, Dict, Generic, Optional, Type, TypeVar, Union
 
 import twitterhal
 
@@ -11,16 +11,21 @@ TH = TypeVar("TH", bound=twitterhal.TwitterHAL)
 def main(): ...
 
 class CommandLine(Generic[TH]):
+    _hal: Optional[TH]
     args: Namespace
-    hal: TH
     mutex: _MutuallyExclusiveGroup
     parser: ArgumentParser
-    TwitterHAL: Type[TH]
+    TwitterHAL: Optional[Type[TH]]
+
+    @property
+    def hal(self) -> TH: ...
 
     def __enter__(self): ...
     def __exit__(self, *args, **kwargs): ...
-    def __init__(self, twitterhal_class: Type[TH], settings_module=Union[str, ModuleType, None]): ...
+    def __init__(self, twitterhal_class: Optional[Type[TH]] = ..., settings_module=Union[str, ModuleType, None]): ...
     def get_hal_kwargs(self) -> Dict[str, Any]: ...
+    def get_twitterhal_class(self) -> Type[TH]: ...
+    def migrate(self): ...
     def print_stats(self): ...
     def run_extra(self, *args, **kwargs) -> bool: ...
     def run(self, *args, **kwargs): ...
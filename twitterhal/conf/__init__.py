@@ -95,6 +95,9 @@ class Settings:
             except ImportError:
                 warnings.warn("settings.DETECTLANGUAGE_API_KEY was set, but detectlanguage could not be imported")
 
+        assert self.TWEET_GENERATION["fallback"] in ("best", "skip", "queue"), \
+            'settings.TWEET_GENERATION["fallback"] must be "best", "skip", or "queue"'
+
         self.is_setup = True
 
     def __setattr__(self, key, value):
@@ -125,6 +128,15 @@ class Settings:
         mod, klass = self.DATABASE["class"].rsplit(".", maxsplit=1)
         return getattr(importlib.import_module(mod), klass)
 
+    def get_database_codec(self):
+        """Return an instance of the codec in DATABASE["codec"], or None if
+        there is none (so the database uses its default)
+        """
+        if not self.DATABASE.get("codec"):
+            return None
+        mod, klass = self.DATABASE["codec"]["class"].rsplit(".", maxsplit=1)
+        return getattr(importlib.import_module(mod), klass)(**self.DATABASE["codec"].get("options", {}))
+
     def get_megahal_database_class(self):
         mod, klass = self.MEGAHAL_DATABASE["class"].rsplit(".", maxsplit=1)
         return getattr(importlib.import_module(mod), klass)
@@ -2,8 +2,6 @@ import datetime
 import pickle
 from copy import deepcopy
 
-from twitter.api import CHARACTER_LIMIT
-
 
 _DATABASE_REDIS = {
     "class": "twitterhal.database.RedisDatabase",
@@ -36,15 +34,58 @@ _MEGAHAL_DATABASE_SHELVE["options"]["db_path"] = "twitterhal.brain"
 _MEGAHAL_DATABASE_SHELVE["test_options"]["db_path"] = "twitterhal.test.brain"
 
 DATABASE = _DATABASE_SHELVE
+# The database is synced by a worker when this many seconds have passed since
+# the last time, or when this many changes are waiting to be written
+# (whichever comes first). None disables that trigger.
+DATABASE_CHECKPOINT_SECONDS = 300
+DATABASE_CHECKPOINT_CHANGES = 10
+# With "enabled", replies are generated without learning from the mentions
+# first. The mentions are queued in the database instead, and a worker learns
+# them in batches of up to "batch_size", as soon as there are that many, or
+# when "flush_seconds" have passed since the last batch.
+DEFERRED_LEARNING = {
+    "enabled": False,
+    "batch_size": 50,
+    "flush_seconds": 60,
+}
 DETECTLANGUAGE_API_KEY = ""
 INCLUDE_MENTIONS = False
 MEGAHAL_DATABASE = _MEGAHAL_DATABASE_SHELVE
+# Number of worker processes generating MegaHAL replies. 0: generate them in
+# the threads that need them, with the main process's MegaHAL. Every worker
+# gets a copy of the brain, refreshed at database checkpoints. Requires
+# megahal < 0.4.0; otherwise, threads are used.
+MEGAHAL_PROCESSES = 0
 POST_STATUS_LIMIT = 300
 POST_STATUS_LIMIT_RESET_FREQUENCY = 3 * 60 * 60
 RANDOM_POST_TIMES = [datetime.time(8), datetime.time(16), datetime.time(22)]
+# Number of random tweets to keep pre-generated. 0 disables the pool.
+RANDOM_TWEET_POOL_SIZE = 0
+# Number of mentions to reply to at a time, in threads sharing the main
+# process's MegaHAL. Ignored if MEGAHAL_PROCESSES is set.
+REPLY_THREADS = 1
 RUNNER_SLEEP_SECONDS = 5
 SCREEN_NAME = ""
 
+# How TwitterHAL.generate_tweet() looks for a reply that is neither empty nor
+# a duplicate of a posted tweet. Candidates are generated `batch_size` at a
+# time, until one is found or `max_attempts` candidates have been generated
+# or `max_seconds` seconds have passed (`batch_size` only matters with
+# MEGAHAL_PROCESSES; otherwise, candidates are screened one at a time). Then,
+# `fallback` decides:
+# "best": use the candidate least similar to posted tweets, even though it
+#     is a duplicate
+# "skip": don't post anything
+# "queue": don't post anything now, but try again with a mention after
+#     `retry_seconds` seconds (random tweets are retried anyway)
+TWEET_GENERATION = {
+    "batch_size": 4,
+    "max_attempts": 40,
+    "max_seconds": 120,
+    "fallback": "best",
+    "retry_seconds": 600,
+}
+
 # List of Twitter handles we will never mention (including replying to them).
 # Without "@"!
 BANNED_USERS = []
@@ -59,7 +100,9 @@ TWITTER_API = {
 }
 
 MEGAHAL_API = {
-    "max_length": CHARACTER_LIMIT,
+    # Same as twitter.api.CHARACTER_LIMIT; not imported from there, since
+    # importing twitter is slow and settings are needed by every command
+    "max_length": 280,
     # Only applies to version <0.4.0 of megahal:
     "brainfile": "twitterhal-brain",
 }
@@ -1,16 +1,24 @@
 import datetime
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
 
 
 BANNED_USERS: List[str]
 DATABASE: Dict[str, Any]
+DATABASE_CHECKPOINT_CHANGES: Optional[int]
+DATABASE_CHECKPOINT_SECONDS: Optional[int]
+DEFERRED_LEARNING: Dict[str, Any]
 DETECTLANGUAGE_API_KEY: str
 INCLUDE_MENTIONS: bool
 MEGAHAL_API: Dict[str, Any]
+MEGAHAL_DATABASE: Dict[str, Any]
+MEGAHAL_PROCESSES: int
 PICKLE_PROTOCOL: int
 POST_STATUS_LIMIT_RESET_FREQUENCY: int
 POST_STATUS_LIMIT: int
 RANDOM_POST_TIMES: List[datetime.time]
+RANDOM_TWEET_POOL_SIZE: int
+REPLY_THREADS: int
 RUNNER_SLEEP_SECONDS: int
 SCREEN_NAME: str
+TWEET_GENERATION: Dict[str, Any]
 TWITTER_API: Dict[str, Any]
@@ -1,10 +1,471 @@
+import datetime
+import itertools
+import json
+import mmap
+import os
 import pickle
 import shelve
+import struct
 import sys
+import time
 from collections import UserList
-from threading import RLock
+from contextlib import contextmanager
+from threading import Lock, RLock
+
+from twitterhal.models import TWEET_FLAG_ATTRS, TWEET_FLAGS, TWEET_TYPES, TweetList, get_timestamp
+from twitterhal.serialization import PickleCodec
+from twitterhal.util import camel_case
+
+
+# Number of items RedisList fetches per round trip when iterating
+DEFAULT_PAGE_SIZE = 1000
+# Values of these types can only change by being replaced, so they never have
+# to be written again unless they have been set since the last sync
+IMMUTABLE_TYPES = (
+    type(None), bool, int, float, complex, str, bytes, tuple, frozenset, datetime.date, datetime.time,
+    datetime.timedelta,
+)
+# SegmentLog record header: type, sequence number (orders the items), ID,
+# created_at, in_reply_to_status_id (0 for None), flags, body length
+LOG_HEADER = struct.Struct("<BQqdqBI")
+# Record types: LOG_PUT stores an item, LOG_TWEET a tweet with its ID and
+# other header fields filled in, LOG_FLAGS changes the flags of a stored
+# tweet, and LOG_DELETE removes an item. The last three have no body.
+LOG_PUT, LOG_TWEET, LOG_FLAGS, LOG_DELETE = 1, 2, 3, 4
+# Tweet attributes stored as bits of the record header's flags
+LOG_FLAG_ATTRS = ("is_answered", "is_processed")
+# Distance between the sequence numbers of appended items, so items can be
+# inserted in between without renumbering the others
+LOG_SEQ_STEP = 2 ** 16
+DEFAULT_SEGMENT_SIZE = 16 * 2 ** 20
+# migrate_to() syncs the target and saves its progress at most this often
+MIGRATION_CHECKPOINT_SECONDS = 5
+# Connection parameters -> redis.ConnectionPool, see get_redis_pool()
+_redis_pools = {}
+_redis_pools_lock = Lock()
+
+
+def lua_mutation(script):
+    """Wrap a Lua script that mutates a list, so that it also increments the
+    version counter, which must be the last of its KEYS. Unless the script
+    returns an error, it will then return {new version, original result}.
+    """
+    return f"""
+        local result = (function()
+{script}
+        end)()
+        if type(result) == "table" and result.err then
+            return result
+        end
+        return {{redis.call("INCR", KEYS[#KEYS]), result}}
+    """
+
+
+# Functions shared by the scripts of RedisList and RedisTweetStore.
+# get_positions() reads list positions from ARGV, which is either a number of
+# positions, or "slice", start, stop, step (as in a Python slice, with empty
+# strings for None).
+LIST_LUA_FUNCTIONS = """
+        local unpack = unpack or table.unpack
+        local function slice_positions(length, start, stop, step)
+            step = tonumber(step) or 1
+            local lower, upper = 0, length
+            if step < 0 then
+                lower, upper = -1, length - 1
+            end
+            -- Same as Python's slice.indices()
+            local function clamp(value, default)
+                value = tonumber(value)
+                if value == nil then
+                    return default
+                elseif value < 0 then
+                    return math.max(value + length, lower)
+                end
+                return math.min(value, upper)
+            end
+            start = clamp(start, step < 0 and upper or lower)
+            stop = clamp(stop, step < 0 and lower or upper)
+            local positions = {}
+            for position = start, stop - (step > 0 and 1 or -1), step do
+                positions[#positions + 1] = position
+            end
+            return positions
+        end
+        local function get_positions(key)
+            if ARGV[1] == "slice" then
+                return slice_positions(redis.call("LLEN", key), ARGV[2], ARGV[3], ARGV[4])
+            end
+            return ARGV
+        end
+        -- Returns {position, value} for those of `positions` that exist.
+        -- They must be in ascending or descending order (or just one), so
+        -- we can get them all with one LRANGE.
+        local function list_items(key, positions)
+            local items = {}
+            if #positions == 0 then
+                return items
+            end
+            local low = math.min(positions[1], positions[#positions])
+            local values = redis.call("LRANGE", key, low, math.max(positions[1], positions[#positions]))
+            for _, position in ipairs(positions) do
+                local value = values[position - low + 1]
+                if value then
+                    items[#items + 1] = {position, value}
+                end
+            end
+            return items
+        end
+"""
+# Lua scripts used by RedisList. KEYS are the list and the version counter.
+REDIS_LIST_SCRIPTS = {
+    # ARGV: positions. Returns the items at those positions that exist.
+    "get_at": """
+        local values = {}
+        for _, item in ipairs(list_items(KEYS[1], get_positions(KEYS[1]))) do
+            values[#values + 1] = item[2]
+        end
+        return values
+    """,
+    # ARGV: positions. Returns the deleted items.
+    "delete_at": lua_mutation("""
+        local values = {}
+        for _, item in ipairs(list_items(KEYS[1], get_positions(KEYS[1]))) do
+            redis.call("LSET", KEYS[1], item[1], "__DELETED__")
+            values[#values + 1] = item[2]
+        end
+        if #values > 0 then
+            redis.call("LREM", KEYS[1], 0, "__DELETED__")
+        end
+        return values
+    """),
+    # ARGV: position, item. Inserts like Python's list.insert().
+    "insert": lua_mutation("""
+        local length = redis.call("LLEN", KEYS[1])
+        local position = tonumber(ARGV[1])
+        if position < 0 then
+            position = math.max(position + length, 0)
+        end
+        if position >= length then
+            redis.call("RPUSH", KEYS[1], ARGV[2])
+        elseif position == 0 then
+            redis.call("LPUSH", KEYS[1], ARGV[2])
+        else
+            -- LINSERT inserts before the first occurrence of a value, so
+            -- temporarily replace the one at `position` with a unique one
+            local ref = redis.call("LINDEX", KEYS[1], position)
+            redis.call("LSET", KEYS[1], position, "__INSERTING__")
+            redis.call("LINSERT", KEYS[1], "BEFORE", "__INSERTING__", ARGV[2])
+            redis.call("LSET", KEYS[1], position + 1, ref)
+        end
+        return 1
+    """),
+    # ARGV: n. Repeats the list contents n times in total.
+    "multiply": lua_mutation("""
+        local values = redis.call("LRANGE", KEYS[1], 0, -1)
+        for _ = 2, tonumber(ARGV[1]) do
+            for i = 1, #values, 1000 do
+                redis.call("RPUSH", KEYS[1], unpack(values, i, math.min(i + 999, #values)))
+            end
+        end
+        return #values
+    """),
+}
+# Lua scripts used by RedisTweetStore. Unless otherwise noted, KEYS are
+# RedisTweetStore.script_keys: ids list, tweets hash, created sorted set, one
+# set per flag, and the version counter. Items are given as ARGV groups of:
+# id, pickle, timestamp, and one 1/0 per flag.
+# Functions shared by the scripts:
+TWEET_STORE_LUA_FUNCTIONS = """
+        local function index_item(argv, offset)
+            local id = argv[offset]
+            redis.call("HSET", KEYS[2], id, argv[offset + 1])
+            redis.call("ZADD", KEYS[3], argv[offset + 2], id)
+            for f = 4, #KEYS - 1 do
+                if argv[offset + f - 1] == "1" then
+                    redis.call("SADD", KEYS[f], id)
+                else
+                    redis.call("SREM", KEYS[f], id)
+                end
+            end
+        end
+        local function unindex_id(id)
+            redis.call("HDEL", KEYS[2], id)
+            for f = 3, #KEYS - 1 do
+                redis.call(f == 3 and "ZREM" or "SREM", KEYS[f], id)
+            end
+        end
+        local function hmget(ids)
+            local result = {}
+            for i = 1, #ids, 1000 do
+                local chunk = redis.call("HMGET", KEYS[2], unpack(ids, i, math.min(i + 999, #ids)))
+                for j = 1, #chunk do
+                    result[#result + 1] = chunk[j]
+                end
+            end
+            return result
+        end
+"""
+TWEET_STORE_SCRIPTS = {
+    # Append items whose IDs aren't stored yet; returns number appended
+    "extend": lua_mutation("""
+        local stride = #KEYS - 1
+        local added = 0
+        for i = 1, #ARGV, stride do
+            if redis.call("HEXISTS", KEYS[2], ARGV[i]) == 0 then
+                redis.call("RPUSH", KEYS[1], ARGV[i])
+                index_item(ARGV, i)
+                added = added + 1
+            end
+        end
+        return added
+    """),
+    # ARGV: position, item. Like extend if the position is out of range.
+    # Returns 1 if inserted, 0 if the ID was already stored
+    "insert": lua_mutation("""
+        if redis.call("HEXISTS", KEYS[2], ARGV[2]) == 1 then
+            return 0
+        end
+        local position = tonumber(ARGV[1])
+        local ref = redis.call("LINDEX", KEYS[1], position)
+        if ref then
+            redis.call("LINSERT", KEYS[1], "BEFORE", ref, ARGV[2])
+        elseif position >= 0 then
+            redis.call("RPUSH", KEYS[1], ARGV[2])
+        else
+            redis.call("LPUSH", KEYS[1], ARGV[2])
+        end
+        index_item(ARGV, 2)
+        return 1
+    """),
+    # ARGV: positions. Returns pickles of the items at those positions.
+    "get_at": """
+        local ids = {}
+        for _, item in ipairs(list_items(KEYS[1], get_positions(KEYS[1]))) do
+            ids[#ids + 1] = item[2]
+        end
+        return hmget(ids)
+    """,
+    # ARGV: position, item. Replaces the item at that position.
+    "set_at": lua_mutation("""
+        local old = redis.call("LINDEX", KEYS[1], ARGV[1])
+        if not old then
+            return redis.error_reply("index out of range")
+        end
+        if old ~= ARGV[2] then
+            if redis.call("HEXISTS", KEYS[2], ARGV[2]) == 1 then
+                return redis.error_reply("ID " .. ARGV[2] .. " is already stored")
+            end
+            unindex_id(old)
+            redis.call("LSET", KEYS[1], ARGV[1], ARGV[2])
+        end
+        index_item(ARGV, 2)
+        return 1
+    """),
+    # Replaces the item with the same ID, if any; returns 1 if there was one
+    "update": lua_mutation("""
+        if redis.call("HEXISTS", KEYS[2], ARGV[1]) == 0 then
+            return 0
+        end
+        index_item(ARGV, 1)
+        return 1
+    """),
+    # ARGV: positions. Returns pickles of the deleted items.
+    "delete_at": lua_mutation("""
+        local ids = {}
+        for _, item in ipairs(list_items(KEYS[1], get_positions(KEYS[1]))) do
+            redis.call("LSET", KEYS[1], item[1], "__DELETED__")
+            ids[#ids + 1] = item[2]
+        end
+        if #ids == 0 then
+            return {}
+        end
+        redis.call("LREM", KEYS[1], 0, "__DELETED__")
+        local values = hmget(ids)
+        for i = 1, #ids do
+            unindex_id(ids[i])
+        end
+        return values
+    """),
+    # ARGV: IDs. Returns number of items deleted.
+    "delete_ids": lua_mutation("""
+        local deleted = 0
+        for i = 1, #ARGV do
+            if redis.call("LREM", KEYS[1], 1, ARGV[i]) > 0 then
+                unindex_id(ARGV[i])
+                deleted = deleted + 1
+            end
+        end
+        return deleted
+    """),
+    # ARGV: timestamp. Deletes all items older than it; returns the number.
+    "remove_older_than": lua_mutation("""
+        local ids = redis.call("ZRANGEBYSCORE", KEYS[3], "-inf", "(" .. ARGV[1])
+        for i = 1, #ids do
+            redis.call("LREM", KEYS[1], 1, ids[i])
+            unindex_id(ids[i])
+        end
+        return #ids
+    """),
+    # ARGV: min & max timestamp, in ZRANGEBYSCORE syntax. Returns pickles.
+    "range": """
+        return hmget(redis.call("ZRANGEBYSCORE", KEYS[3], ARGV[1], ARGV[2]))
+    """,
+    # KEYS: ids list, tweets hash, flag set. ARGV: 1 for items that have the
+    # flag, 0 for those that don't. Returns pickles, in list order.
+    "flagged": """
+        local ids = {}
+        for _, id in ipairs(redis.call("LRANGE", KEYS[1], 0, -1)) do
+            if redis.call("SISMEMBER", KEYS[3], id) == tonumber(ARGV[1]) then
+                ids[#ids + 1] = id
+            end
+        end
+        return hmget(ids)
+    """,
+    # KEYS: ids list, tweets hash, version. ARGV: start & stop, as in
+    # LRANGE. Returns {version, pickles}.
+    "fetch": """
+        local version = redis.call("GET", KEYS[3]) or "0"
+        return {version, hmget(redis.call("LRANGE", KEYS[1], ARGV[1], ARGV[2]))}
+    """,
+}
+
+
+# Kwargs of RedisDatabase that are connection parameters for redis.Redis(),
+# and so for get_redis_pool()
+REDIS_CONNECTION_KWARGS = (
+    "host", "port", "db", "username", "password", "unix_socket_path", "socket_timeout", "socket_connect_timeout",
+    "socket_keepalive", "socket_keepalive_options", "encoding", "encoding_errors", "decode_responses", "ssl",
+    "ssl_keyfile", "ssl_certfile", "ssl_cert_reqs", "ssl_ca_certs", "client_name", "health_check_interval",
+    "max_connections",
+)
+
+
+def get_redis_pool(max_connections=None, **kwargs):
+    """Return the process-wide connection pool for these connection
+    parameters, creating it if needed
+
+    Every RedisDatabase (and the RedisLists it creates) gets its connections
+    from here, so databases on the same Redis server and DB share sockets.
+
+    Args:
+        max_connections (int, optional): Maximum number of connections the
+            pool will open. If the pool already exists with a lower maximum,
+            that is raised. Default: None (no limit).
+        **kwargs (optional): Connection parameters, as for redis.Redis().
+    """
+    from redis import Redis
+
+    key = tuple(sorted((k, repr(v)) for k, v in kwargs.items()))
+    with _redis_pools_lock:
+        if key not in _redis_pools:
+            # Let Redis pick the connection class etc from the parameters; it
+            # doesn't connect until a command is run
+            _redis_pools[key] = Redis(max_connections=max_connections, **kwargs).connection_pool
+        pool = _redis_pools[key]
+        if max_connections is not None and pool.max_connections < max_connections:
+            pool.max_connections = max_connections
+    return pool
+
+
+def get_redis(**kwargs):
+    """Return a redis.Redis using the connection pool from get_redis_pool()"""
+    from redis import Redis
+
+    return Redis(connection_pool=get_redis_pool(**kwargs))
+
+
+def redis_pool_stats(pool=None):
+    """Return connection counts for `pool`, or for every pool created by
+    get_redis_pool() as a dict keyed by their descriptions
+
+    Counts are `max_connections` (None if unlimited), `created` (open
+    connections), `in_use` and `idle`.
+    """
+    if pool is None:
+        with _redis_pools_lock:
+            pools = list(_redis_pools.values())
+        return {repr(p): redis_pool_stats(p) for p in pools}
+    in_use, idle = len(pool._in_use_connections), len(pool._available_connections)
+    return {
+        # The pool uses 2 ** 31 for no limit
+        "max_connections": pool.max_connections if pool.max_connections < 2 ** 31 else None,
+        "created": in_use + idle,
+        "in_use": in_use,
+        "idle": idle,
+    }
+
+
+def stream_list(value, start=0, page_size=None):
+    """Iterate over a list, from index `start`, streaming it page by page if
+    it is backed by a database (RedisList, SQLiteList, LogList, or a UserList
+    wrapping one of them)
+    """
+    if isinstance(value, UserList) and not hasattr(value, "stream"):
+        value = value.data
+    if hasattr(value, "stream"):
+        return value.stream(page_size, start=start)
+    return itertools.islice(value, start, None)
+
+
+class ChangeCountingList(list):
+    """List counting its mutations in `change_count`, like TweetList, so
+    BaseDatabase can tell whether and how much it has changed (see
+    is_dirty() and pending_changes())
+    """
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.change_count = 0
 
-from twitterhal.util import slice_to_redis_range, camel_case
+    def __setitem__(self, i, item):
+        super().__setitem__(i, item)
+        self.change_count += 1
+
+    def __delitem__(self, i):
+        super().__delitem__(i)
+        self.change_count += 1
+
+    def __iadd__(self, other):
+        self.extend(other)
+        return self
+
+    def __imul__(self, n):
+        super().__imul__(n)
+        self.change_count += 1
+        return self
+
+    def append(self, item):
+        super().append(item)
+        self.change_count += 1
+
+    def extend(self, other):
+        super().extend(other)
+        self.change_count += 1
+
+    def insert(self, i, item):
+        super().insert(i, item)
+        self.change_count += 1
+
+    def pop(self, i=-1):
+        item = super().pop(i)
+        self.change_count += 1
+        return item
+
+    def remove(self, item):
+        super().remove(item)
+        self.change_count += 1
+
+    def clear(self):
+        super().clear()
+        self.change_count += 1
+
+    def reverse(self):
+        super().reverse()
+        self.change_count += 1
+
+    def sort(self, *args, **kwargs):
+        super().sort(*args, **kwargs)
+        self.change_count += 1
 
 
 class DatabaseItem:
@@ -20,10 +481,29 @@ class DatabaseItem:
 
 
 class BaseDatabase:
-    def __init__(self):
-        """Initialize the DB."""
+    def __init__(self, preload=()):
+        """Initialize the DB.
+
+        Values are loaded from the DB the first time they are accessed, so
+        opening it is quick however many keys the schema has.
+
+        Args:
+            preload (iterable of str, or bool, optional): Keys whose values
+                should be loaded on open() instead, or True for all of them.
+                Default: () (none).
+        """
         self._is_open = False
         self._schema = {}
+        self._preload = preload
+        # Held while loading a value, so it's only loaded once
+        self._load_lock = RLock()
+        # Keys that have been set since they were last written
+        self._dirty = set()
+        # Key -> the value's `change_count` when it was last written
+        self._change_counts = {}
+        self._sync_stats = {"syncs": 0, "keys": 0, "bytes": 0, "total_bytes": 0}
+        # Held by _write_dirty(), so concurrent syncs don't mix up the above
+        self._sync_lock = RLock()
 
     def add_key(self, name, type_, default=None, **default_kwargs):
         """Add new key to database
@@ -62,9 +542,17 @@ class BaseDatabase:
             assert isinstance(value, self._schema[name].type), \
                 f"'{name}' is of wrong type '{value.__class__.__name__}', " \
                 f"should be: '{self._schema[name].type.__name__}'"
+            self._dirty.add(name)
             self.setattr(name, value)
         super().__setattr__(name, value)
 
+    def __getattr__(self, name):
+        # Only called for attributes that aren't set, which includes keys
+        # whose values haven't been loaded yet
+        if self.__dict__.get("_is_open") and name in self.__dict__.get("_schema", {}):
+            return self._load(name)
+        raise AttributeError(f"'{self.__class__.__name__}' object has no attribute '{name}'")
+
     def setattr(self, name, value):
         """Hook for setting DB values
 
@@ -74,60 +562,311 @@ class BaseDatabase:
         """
         raise NotImplementedError
 
+    def is_loaded(self, key):
+        """Return True if the value of `key` has been loaded (or set)"""
+        return key in self.__dict__
+
+    def _load(self, key):
+        with self._load_lock:
+            if key not in self.__dict__:
+                value = self._read_key(key)
+                # Bypass __setattr__, as there is nothing to write
+                object.__setattr__(self, key, value)
+                self._mark_clean(key, getattr(value, "change_count", None))
+            return self.__dict__[key]
+
     def open(self):
         """Hook for opening DB"""
+        for key in self._schema if self._preload is True else self._preload:
+            self._load(key)
         self._is_open = True
 
     def close(self):
         """Hook for closing DB"""
         self._is_open = False
         for key in self._schema.keys():
-            delattr(self, key)
+            self.__dict__.pop(key, None)
 
     def sync(self, key=None):
         """Hook for syncing DB"""
         pass
 
-    def migrate_to(self, other_db):
+    @property
+    def sync_stats(self):
+        """Counters for sync(): the number of `syncs`, the number of `keys`
+        and `bytes` written by the last one, and `total_bytes` written by all
+        of them.
+        """
+        return self._sync_stats.copy()
+
+    def is_dirty(self, key):
+        """Return True if the value of `key` may have changed since it was
+        last written
+
+        That is if it has been set since then, or, if it has a `change_count`
+        (like TweetList), if that has changed. In-place changes to other
+        mutable values can't be detected, so those are always dirty.
+        """
+        if key in self._dirty:
+            return True
+        value = getattr(self, key)
+        if isinstance(value, IMMUTABLE_TYPES):
+            return False
+        change_count = getattr(value, "change_count", None)
+        return change_count is None or change_count != self._change_counts.get(key)
+
+    def pending_changes(self):
+        """Return the number of changes that the next sync() would write
+
+        That is, one for every key that has been set, plus the number of
+        mutations of values with a `change_count` (TweetList, and the lists
+        of ShelveDatabase; those of the other databases write their own
+        changes), since they were last written. Other values are not
+        counted.
+        """
+        count = 0
+        for key in self._sync_keys():
+            if key in self._dirty:
+                count += 1
+                continue
+            change_count = getattr(getattr(self, key), "change_count", None)
+            if change_count is not None:
+                count += change_count - (self._change_counts.get(key) or 0)
+        return count
+
+    def _sync_keys(self, key=None):
+        """Return the keys sync() should write, if they are dirty
+
+        Values that haven't been loaded can't have changed, so those keys are
+        left out.
+        """
+        return [k for k in self._schema if (key is None or k == key) and self.is_loaded(k)]
+
+    def _read_key(self, key):
+        """Hook for loading DB values
+
+        Return the value of `key` as stored in the DB, or its default, ready
+        to be used (e.g. lists wrapped so they write their own changes).
+        Called the first time a key is accessed after open().
+        """
+        raise NotImplementedError
+
+    def _mark_clean(self, key, change_count=None):
+        self._dirty.discard(key)
+        self._change_counts[key] = change_count
+
+    def _write_dirty(self, write, key=None):
+        """Run `write(key, value)` for those of _sync_keys(key) that are
+        dirty, and update sync_stats
+
+        `write` should return the number of bytes written.
+        """
+        with self._sync_lock:
+            written_keys, written_bytes = 0, 0
+            for k in self._sync_keys(key):
+                if self.is_dirty(k):
+                    value = getattr(self, k)
+                    # Read before writing, so changes made meanwhile are
+                    # written by the next sync
+                    change_count = getattr(value, "change_count", None)
+                    written_bytes += write(k, value)
+                    self._mark_clean(k, change_count)
+                    written_keys += 1
+            self._sync_stats["syncs"] += 1
+            self._sync_stats["keys"] = written_keys
+            self._sync_stats["bytes"] = written_bytes
+            self._sync_stats["total_bytes"] += written_bytes
+
+    def migrate_to(self, other_db, batch_size=DEFAULT_PAGE_SIZE, checkpoint_path=None, progress=None):
+        """Copy all values to `other_db`, which must have the same keys in
+        its schema, and verify the result
+
+        Lists are streamed from this DB and appended to the lists in
+        `other_db` (which are emptied first) `batch_size` items at a time, so
+        they are never held in memory as a whole, whatever the backends.
+        Other values are just set.
+
+        With `checkpoint_path`, other_db is synced and the progress is saved
+        to that JSON file after each key, and every
+        MIGRATION_CHECKPOINT_SECONDS while copying a list. If the file
+        exists, the migration resumes from there: keys that are done are
+        skipped, and a list that was being copied is truncated to what had
+        been saved, and continued. The file is removed once the migration
+        has been verified.
+
+        Finally, every key is verified: lists must have the same number of
+        items, with the same IDs (or, for items without one, equal items) in
+        the same order, and other values must be equal.
+
+        Args:
+            other_db (BaseDatabase): Will be opened and closed, unless it
+                already is open.
+            batch_size (int, optional): Default: DEFAULT_PAGE_SIZE.
+            checkpoint_path (str, optional): Default: None, i.e. no
+                checkpoints.
+            progress (callable, optional): Called with (key, items copied,
+                total items) after each batch, and with (key, 1, 1) for
+                non-list values.
+
+        Returns:
+            dict: Key -> number of list items (or 1 for other values) in
+                other_db.
+
+        Raises:
+            ValueError: If the verification fails.
+        """
         assert isinstance(other_db, BaseDatabase)
-        self.open()
-        other_was_open = other_db._is_open
+        was_open, other_was_open = self._is_open, other_db._is_open
+        if not was_open:
+            self.open()
         if not other_was_open:
             other_db.open()
-        for key in self._schema.keys():
-            setattr(other_db, key, getattr(self, key))
-        if not other_was_open:
-            other_db.close()
+        state = {}
+        if checkpoint_path and os.path.exists(checkpoint_path):
+            with open(checkpoint_path) as f:
+                state = json.load(f)
+
+        def checkpoint():
+            if checkpoint_path:
+                other_db.sync()
+                with open(checkpoint_path + ".tmp", "w") as f:
+                    json.dump(state, f)
+                os.replace(checkpoint_path + ".tmp", checkpoint_path)
+
+        try:
+            for key in self._schema:
+                key_state = state.setdefault(key, {"done": False, "copied": 0, "length": 0})
+                if key_state["done"]:
+                    continue
+                value = getattr(self, key)
+                if isinstance(value, (list, UserList)):
+                    self._migrate_list(key, value, getattr(other_db, key), key_state, batch_size, checkpoint, progress)
+                else:
+                    setattr(other_db, key, value)
+                    if progress:
+                        progress(key, 1, 1)
+                key_state["done"] = True
+                checkpoint()
+            other_db.sync()
+            counts = {key: self._verify_migration(key, other_db, batch_size) for key in self._schema}
+            if checkpoint_path:
+                os.remove(checkpoint_path)
+            return counts
+        finally:
+            if not other_was_open:
+                other_db.close()
+            if not was_open:
+                self.close()
+
+    @staticmethod
+    def _migrate_list(key, source, target, key_state, batch_size, checkpoint, progress):
+        """Copy `source` to `target` for migrate_to(), resuming from
+        `key_state`: {"copied": items read from `source`, "length": length
+        of `target` at that point}
+        """
+        if len(target) < key_state["length"]:
+            # Got lost somehow; start over
+            key_state["copied"] = key_state["length"] = 0
+        if key_state["length"]:
+            del target[key_state["length"]:]
+        else:
+            target.clear()
+        total = len(source)
+        items = stream_list(source, key_state["copied"], batch_size)
+        last_checkpoint = time.monotonic()
+        while True:
+            batch = list(itertools.islice(items, batch_size))
+            if not batch:
+                break
+            target.extend(batch)
+            key_state["copied"] += len(batch)
+            key_state["length"] = len(target)
+            if progress:
+                progress(key, key_state["copied"], total)
+            if time.monotonic() - last_checkpoint >= MIGRATION_CHECKPOINT_SECONDS:
+                checkpoint()
+                last_checkpoint = time.monotonic()
+
+    def _verify_migration(self, key, other_db, batch_size):
+        """Check that `key` has the same value in other_db, see migrate_to();
+        return its number of items
+        """
+        value, other = getattr(self, key), getattr(other_db, key)
+        if not isinstance(value, (list, UserList)):
+            if value != other:
+                raise ValueError(f"Migration of '{key}' failed: values differ")
+            return 1
+        if len(value) != len(other):
+            raise ValueError(f"Migration of '{key}' failed: {len(value)} items, but {len(other)} were migrated")
+        items = zip(stream_list(value, page_size=batch_size), stream_list(other, page_size=batch_size))
+        for idx, (item, other_item) in enumerate(items):
+            if getattr(item, "id", item) != getattr(other_item, "id", other_item):
+                raise ValueError(f"Migration of '{key}' failed: items at index {idx} differ")
+        return len(other)
 
 
 class ShelveDatabase(BaseDatabase):
     """Wrapper for typed `shelve` DB storing TwitterHAL data."""
 
-    def __init__(self, db_path="twitterhal"):
+    def __init__(self, db_path="twitterhal", codec=None, preload=()):
         """Initialize the DB.
 
         Args:
             db_path (str, optional): Path to the .db file on disk, without
                 extension. Default: "twitterhal"
+            codec (optional): Encodes the values; see
+                twitterhal.serialization. Default: PickleCodec(), which
+                stores plain pickles, like `shelve` itself.
+            preload (iterable of str, or bool, optional): See BaseDatabase.
         """
-        super().__init__()
+        super().__init__(preload=preload)
         self._db_path = db_path
+        self._codec = codec or PickleCodec()
         self._lock = RLock()
 
+    def __setattr__(self, name, value):
+        if not name.startswith("_") and type(value) is list:
+            # So its changes are counted, see pending_changes()
+            value = ChangeCountingList(value)
+        super().__setattr__(name, value)
+
     def add_key(self, name, type_, default=None, **default_kwargs):
         assert not self._is_open, "Cannot add to schema once DB has been opened"
         super().add_key(name, type_, default=default, **default_kwargs)
 
     def setattr(self, name, value):
         with self._lock:
-            self._db[name] = value
+            self._write_key(name, value)
+            self._mark_clean(name, getattr(value, "change_count", None))
+
+    def _read_key(self, key):
+        with self._lock:
+            data = self._db.dict.get(key.encode(self._db.keyencoding))
+        if data is None:
+            item = self._schema[key]
+            value = item.default or item.type(**item.default_kwargs)
+        else:
+            value = self._codec.loads(data)
+        if type(value) is list:
+            return ChangeCountingList(value)
+        return value
+
+    def _write_key(self, key, value):
+        if isinstance(value, ChangeCountingList):
+            # Stored as a plain list
+            value = list(value)
+        # Encode it ourselves, bypassing the shelf's pickling, so we can use
+        # the codec and know the size, and so other threads aren't blocked
+        # meanwhile
+        data = self._codec.dumps(value)
+        with self._lock:
+            self._db.dict[key.encode(self._db.keyencoding)] = data
+        return len(data)
 
     def open(self):
         if not self._is_open:
             with self._lock:
                 self._db = shelve.open(self._db_path)
-                for k, v in self._schema.items():
-                    setattr(self, k, self._db.get(k, v.default or v.type(**v.default_kwargs)))
                 super().open()
 
     def close(self):
@@ -138,43 +877,69 @@ class ShelveDatabase(BaseDatabase):
             super().close()
 
     def sync(self, key=None):
+        """Write the values that have changed since they were last written
+        (see is_dirty()), or just `key`'s value if it has, to disk
+        """
+        # Only lock while writing, see _write_key()
+        self._write_dirty(self._write_key, key)
         with self._lock:
-            for k in self._schema.keys():
-                if key is None or k == key:
-                    self._db[k] = getattr(self, k)
             self._db.sync()
 
 
 class RedisDatabase(BaseDatabase):
-    def __init__(self, pickle_protocol=pickle.DEFAULT_PROTOCOL, namespace=None, **kwargs):
+    def __init__(
+        self, pickle_protocol=pickle.DEFAULT_PROTOCOL, namespace=None, cache=True, tweet_store=False,
+        page_size=DEFAULT_PAGE_SIZE, bgsave=((0, 1),), codec=None, preload=(), **kwargs
+    ):
         """Initialize Redis DB
 
         Args:
             pickle_protocol (int, optional): https://docs.python.org/3.7/library/pickle.html#data-stream-format
+                Used by the default codec.
             namespace (str, optional): If set, key names in the Redis DB will
                 be preceeded by "<namespace>:".
-            **kwargs (optional): All these will be sent to redis.Redis(). See
+            cache (bool, optional): If True, lists will keep local caches of
+                their decoded items, which are only refreshed when the lists
+                have changed in Redis. See RedisList. Default: True.
+            tweet_store (bool, optional): If True, unique TweetLists will be
+                stored with RedisTweetStore (hashes, sorted sets etc) instead
+                of RedisList, and existing RedisLists will be migrated.
+                Default: False.
+            page_size (int, optional): Number of list items to fetch per
+                round trip when iterating over lists. See RedisList.
+                Default: DEFAULT_PAGE_SIZE.
+            bgsave (sequence of (int, int) tuples, optional): When sync()
+                should make Redis save to disk with BGSAVE. Works like the
+                `save` directive in redis.conf: (seconds, changes) means "if
+                at least `seconds` have passed and at least `changes` writes
+                have been made since the last save". Empty: never (leave it
+                to Redis' own config). Default: ((0, 1),), i.e. whenever
+                there are unsaved writes.
+            codec (optional): Encodes values and list items; see
+                twitterhal.serialization. Default:
+                PickleCodec(pickle_protocol).
+            preload (iterable of str, or bool, optional): See BaseDatabase.
+            **kwargs (optional): Connection parameters, as for redis.Redis(),
+                plus `max_connections` (see get_redis_pool()). Databases with
+                the same parameters share a connection pool. See
                 https://github.com/andymccurdy/redis-py for more info.
         """
-        from redis import Redis
-
-        super().__init__()
-        self._pickle_protocol = pickle_protocol
+        super().__init__(preload=preload)
+        self._codec = codec or PickleCodec(pickle_protocol)
         self._namespace = namespace
+        self._cache = cache
+        self._tweet_store = tweet_store
+        self._page_size = page_size
+        self._bgsave = bgsave
 
         # Quick check so the number of databases is sufficient
         if "db" in kwargs and kwargs["db"] > 0:
-            redis_kwargs = kwargs.copy()
-            redis_kwargs["db"] = 0
-            redis = Redis(**redis_kwargs)
-            dbs = redis.config_get("databases")
+            dbs = get_redis(**dict(kwargs, db=0)).config_get("databases")
             if int(dbs["databases"]) <= kwargs["db"]:
-                redis.close()
                 raise ValueError(
                     f"Tried to open Redis DB #{kwargs['db']}, but there are only {dbs['databases']} databases")
-            redis.close()
 
-        self._redis = Redis(**kwargs)
+        self._redis = get_redis(**kwargs)
 
     def __setattr__(self, name, value):
         if not name.startswith("_") and self._is_open:
@@ -186,16 +951,20 @@ class RedisDatabase(BaseDatabase):
                             self.get_redis_key(name),
                             initlist=value,
                             overwrite=True,
-                            pickle_protocol=self._pickle_protocol
+                            codec=self._codec,
+                            cache=self._cache,
+                            page_size=self._page_size
                         )
                         break
             if isinstance(value, UserList) and not hasattr(value, "_redis_wrapped"):
-                value = RedisList.wrap(
+                value = self.get_list_class(value).wrap(
                     value,
                     self._redis,
                     self.get_redis_key(name),
                     overwrite=True,
-                    pickle_protocol=self._pickle_protocol
+                    codec=self._codec,
+                    cache=self._cache,
+                    page_size=self._page_size
                 )
         super().__setattr__(name, value)
 
@@ -211,75 +980,131 @@ class RedisDatabase(BaseDatabase):
                 "initlist": initlist,
                 "redis": self._redis,
                 "key": self.get_redis_key(name),
-                "pickle_protocol": self._pickle_protocol
+                "codec": self._codec,
+                "cache": self._cache,
+                "page_size": self._page_size,
             })
         super().add_key(name, type_, default=default, **default_kwargs)
 
+    def get_list_class(self, userlist):
+        """Return the class that should be used for wrapping `userlist`"""
+        if self._tweet_store and isinstance(userlist, TweetList) and userlist.unique:
+            return RedisTweetStore
+        return RedisList
+
+    def _sync_keys(self, key=None):
+        # Lists are written on every mutation
+        return [k for k in super()._sync_keys(key) if not issubclass(self._schema[k].type, UserList)]
+
     def get_redis_key(self, name):
         return f"{self._namespace}:{name}" if self._namespace else name
 
+    @property
+    def pool_stats(self):
+        """Connection counts for the shared connection pool this database
+        uses, see redis_pool_stats()
+        """
+        return redis_pool_stats(self._redis.connection_pool)
+
     def setattr(self, name, value):
+        # Lists write their own changes
         if not isinstance(value, (list, UserList)):
-            self._redis[self.get_redis_key(name)] = pickle.dumps(value, protocol=self._pickle_protocol)
+            self._write_key(name, value)
+        self._mark_clean(name, getattr(value, "change_count", None))
+
+    def _write_key(self, key, value):
+        data = self._codec.dumps(value)
+        self._redis.set(self.get_redis_key(key), data)
+        return len(data)
+
+    def bgsave_due(self):
+        """Return True if a BGSAVE should be made now, according to the
+        `bgsave` policy and Redis' persistence info
+        """
+        if not self._bgsave:
+            return False
+        with self._redis.pipeline(transaction=False) as pipe:
+            pipe.info("persistence")
+            pipe.time()
+            info, (now, _) = pipe.execute()
+        if info.get("rdb_bgsave_in_progress"):
+            return False
+        elapsed = now - info["rdb_last_save_time"]
+        changes = info["rdb_changes_since_last_save"]
+        return any(elapsed >= seconds and changes >= min_changes for seconds, min_changes in self._bgsave)
 
     def close(self):
         self.sync()
         self._redis.close()
         super().close()
 
-    def open(self):
-        for key, item in self._schema.items():
-            if item.type is RedisList:
-                setattr(self, key, item.get_default())
-            elif issubclass(item.type, UserList):
-                unique = item.default_kwargs.get("unique", False)
-                setattr(self, key, RedisList.wrap(
-                    item.get_default(),
-                    self._redis,
-                    self.get_redis_key(key),
-                    unique=unique,
-                    pickle_protocol=self._pickle_protocol
-                ))
-            else:
-                value = self._redis.get(self.get_redis_key(key))
-                setattr(self, key, item.get_default() if value is None else pickle.loads(value))
-        super().open()
+    def _read_key(self, key):
+        item = self._schema[key]
+        if item.type is RedisList:
+            return item.get_default()
+        if issubclass(item.type, UserList):
+            default = item.get_default()
+            return self.get_list_class(default).wrap(
+                default,
+                self._redis,
+                self.get_redis_key(key),
+                unique=item.default_kwargs.get("unique", False),
+                codec=self._codec,
+                cache=self._cache,
+                page_size=self._page_size
+            )
+        value = self._redis.get(self.get_redis_key(key))
+        return item.get_default() if value is None else self._codec.loads(value)
 
     def sync(self, key=None):
+        """Write the non-list values that have changed since they were last
+        written (see is_dirty()), or just `key`'s value if it has, and BGSAVE
+        if the `bgsave` policy says so
+        """
         from redis import ResponseError
-        for k, item in self._schema.items():
-            if key is not None and k != key:
-                continue
-            if not issubclass(item.type, UserList):
-                self._redis.set(self.get_redis_key(k), pickle.dumps(getattr(self, k), protocol=self._pickle_protocol))
-        # Fail silently if another save is already in progress
-        try:
-            self._redis.bgsave()
-        except ResponseError:
-            pass
+
+        self._write_dirty(self._write_key, key)
+        if self.bgsave_due():
+            # Fail silently if another save has started meanwhile
+            try:
+                self._redis.bgsave()
+            except ResponseError:
+                pass
 
 
 class RedisList(UserList):
-    def __new__(cls, redis, key, list_type=None, pickle_protocol=pickle.DEFAULT_PROTOCOL, **kwargs):
+    lua_functions = LIST_LUA_FUNCTIONS
+    lua_scripts = REDIS_LIST_SCRIPTS
+
+    def __new__(
+        cls, redis, key, list_type=None, pickle_protocol=pickle.DEFAULT_PROTOCOL, cache=False,
+        page_size=DEFAULT_PAGE_SIZE, codec=None, **kwargs
+    ):
         """
         We actually create a new class for each instantiation. This is because
         we want to set custom attributes/methods on it, depending on what
         custom attributes/methods are on the underlying `data` list.
         """
-        class_name = camel_case(key) + "RedisList"
+        class_name = camel_case(key) + cls.__name__
         new_cls = type(class_name, (cls,), {})
         new_cls.redis = redis
         new_cls.key = key
+        new_cls.version_key = f"{key}:version"
         new_cls.pickle_protocol = pickle_protocol
+        new_cls.codec = codec or PickleCodec(pickle_protocol)
+        new_cls.cache = cache
+        new_cls.page_size = page_size
         new_cls._redis_wrapped = True
         if list_type is None and "initlist" in kwargs and kwargs["initlist"] is not None:
             new_cls.list_type = type(kwargs["initlist"])
         else:
             new_cls.list_type = list
         if new_cls.list_type is not list:
+            # Skip anything RedisList defines itself (e.g. the `data`
+            # property), or we would shadow our own implementation
             extra_attrs = {
                 k: v for k, v in new_cls.list_type.__dict__.items()
-                if k not in list.__dict__ and not k.startswith("__")}
+                if k not in list.__dict__ and not k.startswith("__") and not hasattr(cls, k)}
             for k, v in extra_attrs.items():
                 setattr(new_cls, k, v)
         return super().__new__(new_cls)
@@ -299,6 +1124,19 @@ class RedisList(UserList):
         RedisList.wrap(), which replaces their `data` attribute but otherwise
         leaves them intact.
 
+        Every mutation is atomic, takes one round trip to the server, and
+        also increments a version counter, stored in Redis under
+        "<key>:version". If `cache` is True, decoded items are kept locally,
+        and only fetched again when that counter has changed, i.e. when the
+        list has been changed by someone else (e.g. another process). Like
+        with a regular list, reads will then return the same item objects
+        every time. To make many mutations in one round trip, use batch().
+
+        Iterating over the list, or fetching all of it (e.g. `data` or
+        copy()), is done `page_size` items at a time, so neither we nor the
+        Redis server have to handle the whole list in one reply. stream()
+        does that without keeping the items around.
+
         Args:
             redis (redis.Redis): A Redis instance
             key (str): Redis DB key to use
@@ -309,18 +1147,42 @@ class RedisList(UserList):
                 contents of `initlist`. If False, the contents of `initlist`
                 will be disregarded and no longer available. Default: False.
             pickle_protocol (int, optional): https://docs.python.org/3.7/library/pickle.html#data-stream-format
+                Used by the default codec.
+            cache (bool, optional): Keep a local cache of decoded items.
+                Default: False.
+            page_size (int, optional): Number of items to fetch per round
+                trip when iterating. Default: DEFAULT_PAGE_SIZE.
+            codec (optional): Encodes the items; see
+                twitterhal.serialization. Default:
+                PickleCodec(pickle_protocol).
         """
+        self._lock = RLock()
+        self._cache = None
+        self._cache_version = None
+        # Version the owner of the list knows it as, see track_version()
+        self._tracked_version = None
+        self._batch = None
+        # register_script() doesn't talk to the server; scripts are loaded
+        # on first use
+        self._scripts = {
+            name: redis.register_script(self.lua_functions + script) for name, script in self.lua_scripts.items()
+        }
         if overwrite:
             if isinstance(initlist, UserList):
-                self.data = initlist.data[:]
+                initlist = initlist.data
+            if isinstance(initlist, RedisList):
+                self.data = initlist.stream()
             else:
                 self.data = initlist
 
     def __sizeof__(self):
-        return sum([sys.getsizeof(i) for i in self.redis.lrange(self.key, 0, -1)])
+        return sum(sys.getsizeof(i) for i in self.stream_raw())
 
     @classmethod
-    def wrap(cls, userlist, redis, key, overwrite=False, unique=False, pickle_protocol=pickle.DEFAULT_PROTOCOL):
+    def wrap(
+        cls, userlist, redis, key, overwrite=False, unique=False, pickle_protocol=pickle.DEFAULT_PROTOCOL, cache=False,
+        page_size=DEFAULT_PAGE_SIZE, codec=None
+    ):
         """Wrap an existing list
 
         This will make RedisList act as a transparent "backend" for a UserList
@@ -340,87 +1202,345 @@ class RedisList(UserList):
                 __hash__() value).
             pickle_protocol (int, optional):
                 https://docs.python.org/3.7/library/pickle.html#data-stream-format
+            cache (bool, optional): Keep a local cache of decoded items; see
+                RedisList.__init__(). Default: False.
+            page_size, codec (optional): See RedisList.__init__().
 
         Returns:
             "Wrapped" UserList
         """
         assert isinstance(userlist, UserList)
-        initlist = userlist.data
-        userlist.data = cls(
-            redis, key, initlist=initlist, overwrite=overwrite, list_type=type(userlist),
-            pickle_protocol=pickle_protocol)
+        redis_list = cls(
+            redis, key, initlist=userlist.data, overwrite=overwrite, list_type=type(userlist),
+            pickle_protocol=pickle_protocol, cache=cache, page_size=page_size, codec=codec)
         if unique and not overwrite:
-            userlist.data.data = list(set(userlist.data.data))
+            redis_list.data = list(dict.fromkeys(redis_list))
+        # Assign only once deduplication is done, since e.g. TweetList
+        # rebuilds its index whenever `data` is set
+        userlist.data = redis_list
         userlist._redis_wrapped = True
         return userlist
 
+    @property
+    def script_keys(self):
+        """KEYS for our Lua scripts; the version counter must come last"""
+        return [self.key, self.version_key]
+
+    @staticmethod
+    def _position_args(i):
+        """Lua script arguments for an index or a slice; see
+        LIST_LUA_FUNCTIONS
+        """
+        if isinstance(i, slice):
+            if i.step == 0:
+                raise ValueError("slice step cannot be zero")
+            return ["slice", *["" if v is None else v for v in (i.start, i.stop, i.step)]]
+        return [i]
+
+    def _run(self, script, args=[], client=None):
+        return self._scripts[script](keys=self.script_keys, args=args, client=client or self.redis)
+
+    def _fetch_page(self, start, stop):
+        """Return (version, pickled items start..stop-1), fetched in one
+        transaction
+        """
+        pipe = self.redis.pipeline()
+        pipe.get(self.version_key)
+        pipe.lrange(self.key, start, stop - 1)
+        version, items = pipe.execute()
+        return int(version or 0), items
+
+    def _pages(self, page_size=None, start=0):
+        """Yield (version, pickled items) for one page at a time, starting
+        at index `start`
+        """
+        page_size = page_size or self.page_size
+        while True:
+            version, items = self._fetch_page(start, start + page_size)
+            yield version, items
+            if len(items) < page_size:
+                return
+            start += page_size
+
+    def _fetch(self):
+        """Return (version, pickled items), fetched page by page, but
+        starting over if the list changes meanwhile
+        """
+        while True:
+            versions, items = set(), []
+            for version, page in self._pages():
+                versions.add(version)
+                if len(versions) > 1:
+                    break
+                items.extend(page)
+            else:
+                return version, items
+
+    def stream_raw(self, page_size=None, start=0):
+        """Like stream(), but yields the items still encoded"""
+        for _, items in self._pages(page_size, start):
+            yield from items
+
+    def stream(self, page_size=None, start=0):
+        """Iterate over the items in Redis, fetching one page at a time
+
+        Only the current page is kept in memory. Unlike with the local cache,
+        this is not a snapshot: if the list is changed by someone else while
+        iterating, items may be skipped or repeated.
+
+        Args:
+            page_size (int, optional): Items per page. Default:
+                self.page_size.
+            start (int, optional): Index of the first item. Default: 0.
+        """
+        for item in self.stream_raw(page_size, start):
+            yield self.codec.loads(item)
+
+    def version(self):
+        """Return the version counter, i.e. the number of mutations so far"""
+        return int(self.redis.get(self.version_key) or 0)
+
+    def track_version(self):
+        """Return the version counter, and start keeping track of whether the
+        list has been changed by anyone else since then
+
+        For owners who keep their own indexes of the list, like TweetList:
+        call this before reading the list to build them, and is_stale() to
+        find out if they have to be built again.
+        """
+        with self._lock:
+            self._tracked_version = self.version()
+            return self._tracked_version
+
+    def is_stale(self):
+        """Return True if the list may have been changed by someone else
+        (e.g. another process, or another RedisList with the same key) since
+        track_version() was called
+
+        Our own mutations don't count, unless someone else's got in between.
+        Takes one round trip.
+        """
+        with self._lock:
+            return self._tracked_version is None or self.version() != self._tracked_version
+
+    def _get_cache(self):
+        """Return locally cached items, fetching them first if needed
+
+        That is, if there is no cache yet, or the version counter in Redis
+        says the list has changed since we cached it.
+        """
+        with self._lock:
+            if self._cache is not None and int(self.redis.get(self.version_key) or 0) == self._cache_version:
+                return self._cache
+            version, items = self._fetch()
+            self._cache = [self.codec.loads(i) for i in items]
+            self._cache_version = version
+            return self._cache
+
+    def _write(self, queue, update=None, check=None):
+        """Run a mutation and increment the version counter, atomically
+
+        Args:
+            queue (callable or tuple): Either a callable, which gets a
+                transaction pipeline and should queue the mutating commands
+                on it, or a (script name, args) tuple for running one of
+                self.lua_scripts (which increments the counter by itself).
+            update (callable, optional): Gets the list of cached items, and
+                should make the same change to it. If not set, or the list
+                has also been changed by someone else since it was cached,
+                the cache is dropped instead.
+            check (callable, optional): Gets the results of the queued
+                commands, and should return False if `update` would not
+                reflect what actually happened.
+
+        Returns:
+            list: Results of the queued commands (or the script). Errors are
+                returned, not raised. Inside a batch(), the mutation is only
+                queued, and None is returned.
+        """
+        with self._lock:
+            if self._batch is not None:
+                self._batch.append((queue, update, check))
+                return None
+            return self._execute([(queue, update, check)])[0]
+
+    def _execute(self, mutations):
+        """Run (queue, update, check) mutations, see _write(), in one
+        transaction, and update or drop the cache
+
+        Returns:
+            list: One list of results per mutation
+        """
+        from redis import ResponseError
+
+        with self._lock:
+            if len(mutations) == 1 and isinstance(mutations[0][0], tuple):
+                # A lone script is atomic by itself, so we don't need a
+                # pipeline; that also saves the SCRIPT EXISTS round trip
+                # redis-py does for pipelines containing scripts
+                try:
+                    version, *result = self._run(*mutations[0][0])
+                    results = [[result[0] if result else None]]
+                except ResponseError as e:
+                    version, results = None, [[e]]
+            else:
+                pipe = self.redis.pipeline()
+                sizes = []
+                for queue, _, _ in mutations:
+                    size = len(pipe)
+                    if isinstance(queue, tuple):
+                        self._run(*queue, client=pipe)
+                    else:
+                        queue(pipe)
+                        pipe.incr(self.version_key)
+                    sizes.append(len(pipe) - size)
+                pipe.get(self.version_key)
+                flat_results = pipe.execute(raise_on_error=False)
+                version = int(flat_results.pop() or 0)
+                results = []
+                for (queue, _, _), size in zip(mutations, sizes):
+                    result, flat_results = flat_results[:size], flat_results[size:]
+                    if not isinstance(queue, tuple):
+                        results.append(result[:-1])
+                    elif isinstance(result[0], Exception):
+                        results.append(result)
+                    else:
+                        results.append([result[0][1] if len(result[0]) > 1 else None])
+            if self._tracked_version is not None:
+                # Still up to date only if nobody else has made changes
+                # since, see track_version()
+                if version == self._tracked_version + len(mutations):
+                    self._tracked_version = version
+                else:
+                    self._tracked_version = None
+            if (
+                self._cache is not None and version == self._cache_version + len(mutations) and
+                not any(isinstance(r, Exception) for result in results for r in result) and
+                all(update is not None and (check is None or check(result))
+                    for (_, update, check), result in zip(mutations, results))
+            ):
+                for _, update, _ in mutations:
+                    update(self._cache)
+                self._cache_version = version
+            else:
+                self._cache = None
+            return results
+
+    def _invalidate(self):
+        with self._lock:
+            self._cache = None
+
+    @contextmanager
+    def batch(self):
+        """Collect mutations, and execute them in one transaction on exit
+
+        Usage:
+            with redis_list.batch():
+                redis_list.append(item)
+                del redis_list[3:5]
+
+        This takes one round trip to the server (two, if any mutation runs
+        a Lua script, since redis-py then checks that they are loaded),
+        however many mutations there are. Meanwhile, the list is locked for
+        other threads. Queued mutations return nothing, and can't be seen by
+        reads until the batch has been executed; pop() executes them at once
+        (see flush()). If any of them fails on the server, the first error is
+        raised on exit; the others will have been executed anyway. If the
+        block raises an exception, the mutations are discarded. Nested
+        batches are merged with the outermost one.
+        """
+        with self._lock:
+            if self._batch is not None:
+                yield self
+                return
+            self._batch = []
+            try:
+                yield self
+                self.flush()
+            finally:
+                self._batch = None
+
+    def flush(self):
+        """Execute mutations queued by batch() so far, if any"""
+        with self._lock:
+            if self._batch:
+                mutations, self._batch = self._batch, []
+                for result in self._execute(mutations):
+                    for r in result:
+                        if isinstance(r, Exception):
+                            raise r
+
     @property  # type: ignore
     def data(self):
-        return self.list_type([pickle.loads(i) for i in self.redis.lrange(self.key, 0, -1)])
+        if self.cache:
+            return self.list_type(self._get_cache()[:])
+        return self.list_type(list(self.stream()))
 
     @data.setter
     def data(self, value):
+        values = [self.codec.dumps(i) for i in value]
+
         def set_data(pipe):
-            pipe.multi()
             pipe.delete(self.key)
-            pipe.rpush(self.key, *[pickle.dumps(i, protocol=self.pickle_protocol) for i in value])
-        if value:
-            self.redis.transaction(set_data, self.key)
+            pipe.rpush(self.key, *values)
+
+        def update(cache):
+            cache[:] = [self.codec.loads(v) for v in values]
+
+        if values:
+            self._write(set_data, update)
 
     def __getitem__(self, i):
+        if self.cache:
+            if isinstance(i, slice):
+                return self.list_type(self._get_cache()[i])
+            return self._get_cache()[i]
         if isinstance(i, slice):
-            values = []
-            if i.step is None or i.step == 1:
-                i = slice_to_redis_range(i)
-                for v in self.redis.lrange(self.key, i.start, i.stop):
-                    if v is not None:
-                        values.append(pickle.loads(v))
-                    else:
-                        break
-            else:
-                for idx in range(i.start, i.stop, i.step):
-                    v = self.redis.lindex(self.key, idx)
-                    if v is not None:
-                        values.append(pickle.loads(v))
-                    else:
-                        break
-            return self.list_type(values)
+            return self.list_type([self.codec.loads(v) for v in self._run("get_at", self._position_args(i))])
         else:
             value = self.redis.lindex(self.key, i)
             if value is None:
                 raise IndexError("list index out of range")
-            return pickle.loads(value)
+            return self.codec.loads(value)
 
     def __setitem__(self, i, item):
-        from redis import ResponseError
         if isinstance(i, slice):
             raise NotImplementedError("__setitem__ with slices not implemented yet")
-        try:
-            self.redis.lset(self.key, i, pickle.dumps(item, protocol=self.pickle_protocol))
-        except ResponseError:
+        value = self.codec.dumps(item)
+
+        def update(cache):
+            cache[i] = self.codec.loads(value)
+
+        results = self._write(lambda pipe: pipe.lset(self.key, i, value), update)
+        if results is not None and isinstance(results[0], Exception):
             raise IndexError("list assignment index out of range")
 
     def __delitem__(self, i):
-        from redis import ResponseError
-        if isinstance(i, slice):
-            for idx in range(i.start, i.stop, i.step):
-                try:
-                    self.redis.lset(self.key, idx, "__DELETED__")
-                except ResponseError:
-                    pass
-        else:
-            try:
-                self.redis.lset(self.key, i, "__DELETED__")
-            except ResponseError:
-                raise IndexError("list assignment index out of range")
-        self.redis.lrem(self.key, 0, "__DELETED__")
+        def update(cache):
+            del cache[i]
+
+        results = self._write(
+            ("delete_at", self._position_args(i)), update,
+            lambda results: isinstance(i, slice) or len(results[0]) == 1
+        )
+        if results is not None and not isinstance(i, slice) and not results[0]:
+            raise IndexError("list assignment index out of range")
 
     def __len__(self):
+        if self.cache:
+            return len(self._get_cache())
         return self.redis.llen(self.key)
 
     def __iter__(self):
-        for i in self.redis.lrange(self.key, 0, -1):
-            yield pickle.loads(i)
+        if self.cache:
+            yield from self._get_cache()[:]
+        else:
+            yield from self.stream()
+
+    def __contains__(self, item):
+        if self.cache:
+            return item in self._get_cache()
+        return item in self.stream()
 
     def __iadd__(self, other):
         self.extend(other)
@@ -429,61 +1549,52 @@ class RedisList(UserList):
     def __imul__(self, n):
         if not isinstance(n, int):
             raise TypeError(f"can't multiply sequence by non-int of type '{n.__class__.__name__}'")
-        if n < 0:
-            n = 0
-        if n == 0:
+        if n <= 0:
             self.clear()
         elif n > 1:
-            items = self.redis.lrange(self.key, 0, -1)
-            if items:
-                def multiply(pipe):
-                    pipe.multi()
-                    for _ in range(1, n):
-                        pipe.rpush(self.key, *items)
-                self.redis.transaction(multiply, self.key)
+            self._write(("multiply", [n]), lambda cache: cache.extend(cache * (n - 1)))
         return self
 
     def append(self, item):
-        self.redis.rpush(self.key, pickle.dumps(item, protocol=self.pickle_protocol))
+        value = self.codec.dumps(item)
+        self._write(lambda pipe: pipe.rpush(self.key, value), lambda cache: cache.append(self.codec.loads(value)))
 
     def insert(self, i, item):
-        ref_item = self.redis.lindex(self.key, i)
-        if ref_item is None:
-            # Mimicking Python's list insert behaviour
-            if i >= 0:
-                self.append(item)
-            else:
-                self.redis.lpush(self.key, pickle.dumps(item, protocol=self.pickle_protocol))
-        else:
-            self.redis.linsert(self.key, "BEFORE", ref_item, pickle.dumps(item, protocol=self.pickle_protocol))
+        value = self.codec.dumps(item)
+        self._write(("insert", [i, value]), lambda cache: cache.insert(i, self.codec.loads(value)))
 
     def pop(self, i=-1):
-        if self.redis.llen(self.key) == 0:
-            raise IndexError("pop from empty list")
-        if i == -1:
-            value = self.redis.rpop(self.key)
-        elif i == 0:
-            value = self.redis.lpop(self.key)
-        else:
-            value = self.redis.lindex(self.key, i)
-            if value is None:
-                raise IndexError("pop index out of range")
-            del self[i]
-        return pickle.loads(value)
+        # We need the result right away, so it can't wait for a batch()
+        with self._lock:
+            self.flush()
+            deleted = self._execute(
+                [(("delete_at", [i]), lambda cache: cache.pop(i), lambda results: len(results[0]) == 1)]
+            )[0][0]
+        if isinstance(deleted, Exception):
+            raise deleted
+        if not deleted:
+            raise IndexError("pop from empty list" if not len(self) else "pop index out of range")
+        return self.codec.loads(deleted[0])
 
     def remove(self, item):
-        if self.redis.lrem(self.key, 1, item) == 0:
+        value = self.codec.dumps(item)
+        results = self._write(lambda pipe: pipe.lrem(self.key, 1, value))
+        if results is not None and results[0] == 0:
             raise ValueError("list.remove(x): x not in list")
 
     def clear(self):
-        del self.redis[self.key]
+        self._write(lambda pipe: pipe.delete(self.key), lambda cache: cache.clear())
 
     def extend(self, other):
         if isinstance(other, UserList) and other.data:
             other = other.data
         if other:
             # Will throw TypeError if `other` is not iterable:
-            self.redis.rpush(self.key, *[pickle.dumps(i, protocol=self.pickle_protocol) for i in other])
+            values = [self.codec.dumps(i) for i in other]
+            self._write(
+                lambda pipe: pipe.rpush(self.key, *values),
+                lambda cache: cache.extend(self.codec.loads(v) for v in values)
+            )
 
     # The following methods do not return a RedisList instance, as that
     # would require a new Redis key. Instead, they return an instance of the
@@ -500,3 +1611,1691 @@ class RedisList(UserList):
     def __mul__(self, n):
         return list(self.data * n)
     __rmul__ = __mul__
+
+
+class RedisTweetStore(RedisList):
+    """Redis storage for unique TweetLists, as an alternative to RedisList.
+
+    Instead of one Redis list of pickled items, uses these keys:
+        <key>:tweets      Hash of status ID -> pickled item
+        <key>:ids         List of status IDs, in list order
+        <key>:created     Sorted set of status IDs, scored by timestamp
+        <key>:flag:<flag> Set of status IDs having <flag> (see TWEET_FLAGS)
+        <key>:version     Version counter, like with RedisList
+
+    Every mutation is done by one Lua script, and so is atomic. Items must be
+    Tweets or TweetRecords, with unique IDs; adding one whose ID is already
+    stored does nothing. Besides the list interface, there are methods for
+    doing lookups, flag updates and range queries on the server side, which
+    TweetList uses when this is its `data`.
+
+    If `key` holds an old-style RedisList (and `overwrite` is False), its
+    contents are migrated on init, and the list is renamed to
+    <key>:list-backup.
+    """
+    is_tweet_store = True
+    lua_functions = LIST_LUA_FUNCTIONS + TWEET_STORE_LUA_FUNCTIONS
+    lua_scripts = TWEET_STORE_SCRIPTS
+
+    def __init__(self, redis, key, initlist=[], overwrite=False, **kwargs):
+        self.tweets_key = f"{key}:tweets"
+        self.ids_key = f"{key}:ids"
+        self.created_key = f"{key}:created"
+        self.flag_keys = {flag: f"{key}:flag:{flag}" for flag in TWEET_FLAGS}
+        super().__init__(redis, key, initlist=initlist, overwrite=overwrite, **kwargs)
+        if not overwrite and redis.type(key) == b"list":
+            self.migrate_from_list()
+
+    @classmethod
+    def wrap(
+        cls, userlist, redis, key, overwrite=False, unique=True, pickle_protocol=pickle.DEFAULT_PROTOCOL, cache=False,
+        page_size=DEFAULT_PAGE_SIZE, codec=None
+    ):
+        # IDs are unique by design, so `unique` doesn't need handling
+        return super().wrap(
+            userlist, redis, key, overwrite=overwrite, unique=False, pickle_protocol=pickle_protocol, cache=cache,
+            page_size=page_size, codec=codec)
+
+    @property
+    def store_keys(self):
+        """Every key used, in the order TWEET_STORE_SCRIPTS expects them"""
+        return [self.ids_key, self.tweets_key, self.created_key, *self.flag_keys.values()]
+
+    @property
+    def script_keys(self):
+        return [*self.store_keys, self.version_key]
+
+    def _item_args(self, item):
+        """Script arguments for storing `item`: id, encoded item, timestamp,
+        flags
+        """
+        if not isinstance(item, TWEET_TYPES):
+            raise TypeError(f"{self.__class__.__name__} can only store Tweets and TweetRecords")
+        return [
+            item.id, self.codec.dumps(item), get_timestamp(item),
+            *[int(test(item)) for test in TWEET_FLAGS.values()],
+        ]
+
+    def _fetch_page(self, start, stop):
+        version, items = self._scripts["fetch"](
+            keys=[self.ids_key, self.tweets_key, self.version_key], args=[start, stop - 1])
+        return int(version), [i for i in items if i is not None]
+
+    def migrate_from_list(self):
+        """Move the contents of an old-style RedisList at self.key to the
+        new keys, unless they already contain something
+        """
+        def migrate(pipe):
+            items = [self.codec.loads(i) for i in pipe.lrange(self.key, 0, -1)]
+            pipe.multi()
+            if items:
+                self._run("extend", [arg for item in items for arg in self._item_args(item)], client=pipe)
+            pipe.incr(self.version_key)
+            pipe.rename(self.key, f"{self.key}:list-backup")
+        if not self.redis.exists(self.tweets_key):
+            self.redis.transaction(migrate, self.key)
+
+    @property  # type: ignore
+    def data(self):
+        return super().data
+
+    @data.setter
+    def data(self, value):
+        # dict.fromkeys() dedupes by ID, while keeping order
+        args = [arg for item in dict.fromkeys(value) for arg in self._item_args(item)]
+
+        def set_data(pipe):
+            pipe.delete(self.key, *self.store_keys)
+            if args:
+                # Increments the version counter too, which is fine
+                self._run("extend", args, client=pipe)
+
+        self._write(set_data)
+
+    def __getitem__(self, i):
+        if self.cache:
+            items = self._get_cache()
+            return self.list_type(items[i]) if isinstance(i, slice) else items[i]
+        values = [self.codec.loads(v) for v in self._run("get_at", self._position_args(i)) if v is not None]
+        if isinstance(i, slice):
+            return self.list_type(values)
+        if not values:
+            raise IndexError("list index out of range")
+        return values[0]
+
+    def __setitem__(self, i, item):
+        if isinstance(i, slice):
+            raise NotImplementedError("__setitem__ with slices not implemented yet")
+        args = [i, *self._item_args(item)]
+
+        def update(cache):
+            cache[i] = self.codec.loads(args[2])
+
+        results = self._write(("set_at", args), update)
+        result = None if results is None else results[0]
+        if isinstance(result, Exception):
+            if "index out of range" in str(result):
+                raise IndexError("list assignment index out of range")
+            raise ValueError(str(result))
+
+    def __len__(self):
+        if self.cache:
+            return len(self._get_cache())
+        return self.redis.llen(self.ids_key)
+
+    def __contains__(self, item):
+        return isinstance(item, TWEET_TYPES) and self.contains_id(item.id)
+
+    def __imul__(self, n):
+        if not isinstance(n, int):
+            raise TypeError(f"can't multiply sequence by non-int of type '{n.__class__.__name__}'")
+        # Repeating would only add items whose IDs are already stored
+        if n <= 0:
+            self.clear()
+        return self
+
+    def append(self, item):
+        self.extend([item])
+
+    def extend(self, other):
+        if isinstance(other, UserList):
+            other = other.data
+        items = [self._item_args(item) for item in other]
+        if items:
+            self._write(
+                ("extend", [arg for item_args in items for arg in item_args]),
+                lambda cache: cache.extend(self.codec.loads(item_args[1]) for item_args in items),
+                # If some IDs were already stored, the cache can't be updated
+                lambda results: results[0] == len(items)
+            )
+
+    def insert(self, i, item):
+        args = [i, *self._item_args(item)]
+        self._write(
+            ("insert", args),
+            lambda cache: cache.insert(i, self.codec.loads(args[2])),
+            lambda results: results[0] == 1
+        )
+
+    def remove(self, item):
+        def update(cache):
+            cache.remove(item)
+
+        if not isinstance(item, TWEET_TYPES):
+            raise ValueError("list.remove(x): x not in list")
+        results = self._write(("delete_ids", [item.id]), update, lambda results: results[0] == 1)
+        if results is not None and not results[0]:
+            raise ValueError("list.remove(x): x not in list")
+
+    def clear(self):
+        self._write(lambda pipe: pipe.delete(*self.store_keys), lambda cache: cache.clear())
+
+    # Server side queries & updates
+    def contains_id(self, id):
+        return bool(self.redis.hexists(self.tweets_key, id))
+
+    def get_by_id(self, id):
+        """Return item with this status ID, or None"""
+        value = self.redis.hget(self.tweets_key, id)
+        return None if value is None else self.codec.loads(value)
+
+    def get_many(self, ids):
+        """Return items with these status IDs, in the same order, skipping
+        those that aren't stored
+        """
+        if not ids:
+            return []
+        return [self.codec.loads(v) for v in self.redis.hmget(self.tweets_key, list(ids)) if v is not None]
+
+    def update_item(self, item):
+        """Store a new version of an item, e.g. after a flag change, updating
+        all indexes along with it. Does nothing if its ID isn't stored.
+
+        Returns:
+            bool: Whether the item was stored, or None if in a batch()
+        """
+        args = self._item_args(item)
+
+        def update(cache):
+            for idx, cached in enumerate(cache):
+                if cached.id == item.id:
+                    cache[idx] = self.codec.loads(args[1])
+                    break
+
+        results = self._write(("update", args), update)
+        return None if results is None else bool(results[0])
+
+    def between(self, start=None, end=None):
+        """Return items created at or after `start` but before `end`, in
+        chronological order
+
+        Args:
+            start, end (float, int or None): UNIX timestamps. None means no
+                limit.
+        """
+        values = self._run("range", ["-inf" if start is None else start, "+inf" if end is None else f"({end}"])
+        return [self.codec.loads(v) for v in values if v is not None]
+
+    def remove_older_than(self, t):
+        """Remove all items created before UNIX timestamp `t`; return the
+        number of items removed (or None if in a batch())
+        """
+        results = self._write(("remove_older_than", [t]))
+        return None if results is None else results[0]
+
+    def flagged(self, flag, value=True):
+        """Return items that have (or, if `value` is False, don't have) a
+        flag from TWEET_FLAGS, in list order
+        """
+        keys = [self.ids_key, self.tweets_key, self.flag_keys[flag]]
+        values = self._scripts["flagged"](keys=keys, args=[int(value)])
+        return [self.codec.loads(v) for v in values if v is not None]
+
+    def earliest_ts(self):
+        items = self.redis.zrange(self.created_key, 0, 0, withscores=True)
+        return items[0][1] if items else 0
+
+    def latest_ts(self):
+        items = self.redis.zrange(self.created_key, -1, -1, withscores=True)
+        return items[0][1] if items else 0
+
+
+class SQLiteDatabase(BaseDatabase):
+    """TwitterHAL data in an SQLite database, in WAL mode.
+
+    Lists are stored as rows in the `list_items` table (see SQLiteList), so
+    every mutation only writes the rows it affects. Unique TweetLists use
+    SQLiteTweetStore, which also keeps the tweets' IDs, timestamps and flags
+    in indexed columns. Other values are stored, encoded, in the `key_values`
+    table.
+    """
+
+    def __init__(
+        self, db_path="twitterhal.sqlite3", pickle_protocol=pickle.DEFAULT_PROTOCOL, timeout=30.0, codec=None,
+        preload=()
+    ):
+        """Initialize the DB.
+
+        Args:
+            db_path (str, optional): Path to the database file. Default:
+                "twitterhal.sqlite3"
+            pickle_protocol (int, optional): https://docs.python.org/3.7/library/pickle.html#data-stream-format
+                Used by the default codec.
+            timeout (float, optional): Seconds to wait for another
+                connection's write lock to be released. Default: 30.
+            codec (optional): Encodes values and list items; see
+                twitterhal.serialization. Default:
+                PickleCodec(pickle_protocol).
+            preload (iterable of str, or bool, optional): See BaseDatabase.
+        """
+        super().__init__(preload=preload)
+        self._db_path = db_path
+        self._codec = codec or PickleCodec(pickle_protocol)
+        self._timeout = timeout
+        self._lock = RLock()
+        self._connection = None
+
+    def __setattr__(self, name, value):
+        if not name.startswith("_") and self._is_open:
+            if isinstance(value, list):
+                value = SQLiteList(
+                    self._connection, name, initlist=value, overwrite=True, lock=self._lock, codec=self._codec)
+            if isinstance(value, UserList) and not hasattr(value, "_sqlite_wrapped"):
+                value = self.get_list_class(value).wrap(
+                    value, self._connection, name, overwrite=True, lock=self._lock, codec=self._codec)
+        super().__setattr__(name, value)
+
+    def add_key(self, name, type_, default=None, **default_kwargs):
+        assert not self._is_open, "Cannot add to schema once DB has been opened"
+        if issubclass(type_, list):
+            # The list itself is created on open()
+            type_ = SQLiteList
+        super().add_key(name, type_, default=default, **default_kwargs)
+
+    def get_list_class(self, userlist):
+        """Return the class that should be used for wrapping `userlist`"""
+        if isinstance(userlist, TweetList) and userlist.unique:
+            return SQLiteTweetStore
+        return SQLiteList
+
+    def setattr(self, name, value):
+        # Lists write their own changes
+        if not isinstance(value, (list, UserList)):
+            self._write_key(name, value)
+        self._mark_clean(name, getattr(value, "change_count", None))
+
+    def _sync_keys(self, key=None):
+        # Lists are written on every mutation
+        return [k for k in super()._sync_keys(key) if not issubclass(self._schema[k].type, UserList)]
+
+    def _read_key(self, key):
+        item = self._schema[key]
+        if item.type is SQLiteList:
+            return SQLiteList(self._connection, key, lock=self._lock, codec=self._codec)
+        if issubclass(item.type, UserList):
+            default = item.get_default()
+            return self.get_list_class(default).wrap(
+                default,
+                self._connection,
+                key,
+                unique=item.default_kwargs.get("unique", False),
+                lock=self._lock,
+                codec=self._codec
+            )
+        with self._lock:
+            row = self._connection.execute("SELECT value FROM key_values WHERE key = ?", (key,)).fetchone()
+        return item.get_default() if row is None else self._codec.loads(row[0])
+
+    def _write_key(self, key, value):
+        data = self._codec.dumps(value)
+        with self._lock:
+            self._connection.execute("INSERT OR REPLACE INTO key_values (key, value) VALUES (?, ?)", (key, data))
+        return len(data)
+
+    def open(self):
+        if not self._is_open:
+            import sqlite3
+
+            with self._lock:
+                # isolation_level=None: autocommit, unless we BEGIN ourselves
+                self._connection = sqlite3.connect(
+                    self._db_path, timeout=self._timeout, isolation_level=None, check_same_thread=False)
+                self._connection.execute("PRAGMA journal_mode=WAL")
+                self._connection.execute("PRAGMA synchronous=NORMAL")
+                SQLiteList.create_tables(self._connection)
+                super().open()
+
+    def close(self):
+        if self._is_open:
+            with self._lock:
+                self.sync()
+                self._connection.close()
+            super().close()
+
+    def sync(self, key=None):
+        """Write the non-list values that have changed since they were last
+        written (see is_dirty()), or just `key`'s value if it has, and
+        checkpoint the WAL
+        """
+        with self._lock:
+            self._write_dirty(self._write_key, key)
+            self._connection.execute("PRAGMA wal_checkpoint(PASSIVE)")
+
+
+class SQLiteList(UserList):
+    _sqlite_wrapped = True
+    # Extra columns SQLiteTweetStore uses, in order
+    tweet_columns = ["id", "created_at", "in_reply_to_status_id", *[f"flag_{flag}" for flag in TWEET_FLAGS]]
+    # How to add rows; SQLiteTweetStore skips IDs that are already stored
+    insert_sql = "INSERT"
+
+    def __init__(
+        self, connection, key, initlist=[], overwrite=False, lock=None, pickle_protocol=pickle.DEFAULT_PROTOCOL,
+        list_type=list, page_size=DEFAULT_PAGE_SIZE, codec=None
+    ):
+        """A UserList implementation of a list stored in SQLite.
+
+        Items are encoded into rows of the `list_items` table, ordered by
+        their `position` column. Positions are not necessarily contiguous, so
+        appending, updating or deleting an item only touches that item's
+        row; inserting also renumbers the rows after it. Mutations involving
+        several statements are done in one transaction.
+
+        Like RedisList, methods that return a new list return an instance of
+        `list_type`, and UserLists are preferably "wrapped" with
+        SQLiteList.wrap().
+
+        Args:
+            connection (sqlite3.Connection): Should be in autocommit mode
+                (isolation_level=None)
+            key (str): Identifies this list in the table
+            initlist (Sequence, optional): Initial data; see comments for
+                `overwrite`.
+            overwrite (bool, optional): If True, will overwrite any
+                pre-existing contents for this key with the contents of
+                `initlist`. If False, the contents of `initlist` will be
+                disregarded. Default: False.
+            lock (threading.RLock, optional): Lock to hold while using
+                `connection`, if it is shared with others.
+            pickle_protocol (int, optional): https://docs.python.org/3.7/library/pickle.html#data-stream-format
+            list_type (type, optional): Default: list
+            page_size (int, optional): Number of rows to fetch at a time when
+                iterating. Default: DEFAULT_PAGE_SIZE.
+            codec (optional): Encodes the items; see
+                twitterhal.serialization. Default:
+                PickleCodec(pickle_protocol).
+        """
+        self.connection = connection
+        self.key = key
+        self.pickle_protocol = pickle_protocol
+        self.codec = codec or PickleCodec(pickle_protocol)
+        self.list_type = list_type
+        self.page_size = page_size
+        self._lock = lock or RLock()
+        if overwrite:
+            if isinstance(initlist, UserList):
+                initlist = initlist.data
+            self.data = initlist
+
+    @classmethod
+    def wrap(
+        cls, userlist, connection, key, overwrite=False, unique=False, lock=None,
+        pickle_protocol=pickle.DEFAULT_PROTOCOL, page_size=DEFAULT_PAGE_SIZE, codec=None
+    ):
+        """Wrap an existing list, like RedisList.wrap() does
+
+        Args:
+            userlist (collections.UserList)
+            connection (sqlite3.Connection)
+            key (str)
+            overwrite (bool, optional): If True, will overwrite any
+                pre-existing contents for this key with the contents of
+                userlist.data. Default: False.
+            unique (bool, optional): If True, and `overwrite` is False, will
+                make sure data only contains unique items.
+            lock, pickle_protocol, page_size, codec (optional): See
+                SQLiteList.__init__().
+
+        Returns:
+            "Wrapped" UserList
+        """
+        assert isinstance(userlist, UserList)
+        sqlite_list = cls(
+            connection, key, initlist=userlist.data, overwrite=overwrite, lock=lock, pickle_protocol=pickle_protocol,
+            list_type=type(userlist), page_size=page_size, codec=codec)
+        if unique and not overwrite and not isinstance(sqlite_list, SQLiteTweetStore):
+            sqlite_list.data = list(dict.fromkeys(sqlite_list))
+        userlist.data = sqlite_list
+        userlist._sqlite_wrapped = True
+        return userlist
+
+    @classmethod
+    def create_tables(cls, connection):
+        """Create tables and indexes, and add any missing flag columns"""
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS key_values (key TEXT NOT NULL PRIMARY KEY, value BLOB NOT NULL)")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS list_items (key TEXT NOT NULL, position INTEGER NOT NULL, "
+            "id INTEGER, created_at REAL, in_reply_to_status_id INTEGER, item BLOB NOT NULL, "
+            "PRIMARY KEY (key, position))")
+        existing = {row[1] for row in connection.execute("PRAGMA table_info(list_items)")}
+        for column in cls.tweet_columns:
+            if column not in existing:
+                connection.execute(f"ALTER TABLE list_items ADD COLUMN {column} INTEGER")
+        # NULL IDs (plain SQLiteLists) don't count as duplicates
+        connection.execute("CREATE UNIQUE INDEX IF NOT EXISTS list_items_id ON list_items (key, id)")
+        for column in cls.tweet_columns[1:]:
+            connection.execute(f"CREATE INDEX IF NOT EXISTS list_items_{column} ON list_items (key, {column})")
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            # IMMEDIATE, so other connections can't write in between our
+            # reads and writes
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.connection
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+            self.connection.execute("COMMIT")
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            return self.connection.execute(sql, params)
+
+    def _row(self, item):
+        """Values for tweet_columns + item"""
+        return (*[None] * len(self.tweet_columns), self.codec.dumps(item))
+
+    def _insert(self, rows, first_position):
+        """Insert rows from _row() at consecutive positions"""
+        columns = ", ".join(self.tweet_columns)
+        placeholders = ", ".join(["?"] * (len(self.tweet_columns) + 3))
+        self.connection.executemany(
+            f"{self.insert_sql} INTO list_items (key, position, {columns}, item) VALUES ({placeholders})",
+            [(self.key, position, *row) for position, row in enumerate(rows, start=first_position)])
+
+    def _next_position(self):
+        return self.connection.execute(
+            "SELECT COALESCE(MAX(position), 0) + 1 FROM list_items WHERE key = ?", (self.key,)).fetchone()[0]
+
+    def _positions(self, offset, limit=-1):
+        """Table positions of the items at list indexes offset..offset+limit-1"""
+        return [row[0] for row in self.connection.execute(
+            "SELECT position FROM list_items WHERE key = ? ORDER BY position LIMIT ? OFFSET ?",
+            (self.key, limit, offset))]
+
+    def _normalize_index(self, i, error):
+        length = len(self)
+        if i < 0:
+            i += length
+        if not 0 <= i < length:
+            raise IndexError(error)
+        return i
+
+    def _delete_positions(self, positions):
+        for idx in range(0, len(positions), 500):
+            chunk = positions[idx:idx + 500]
+            self.connection.execute(
+                f"DELETE FROM list_items WHERE key = ? AND position IN ({', '.join(['?'] * len(chunk))})",
+                (self.key, *chunk))
+
+    def _select(self, where="", params=(), order="position", limit=-1, offset=0):
+        """Return unpickled items from rows matching `where`"""
+        with self._lock:
+            rows = self.connection.execute(
+                f"SELECT item FROM list_items WHERE key = ? {where} ORDER BY {order} LIMIT ? OFFSET ?",
+                (self.key, *params, limit, offset)).fetchall()
+        return [self.codec.loads(row[0]) for row in rows]
+
+    def stream(self, page_size=None, start=0):
+        """Iterate over the items, starting at index `start`, fetching
+        `page_size` rows at a time
+        """
+        page_size = page_size or self.page_size
+        position = None
+        while True:
+            with self._lock:
+                # Only the first page needs an OFFSET; the others continue
+                # after the last position we got
+                rows = self.connection.execute(
+                    "SELECT position, item FROM list_items WHERE key = ? AND position > ? "
+                    "ORDER BY position LIMIT ? OFFSET ?",
+                    (self.key, -2 ** 63 if position is None else position, page_size,
+                     start if position is None else 0)).fetchall()
+            for position, item in rows:
+                yield self.codec.loads(item)
+            if len(rows) < page_size:
+                return
+
+    @property  # type: ignore
+    def data(self):
+        return self.list_type(list(self.stream()))
+
+    @data.setter
+    def data(self, value):
+        rows = [self._row(item) for item in value]
+        with self._transaction():
+            self.connection.execute("DELETE FROM list_items WHERE key = ?", (self.key,))
+            self._insert(rows, 1)
+
+    def __sizeof__(self):
+        return self._execute("SELECT COALESCE(SUM(LENGTH(item)), 0) FROM list_items WHERE key = ?", (self.key,)) \
+            .fetchone()[0]
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            with self._lock:
+                indexes = range(*i.indices(len(self)))
+                if not indexes:
+                    return self.list_type([])
+                low = min(indexes[0], indexes[-1])
+                items = self._select(limit=max(indexes[0], indexes[-1]) - low + 1, offset=low)
+            return self.list_type([items[idx - low] for idx in indexes])
+        with self._lock:
+            items = self._select(limit=1, offset=self._normalize_index(i, "list index out of range"))
+        if not items:
+            raise IndexError("list index out of range")
+        return items[0]
+
+    def __setitem__(self, i, item):
+        if isinstance(i, slice):
+            raise NotImplementedError("__setitem__ with slices not implemented yet")
+        row = self._row(item)
+        with self._transaction():
+            position = self._positions(self._normalize_index(i, "list assignment index out of range"), 1)[0]
+            columns = ", ".join(f"{column} = ?" for column in self.tweet_columns)
+            self.connection.execute(
+                f"UPDATE list_items SET {columns}, item = ? WHERE key = ? AND position = ?",
+                (*row, self.key, position))
+
+    def __delitem__(self, i):
+        with self._transaction():
+            if isinstance(i, slice):
+                indexes = range(*i.indices(len(self)))
+                if not indexes:
+                    return
+                low = min(indexes[0], indexes[-1])
+                positions = self._positions(low, max(indexes[0], indexes[-1]) - low + 1)
+                self._delete_positions([positions[idx - low] for idx in indexes])
+            else:
+                i = self._normalize_index(i, "list assignment index out of range")
+                self._delete_positions(self._positions(i, 1))
+
+    def __len__(self):
+        return self._execute("SELECT COUNT(*) FROM list_items WHERE key = ?", (self.key,)).fetchone()[0]
+
+    def __iter__(self):
+        yield from self.stream()
+
+    def __contains__(self, item):
+        return item in self.stream()
+
+    def __iadd__(self, other):
+        self.extend(other)
+        return self
+
+    def __imul__(self, n):
+        if not isinstance(n, int):
+            raise TypeError(f"can't multiply sequence by non-int of type '{n.__class__.__name__}'")
+        if n <= 0:
+            self.clear()
+        elif n > 1:
+            self.extend(list(self.stream()) * (n - 1))
+        return self
+
+    def append(self, item):
+        columns = ", ".join(self.tweet_columns)
+        placeholders = ", ".join(["?"] * (len(self.tweet_columns) + 1))
+        # One statement, so no explicit transaction is needed
+        self._execute(
+            f"{self.insert_sql} INTO list_items (key, position, {columns}, item) "
+            f"SELECT ?, COALESCE(MAX(position), 0) + 1, {placeholders} FROM list_items WHERE key = ?",
+            (self.key, *self._row(item), self.key))
+
+    def insert(self, i, item):
+        row = self._row(item)
+        with self._transaction():
+            length = len(self)
+            if i < 0:
+                i = max(i + length, 0)
+            if i >= length:
+                self._insert([row], self._next_position())
+                return
+            position = self._positions(i, 1)[0]
+            # Make room, in two steps so (key, position) stays unique
+            self.connection.execute(
+                "UPDATE list_items SET position = -position - 1 WHERE key = ? AND position >= ?", (self.key, position))
+            self.connection.execute(
+                "UPDATE list_items SET position = -position WHERE key = ? AND position < 0", (self.key,))
+            self._insert([row], position)
+
+    def pop(self, i=-1):
+        with self._transaction():
+            if not len(self):
+                raise IndexError("pop from empty list")
+            i = self._normalize_index(i, "pop index out of range")
+            position = self._positions(i, 1)[0]
+            item = self._select("AND position = ?", (position,))[0]
+            self._delete_positions([position])
+        return item
+
+    def remove(self, item):
+        with self._transaction():
+            for idx, other in enumerate(self.stream()):
+                if other == item:
+                    self._delete_positions(self._positions(idx, 1))
+                    return
+        raise ValueError("list.remove(x): x not in list")
+
+    def clear(self):
+        self._execute("DELETE FROM list_items WHERE key = ?", (self.key,))
+
+    def extend(self, other):
+        if isinstance(other, UserList):
+            other = other.data
+        rows = [self._row(item) for item in other]
+        if rows:
+            with self._transaction():
+                self._insert(rows, self._next_position())
+
+    def reverse(self):
+        self.data = self.data[::-1]
+
+    def sort(self, *args, **kwargs):
+        items = list(self.stream())
+        items.sort(*args, **kwargs)
+        self.data = items
+
+    # Like with RedisList, these return an instance of the underlying
+    # sequence type (self.list_type)
+    def copy(self):
+        return self.data
+
+    def __add__(self, other):
+        return list(self.data + other)
+
+    def __radd__(self, other):
+        return list(list(other) + self.data)
+
+    def __mul__(self, n):
+        return list(self.data * n)
+    __rmul__ = __mul__
+
+
+class SQLiteTweetStore(SQLiteList):
+    """SQLite storage for unique TweetLists, like RedisTweetStore.
+
+    Items must be Tweets or TweetRecords, with unique IDs; adding one whose ID
+    is already stored does nothing. Their ID, timestamp, in_reply_to_status_id
+    and flags (see TWEET_FLAGS) are also stored in indexed columns, so the
+    lookups, flag updates and range queries TweetList uses are single
+    indexed statements.
+    """
+    is_tweet_store = True
+    insert_sql = "INSERT OR IGNORE"
+
+    def __init__(self, connection, key, initlist=[], overwrite=False, **kwargs):
+        super().__init__(connection, key, initlist=initlist, overwrite=overwrite, **kwargs)
+        if not overwrite:
+            self.fill_columns()
+
+    def _row(self, item):
+        if not isinstance(item, TWEET_TYPES):
+            raise TypeError(f"{self.__class__.__name__} can only store Tweets and TweetRecords")
+        return (
+            item.id, get_timestamp(item), getattr(item, "in_reply_to_status_id", None),
+            *[int(test(item)) for test in TWEET_FLAGS.values()],
+            self.codec.dumps(item),
+        )
+
+    def fill_columns(self):
+        """Rewrite rows stored by a plain SQLiteList under our key, which
+        lack the tweet columns
+        """
+        with self._transaction():
+            if self.connection.execute(
+                "SELECT 1 FROM list_items WHERE key = ? AND id IS NULL LIMIT 1", (self.key,)
+            ).fetchone() is not None:
+                # dict.fromkeys() dedupes by ID, while keeping order
+                rows = [self._row(item) for item in dict.fromkeys(self.stream())]
+                self.connection.execute("DELETE FROM list_items WHERE key = ?", (self.key,))
+                self._insert(rows, 1)
+
+    def __setitem__(self, i, item):
+        import sqlite3
+
+        try:
+            super().__setitem__(i, item)
+        except sqlite3.IntegrityError:
+            raise ValueError(f"ID {item.id} is already stored")
+
+    def __contains__(self, item):
+        return isinstance(item, TWEET_TYPES) and self.contains_id(item.id)
+
+    def __imul__(self, n):
+        if not isinstance(n, int):
+            raise TypeError(f"can't multiply sequence by non-int of type '{n.__class__.__name__}'")
+        # Repeating would only add items whose IDs are already stored
+        if n <= 0:
+            self.clear()
+        return self
+
+    def remove(self, item):
+        if not isinstance(item, TWEET_TYPES) or not self._execute(
+            "DELETE FROM list_items WHERE key = ? AND id = ?", (self.key, item.id)
+        ).rowcount:
+            raise ValueError("list.remove(x): x not in list")
+
+    def contains_id(self, id):
+        row = self._execute("SELECT 1 FROM list_items WHERE key = ? AND id = ?", (self.key, id)).fetchone()
+        return row is not None
+
+    def get_by_id(self, id):
+        """Return item with this status ID, or None"""
+        items = self._select("AND id = ?", (id,))
+        return items[0] if items else None
+
+    def get_many(self, ids):
+        """Return items with these status IDs, in the same order, skipping
+        those that aren't stored
+        """
+        ids = list(ids)
+        items = {}
+        with self._lock:
+            for idx in range(0, len(ids), 500):
+                chunk = ids[idx:idx + 500]
+                rows = self.connection.execute(
+                    f"SELECT id, item FROM list_items WHERE key = ? AND id IN ({', '.join(['?'] * len(chunk))})",
+                    (self.key, *chunk))
+                items.update(rows)
+        return [self.codec.loads(items[id]) for id in ids if id in items]
+
+    def update_item(self, item):
+        """Store a new version of an item, e.g. after a flag change. Does
+        nothing if its ID isn't stored.
+
+        Returns:
+            bool: Whether the item was stored
+        """
+        columns = ", ".join(f"{column} = ?" for column in self.tweet_columns[1:])
+        row = self._row(item)
+        return bool(self._execute(
+            f"UPDATE list_items SET {columns}, item = ? WHERE key = ? AND id = ?", (*row[1:], self.key, item.id)
+        ).rowcount)
+
+    def between(self, start=None, end=None):
+        """Return items created at or after `start` but before `end`, in
+        chronological order
+
+        Args:
+            start, end (float, int or None): UNIX timestamps. None means no
+                limit.
+        """
+        return self._select(
+            "AND created_at >= ? AND created_at < ?",
+            (float("-inf") if start is None else start, float("inf") if end is None else end),
+            order="created_at, id")
+
+    def remove_older_than(self, t):
+        """Remove all items created before UNIX timestamp `t`; return the
+        number of items removed
+        """
+        return self._execute("DELETE FROM list_items WHERE key = ? AND created_at < ?", (self.key, t)).rowcount
+
+    def flagged(self, flag, value=True):
+        """Return items that have (or, if `value` is False, don't have) a
+        flag from TWEET_FLAGS, in list order
+        """
+        if flag not in TWEET_FLAGS:
+            raise KeyError(flag)
+        return self._select(f"AND flag_{flag} = ?", (int(value),))
+
+    def earliest_ts(self):
+        return self._execute("SELECT MIN(created_at) FROM list_items WHERE key = ?", (self.key,)).fetchone()[0] or 0
+
+    def latest_ts(self):
+        return self._execute("SELECT MAX(created_at) FROM list_items WHERE key = ?", (self.key,)).fetchone()[0] or 0
+
+
+class LogDatabase(BaseDatabase):
+    """TwitterHAL data in append-only logs, for single-node setups without
+    Redis.
+
+    Every list is stored in a SegmentLog of its own, in the directory
+    `<db_path>/<key>` (see LogList), so mutations only append records for
+    the items they affect. Unique TweetLists use LogTweetStore, which keeps
+    the tweets' IDs, timestamps and flags in its in-memory index. Other
+    values are stored, encoded, in `<db_path>/<key>.pickle`.
+
+    When a list is first accessed, its index is rebuilt from the record
+    headers, without reading any items. sync() flushes the logs to disk, and compacts those
+    where superseded records take up more than `compact_ratio` of the log.
+    """
+
+    def __init__(
+        self, db_path="twitterhal.log", pickle_protocol=pickle.DEFAULT_PROTOCOL, segment_size=DEFAULT_SEGMENT_SIZE,
+        compact_ratio=0.5, codec=None, preload=()
+    ):
+        """Initialize the DB.
+
+        Args:
+            db_path (str, optional): Path to the database directory. Default:
+                "twitterhal.log"
+            pickle_protocol (int, optional): https://docs.python.org/3.7/library/pickle.html#data-stream-format
+                Used by the default codec.
+            segment_size (int, optional): Size in bytes at which a new log
+                segment is started. Default: DEFAULT_SEGMENT_SIZE (16 MiB)
+            compact_ratio (float, optional): sync() compacts logs where more
+                than this fraction is superseded records. Default: 0.5
+            codec (optional): Encodes values and list items; see
+                twitterhal.serialization. Default:
+                PickleCodec(pickle_protocol).
+            preload (iterable of str, or bool, optional): See BaseDatabase.
+        """
+        super().__init__(preload=preload)
+        self._db_path = db_path
+        self._codec = codec or PickleCodec(pickle_protocol)
+        self._segment_size = segment_size
+        self._compact_ratio = compact_ratio
+        self._lock = RLock()
+        self._logs = {}
+        self._lists = {}
+
+    def __setattr__(self, name, value):
+        if not name.startswith("_") and self._is_open:
+            if isinstance(value, list):
+                value = LogList(
+                    self._get_log(name), initlist=value, overwrite=True, lock=self._lock, codec=self._codec)
+            if isinstance(value, UserList) and not hasattr(value, "_log_wrapped"):
+                value = self.get_list_class(value).wrap(
+                    value, self._get_log(name), overwrite=True, lock=self._lock, codec=self._codec)
+        if not name.startswith("_") and hasattr(value, "_log_wrapped"):
+            # Kept for sync()
+            self._lists[name] = value if isinstance(value, LogList) else value.data
+        super().__setattr__(name, value)
+
+    def add_key(self, name, type_, default=None, **default_kwargs):
+        assert not self._is_open, "Cannot add to schema once DB has been opened"
+        if issubclass(type_, list):
+            # The list itself is created on open()
+            type_ = LogList
+        super().add_key(name, type_, default=default, **default_kwargs)
+
+    def get_list_class(self, userlist):
+        """Return the class that should be used for wrapping `userlist`"""
+        if isinstance(userlist, TweetList) and userlist.unique:
+            return LogTweetStore
+        return LogList
+
+    def _get_log(self, key):
+        if key not in self._logs:
+            self._logs[key] = SegmentLog(os.path.join(self._db_path, key), segment_size=self._segment_size)
+        return self._logs[key]
+
+    def _value_path(self, key):
+        return os.path.join(self._db_path, f"{key}.pickle")
+
+    def _read_key(self, key):
+        item = self._schema[key]
+        if item.type is LogList:
+            value = LogList(self._get_log(key), lock=self._lock, codec=self._codec)
+        elif issubclass(item.type, UserList):
+            default = item.get_default()
+            value = self.get_list_class(default).wrap(
+                default,
+                self._get_log(key),
+                unique=item.default_kwargs.get("unique", False),
+                lock=self._lock,
+                codec=self._codec
+            )
+        elif os.path.exists(self._value_path(key)):
+            with open(self._value_path(key), "rb") as f:
+                return self._codec.loads(f.read())
+        else:
+            return item.get_default()
+        # Kept for sync()
+        self._lists[key] = value if isinstance(value, LogList) else value.data
+        return value
+
+    def setattr(self, name, value):
+        # Lists write their own changes
+        if not isinstance(value, (list, UserList)):
+            self._write_key(name, value)
+        self._mark_clean(name, getattr(value, "change_count", None))
+
+    def _sync_keys(self, key=None):
+        # Lists are written on every mutation
+        return [k for k in super()._sync_keys(key) if not issubclass(self._schema[k].type, UserList)]
+
+    def _write_key(self, key, value):
+        data = self._codec.dumps(value)
+        path = self._value_path(key)
+        # Write to a new file and replace the old one, so a crash can't leave
+        # half a pickle
+        with open(path + ".tmp", "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        return len(data)
+
+    def open(self):
+        if not self._is_open:
+            with self._lock:
+                os.makedirs(self._db_path, exist_ok=True)
+                super().open()
+
+    def close(self):
+        if self._is_open:
+            with self._lock:
+                self.sync()
+                for log in self._logs.values():
+                    log.close()
+                self._logs = {}
+                self._lists = {}
+            super().close()
+
+    def sync(self, key=None):
+        """Write the non-list values that have changed since they were last
+        written (see is_dirty()), or just `key`'s value if it has, compact
+        logs with too much garbage, and flush the logs to disk
+        """
+        with self._lock:
+            self._write_dirty(self._write_key, key)
+            for k, log_list in self._lists.items():
+                if key is None or k == key:
+                    if log_list.garbage > self._compact_ratio:
+                        log_list.compact()
+                    log_list.log.flush(fsync=True)
+
+
+class SegmentLog:
+    """Append-only log of records, in segment files in one directory.
+
+    A record is a LOG_HEADER followed by its body. Segments are named
+    <number>.log; records are appended to the last one, and a new one is
+    started when it has reached `segment_size` bytes. Bodies are read through
+    mmap.
+
+    rewrite() replaces all segments at once: the new ones are written to
+    `<path>.new` and then swapped in, so an interrupted rewrite leaves either
+    the old or the new log.
+    """
+
+    def __init__(self, path, segment_size=DEFAULT_SEGMENT_SIZE):
+        self.path = path
+        self.segment_size = segment_size
+        self._file = None
+        self._maps = {}
+        self._recover()
+        os.makedirs(path, exist_ok=True)
+        self.segments = sorted(int(name[:-4]) for name in os.listdir(path) if name.endswith(".log"))
+        self.size = sum(os.path.getsize(self._segment_path(segment)) for segment in self.segments)
+
+    def _recover(self):
+        """Finish or undo a rewrite() that was interrupted"""
+        import shutil
+
+        new_path, old_path = self.path + ".new", self.path + ".old"
+        if os.path.isdir(new_path):
+            if os.path.isdir(self.path):
+                # Interrupted before the swap
+                shutil.rmtree(new_path)
+            else:
+                os.rename(new_path, self.path)
+        if os.path.isdir(old_path):
+            shutil.rmtree(old_path)
+
+    def _segment_path(self, segment, path=None):
+        return os.path.join(path or self.path, f"{segment:08d}.log")
+
+    def _close_files(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        for segment_map in self._maps.values():
+            segment_map.close()
+        self._maps = {}
+
+    def scan(self):
+        """Return (type, seq, id, created_at, in_reply_to_status_id, flags,
+        segment, offset, length) for every record, where offset and length
+        are those of the body. Only the headers are read.
+
+        A record that was cut short at the end of a segment (i.e. by a crash)
+        is truncated.
+        """
+        records = []
+        for segment in self.segments:
+            path = self._segment_path(segment)
+            size = os.path.getsize(path)
+            offset = 0
+            if size:
+                with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as segment_map:
+                    while offset + LOG_HEADER.size <= size:
+                        header = LOG_HEADER.unpack_from(segment_map, offset)
+                        body_offset = offset + LOG_HEADER.size
+                        if not LOG_PUT <= header[0] <= LOG_DELETE or body_offset + header[-1] > size:
+                            break
+                        records.append((*header[:-1], segment, body_offset, header[-1]))
+                        offset = body_offset + header[-1]
+            if offset < size:
+                self._close_files()
+                with open(path, "r+b") as f:
+                    f.truncate(offset)
+                self.size -= size - offset
+        return records
+
+    def _write(self, f, record):
+        header = LOG_HEADER.pack(*record[:-1], len(record[-1]))
+        f.write(header)
+        f.write(record[-1])
+        return len(header) + len(record[-1])
+
+    def append(self, records):
+        """Append (type, seq, id, created_at, in_reply_to_status_id, flags,
+        body) records; return the (segment, offset, length) of each body
+        """
+        locations = []
+        for record in records:
+            if self._file is None or self._file.tell() >= self.segment_size:
+                if self._file is not None:
+                    self._file.close()
+                if not self.segments or os.path.getsize(self._segment_path(self.segments[-1])) >= self.segment_size:
+                    self.segments.append(self.segments[-1] + 1 if self.segments else 1)
+                self._file = open(self._segment_path(self.segments[-1]), "ab")
+            offset = self._file.tell() + LOG_HEADER.size
+            self.size += self._write(self._file, record)
+            locations.append((self.segments[-1], offset, len(record[-1])))
+        if self._file is not None:
+            # Make it visible to readers (and other processes)
+            self._file.flush()
+        return locations
+
+    def read(self, segment, offset, length):
+        """Return the body at this location"""
+        segment_map = self._maps.get(segment)
+        if segment_map is None or offset + length > len(segment_map):
+            # Not mapped yet, or the segment has grown since
+            if segment_map is not None:
+                segment_map.close()
+            with open(self._segment_path(segment), "rb") as f:
+                segment_map = self._maps[segment] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return segment_map[offset:offset + length]
+
+    def rewrite(self, records):
+        """Replace all records with `records` (same format as for append());
+        return the (segment, offset, length) of each body
+
+        `records` may be a generator reading bodies from the current log.
+        """
+        import shutil
+
+        new_path = self.path + ".new"
+        if os.path.isdir(new_path):
+            shutil.rmtree(new_path)
+        os.makedirs(new_path)
+        locations, segments, size = [], [], 0
+        f = None
+        try:
+            for record in records:
+                if f is None or f.tell() >= self.segment_size:
+                    if f is not None:
+                        f.flush()
+                        os.fsync(f.fileno())
+                        f.close()
+                    segments.append(len(segments) + 1)
+                    f = open(self._segment_path(segments[-1], new_path), "wb")
+                locations.append((segments[-1], f.tell() + LOG_HEADER.size, len(record[-1])))
+                size += self._write(f, record)
+            if f is not None:
+                f.flush()
+                os.fsync(f.fileno())
+        finally:
+            if f is not None:
+                f.close()
+        self._close_files()
+        os.rename(self.path, self.path + ".old")
+        os.rename(new_path, self.path)
+        shutil.rmtree(self.path + ".old")
+        self.segments, self.size = segments, size
+        return locations
+
+    def flush(self, fsync=False):
+        if self._file is not None:
+            self._file.flush()
+            if fsync:
+                os.fsync(self._file.fileno())
+
+    def close(self):
+        self.flush(fsync=True)
+        self._close_files()
+
+
+class LogList(UserList):
+    _log_wrapped = True
+    # Record type used for storing items
+    put_type = LOG_PUT
+
+    def __init__(
+        self, log, initlist=[], overwrite=False, lock=None, pickle_protocol=pickle.DEFAULT_PROTOCOL, list_type=list,
+        page_size=DEFAULT_PAGE_SIZE, codec=None
+    ):
+        """A UserList implementation of a list stored in a SegmentLog.
+
+        Every mutation appends records for the affected items: a new version
+        of an item, or a deletion. The index, mapping each item's ID to its
+        sequence number (which orders the list) and location in the log, is
+        kept in memory, and rebuilt from the record headers on startup. Items
+        are only read from the log (and decoded) when accessed. Items
+        inserted in the middle get a sequence number between those of their
+        neighbours; reverse() and sort() rewrite the log.
+
+        Superseded records are left in the log until compact() rewrites it;
+        `garbage` is the fraction of the log they take up.
+
+        Like RedisList, methods that return a new list return an instance of
+        `list_type`, and UserLists are preferably "wrapped" with
+        LogList.wrap().
+
+        Args:
+            log (SegmentLog)
+            initlist (Sequence, optional): Initial data; see comments for
+                `overwrite`.
+            overwrite (bool, optional): If True, will overwrite any
+                pre-existing contents of the log with the contents of
+                `initlist`. If False, the contents of `initlist` will be
+                disregarded. Default: False.
+            lock (threading.RLock, optional): Lock to hold while using the
+                log, if it is shared with others.
+            pickle_protocol (int, optional): https://docs.python.org/3.7/library/pickle.html#data-stream-format
+            list_type (type, optional): Default: list
+            page_size (int, optional): Number of items to read at a time
+                (while holding the lock) when iterating. Default:
+                DEFAULT_PAGE_SIZE.
+            codec (optional): Encodes the items; see
+                twitterhal.serialization. Default:
+                PickleCodec(pickle_protocol).
+        """
+        self.log = log
+        self.pickle_protocol = pickle_protocol
+        self.codec = codec or PickleCodec(pickle_protocol)
+        self.list_type = list_type
+        self.page_size = page_size
+        self._lock = lock or RLock()
+        self._load()
+        if overwrite:
+            if isinstance(initlist, UserList):
+                initlist = initlist.data
+            self.data = initlist
+
+    @classmethod
+    def wrap(
+        cls, userlist, log, overwrite=False, unique=False, lock=None, pickle_protocol=pickle.DEFAULT_PROTOCOL,
+        page_size=DEFAULT_PAGE_SIZE, codec=None
+    ):
+        """Wrap an existing list, like RedisList.wrap() does
+
+        Args:
+            userlist (collections.UserList)
+            log (SegmentLog)
+            overwrite (bool, optional): If True, will overwrite any
+                pre-existing contents of the log with the contents of
+                userlist.data. Default: False.
+            unique (bool, optional): If True, and `overwrite` is False, will
+                make sure data only contains unique items.
+            lock, pickle_protocol, page_size, codec (optional): See
+                LogList.__init__().
+
+        Returns:
+            "Wrapped" UserList
+        """
+        assert isinstance(userlist, UserList)
+        log_list = cls(
+            log, initlist=userlist.data, overwrite=overwrite, lock=lock, pickle_protocol=pickle_protocol,
+            list_type=type(userlist), page_size=page_size, codec=codec)
+        if unique and not overwrite and not isinstance(log_list, LogTweetStore):
+            log_list.data = list(dict.fromkeys(log_list))
+        userlist.data = log_list
+        userlist._log_wrapped = True
+        return userlist
+
+    def _load(self):
+        """Rebuild the index from the record headers"""
+        with self._lock:
+            # ID -> (seq, segment, offset, length, created_at,
+            # in_reply_to_status_id, flags)
+            self._entries = {}
+            self._plain_puts = 0
+            for type_, seq, id, created_at, reply_to, flags, segment, offset, length in self.log.scan():
+                if type_ == LOG_DELETE:
+                    self._entries.pop(id, None)
+                elif type_ == LOG_FLAGS:
+                    if id in self._entries:
+                        self._entries[id] = (*self._entries[id][:-1], flags)
+                else:
+                    self._entries[id] = (seq, segment, offset, length, created_at, reply_to, flags)
+                    self._plain_puts += type_ == LOG_PUT
+            self._order = sorted(self._entries, key=lambda id: self._entries[id][0])
+            self._live_bytes = sum(LOG_HEADER.size + entry[3] for entry in self._entries.values())
+            self._next_id = max(self._entries, default=0) + 1
+
+    def _record(self, item, seq, id=None):
+        """Return a record storing `item`"""
+        if id is None:
+            id = self._next_id
+            self._next_id += 1
+        return (self.put_type, seq, id, 0.0, 0, 0, self.codec.dumps(item))
+
+    def _put(self, records):
+        """Append records from _record() to the log, and index them (but not
+        their order)
+        """
+        for record, (segment, offset, length) in zip(records, self.log.append(records)):
+            old = self._entries.get(record[2])
+            if old is not None:
+                self._live_bytes -= LOG_HEADER.size + old[3]
+            self._entries[record[2]] = (record[1], segment, offset, length, *record[3:6])
+            self._live_bytes += LOG_HEADER.size + length
+
+    def _delete(self, ids):
+        """Append deletion records for these IDs, and unindex them (but not
+        their order)
+        """
+        self.log.append([(LOG_DELETE, 0, id, 0.0, 0, 0, b"") for id in ids])
+        for id in ids:
+            self._live_bytes -= LOG_HEADER.size + self._entries.pop(id)[3]
+
+    def _read(self, id):
+        entry = self._entries[id]
+        return self.codec.loads(self.log.read(*entry[1:4]))
+
+    def _rewrite(self, records):
+        """Replace the log with `records` from _record(), in list order, or
+        with copies of existing ones; see compact()
+        """
+        headers = []
+
+        def write():
+            for record in records:
+                headers.append(record[:-1])
+                yield record
+
+        locations = self.log.rewrite(write())
+        self._entries = {
+            header[2]: (header[1], *location, *header[3:6]) for header, location in zip(headers, locations)
+        }
+        self._order = [header[2] for header in headers]
+        self._live_bytes = self.log.size
+
+    def _seq_after(self, i):
+        """Sequence number for an item inserted at index `i` (0 <= i <=
+        len), or None if there is no room
+        """
+        before = self._entries[self._order[i - 1]][0] if i > 0 else 0
+        if i >= len(self._order):
+            return before + LOG_SEQ_STEP
+        after = self._entries[self._order[i]][0]
+        return (before + after) // 2 if after - before > 1 else None
+
+    def _normalize_index(self, i, error):
+        length = len(self._order)
+        if i < 0:
+            i += length
+        if not 0 <= i < length:
+            raise IndexError(error)
+        return i
+
+    @property
+    def garbage(self):
+        """Fraction of the log taken up by superseded records"""
+        return 1 - self._live_bytes / self.log.size if self.log.size else 0.0
+
+    def compact(self, renumber=False):
+        """Rewrite the log with only the current version of each item, in as
+        few segments as possible. With `renumber`, sequence numbers are
+        spaced out evenly again.
+        """
+        with self._lock:
+            def records():
+                for idx, id in enumerate(self._order, start=1):
+                    seq, segment, offset, length, created_at, reply_to, flags = self._entries[id]
+                    yield (
+                        self.put_type, idx * LOG_SEQ_STEP if renumber else seq, id, created_at, reply_to, flags,
+                        self.log.read(segment, offset, length),
+                    )
+
+            self._rewrite(records())
+
+    def stream(self, page_size=None, start=0):
+        """Iterate over the items, starting at index `start`, reading
+        `page_size` at a time
+        """
+        page_size = page_size or self.page_size
+        ids = self._order[start:]
+        for idx in range(0, len(ids), page_size):
+            with self._lock:
+                items = [self._read(id) for id in ids[idx:idx + page_size] if id in self._entries]
+            yield from items
+
+    @property  # type: ignore
+    def data(self):
+        return self.list_type(list(self.stream()))
+
+    @data.setter
+    def data(self, value):
+        with self._lock:
+            self._next_id = 1
+            self._rewrite(self._record(item, idx * LOG_SEQ_STEP) for idx, item in enumerate(value, start=1))
+
+    def __sizeof__(self):
+        return self._live_bytes
+
+    def __getitem__(self, i):
+        with self._lock:
+            if isinstance(i, slice):
+                return self.list_type([self._read(id) for id in self._order[i]])
+            return self._read(self._order[self._normalize_index(i, "list index out of range")])
+
+    def __setitem__(self, i, item):
+        if isinstance(i, slice):
+            raise NotImplementedError("__setitem__ with slices not implemented yet")
+        with self._lock:
+            id = self._order[self._normalize_index(i, "list assignment index out of range")]
+            self._put([self._record(item, self._entries[id][0], id)])
+
+    def __delitem__(self, i):
+        with self._lock:
+            if isinstance(i, slice):
+                ids = self._order[i]
+                if ids:
+                    self._delete(ids)
+                    del self._order[i]
+            else:
+                i = self._normalize_index(i, "list assignment index out of range")
+                self._delete([self._order.pop(i)])
+
+    def __len__(self):
+        return len(self._order)
+
+    def __iter__(self):
+        yield from self.stream()
+
+    def __contains__(self, item):
+        return item in self.stream()
+
+    def __iadd__(self, other):
+        self.extend(other)
+        return self
+
+    def __imul__(self, n):
+        if not isinstance(n, int):
+            raise TypeError(f"can't multiply sequence by non-int of type '{n.__class__.__name__}'")
+        if n <= 0:
+            self.clear()
+        elif n > 1:
+            self.extend(list(self.stream()) * (n - 1))
+        return self
+
+    def append(self, item):
+        with self._lock:
+            record = self._record(item, self._seq_after(len(self._order)))
+            self._put([record])
+            self._order.append(record[2])
+
+    def insert(self, i, item):
+        with self._lock:
+            length = len(self._order)
+            if i < 0:
+                i = max(i + length, 0)
+            i = min(i, length)
+            seq = self._seq_after(i)
+            if seq is None:
+                self.compact(renumber=True)
+                seq = self._seq_after(i)
+            record = self._record(item, seq)
+            self._put([record])
+            self._order.insert(i, record[2])
+
+    def pop(self, i=-1):
+        with self._lock:
+            if not self._order:
+                raise IndexError("pop from empty list")
+            i = self._normalize_index(i, "pop index out of range")
+            item = self._read(self._order[i])
+            self._delete([self._order.pop(i)])
+        return item
+
+    def remove(self, item):
+        with self._lock:
+            for idx, other in enumerate(self.stream()):
+                if other == item:
+                    del self[idx]
+                    return
+        raise ValueError("list.remove(x): x not in list")
+
+    def clear(self):
+        self.data = []
+
+    def extend(self, other):
+        if isinstance(other, UserList):
+            other = other.data
+        with self._lock:
+            seq = self._seq_after(len(self._order))
+            records = [self._record(item, seq + idx * LOG_SEQ_STEP) for idx, item in enumerate(other)]
+            if records:
+                self._put(records)
+                self._order.extend(record[2] for record in records)
+
+    def reverse(self):
+        self.data = self.data[::-1]
+
+    def sort(self, *args, **kwargs):
+        items = list(self.stream())
+        items.sort(*args, **kwargs)
+        self.data = items
+
+    # Like with RedisList, these return an instance of the underlying
+    # sequence type (self.list_type)
+    def copy(self):
+        return self.data
+
+    def __add__(self, other):
+        return list(self.data + other)
+
+    def __radd__(self, other):
+        return list(list(other) + self.data)
+
+    def __mul__(self, n):
+        return list(self.data * n)
+    __rmul__ = __mul__
+
+
+class LogTweetStore(LogList):
+    """Log storage for unique TweetLists, like RedisTweetStore.
+
+    Items must be Tweets or TweetRecords, with unique IDs, which are used as
+    IDs in the log; adding one whose ID is already stored does nothing. Their
+    timestamp, in_reply_to_status_id and flags (LOG_FLAG_ATTRS) are also kept
+    in the record headers, and so in the index, so lookups and range queries
+    don't read the log, and flag changes only append a header.
+    """
+    is_tweet_store = True
+    put_type = LOG_TWEET
+
+    def __init__(self, log, initlist=[], overwrite=False, **kwargs):
+        super().__init__(log, initlist=initlist, overwrite=overwrite, **kwargs)
+        if not overwrite and self._plain_puts:
+            self.fill_index()
+
+    def _record(self, item, seq, id=None):
+        if not isinstance(item, TWEET_TYPES):
+            raise TypeError(f"{self.__class__.__name__} can only store Tweets and TweetRecords")
+        flags = sum(1 << bit for bit, attr in enumerate(LOG_FLAG_ATTRS) if getattr(item, attr, False))
+        return (
+            self.put_type, seq, item.id, float(get_timestamp(item)), getattr(item, "in_reply_to_status_id", None) or 0,
+            flags, self.codec.dumps(item),
+        )
+
+    def _read(self, id):
+        item = super()._read(id)
+        # The header's flags may be newer than the encoded ones
+        flags = self._entries[id][6]
+        for bit, attr in enumerate(LOG_FLAG_ATTRS):
+            value = bool(flags & 1 << bit)
+            if getattr(item, attr, False) != value:
+                setattr(item, attr, value)
+        return item
+
+    def fill_index(self):
+        """Rewrite items stored by a plain LogList in the same log, which lack
+        the tweet fields in their headers
+        """
+        with self._lock:
+            self.data = list(self.stream())
+            self._plain_puts = 0
+
+    @property  # type: ignore
+    def data(self):
+        return super().data
+
+    @data.setter
+    def data(self, value):
+        with self._lock:
+            # dict.fromkeys() dedupes by ID, while keeping order
+            self._rewrite(
+                self._record(item, idx * LOG_SEQ_STEP) for idx, item in enumerate(dict.fromkeys(value), start=1))
+
+    def __setitem__(self, i, item):
+        if isinstance(i, slice):
+            raise NotImplementedError("__setitem__ with slices not implemented yet")
+        with self._lock:
+            i = self._normalize_index(i, "list assignment index out of range")
+            id = self._order[i]
+            record = self._record(item, self._entries[id][0])
+            if record[2] != id:
+                if record[2] in self._entries:
+                    raise ValueError(f"ID {item.id} is already stored")
+                self._delete([id])
+                self._order[i] = record[2]
+            self._put([record])
+
+    def __contains__(self, item):
+        return isinstance(item, TWEET_TYPES) and self.contains_id(item.id)
+
+    def __imul__(self, n):
+        if not isinstance(n, int):
+            raise TypeError(f"can't multiply sequence by non-int of type '{n.__class__.__name__}'")
+        # Repeating would only add items whose IDs are already stored
+        if n <= 0:
+            self.clear()
+        return self
+
+    def append(self, item):
+        with self._lock:
+            if not self.contains_id(getattr(item, "id", None)):
+                super().append(item)
+
+    def insert(self, i, item):
+        with self._lock:
+            if not self.contains_id(getattr(item, "id", None)):
+                super().insert(i, item)
+
+    def extend(self, other):
+        if isinstance(other, UserList):
+            other = other.data
+        with self._lock:
+            super().extend(item for item in dict.fromkeys(other) if not self.contains_id(getattr(item, "id", None)))
+
+    def remove(self, item):
+        with self._lock:
+            if not isinstance(item, TWEET_TYPES) or item.id not in self._entries:
+                raise ValueError("list.remove(x): x not in list")
+            self._delete([item.id])
+            self._order.remove(item.id)
+
+    def contains_id(self, id):
+        return id in self._entries
+
+    def get_by_id(self, id):
+        """Return item with this status ID, or None"""
+        with self._lock:
+            return self._read(id) if id in self._entries else None
+
+    def get_many(self, ids):
+        """Return items with these status IDs, in the same order, skipping
+        those that aren't stored
+        """
+        with self._lock:
+            return [self._read(id) for id in ids if id in self._entries]
+
+    def update_item(self, item):
+        """Store a new version of an item, e.g. after a flag change. Does
+        nothing if its ID isn't stored. If only flags in LOG_FLAG_ATTRS have
+        changed, only a header is appended.
+
+        Returns:
+            bool: Whether the item was stored
+        """
+        with self._lock:
+            entry = self._entries.get(item.id)
+            if entry is None:
+                return False
+            record = self._record(item, entry[0])
+            if record[3:5] == entry[4:6]:
+                if record[5] != entry[6]:
+                    self.log.append([(LOG_FLAGS, 0, item.id, 0.0, 0, record[5], b"")])
+                    self._entries[item.id] = (*entry[:-1], record[5])
+            else:
+                self._put([record])
+            return True
+
+    def between(self, start=None, end=None):
+        """Return items created at or after `start` but before `end`, in
+        chronological order
+
+        Args:
+            start, end (float, int or None): UNIX timestamps. None means no
+                limit.
+        """
+        start = float("-inf") if start is None else start
+        end = float("inf") if end is None else end
+        with self._lock:
+            ids = sorted(
+                (entry[4], id) for id, entry in self._entries.items() if start <= entry[4] < end)
+            return [self._read(id) for _, id in ids]
+
+    def remove_older_than(self, t):
+        """Remove all items created before UNIX timestamp `t`; return the
+        number of items removed
+        """
+        with self._lock:
+            ids = {id for id, entry in self._entries.items() if entry[4] < t}
+            if ids:
+                self._delete(list(ids))
+                self._order = [id for id in self._order if id not in ids]
+            return len(ids)
+
+    def flagged(self, flag, value=True):
+        """Return items that have (or, if `value` is False, don't have) a
+        flag from TWEET_FLAGS, in list order
+        """
+        if flag not in TWEET_FLAGS:
+            raise KeyError(flag)
+        with self._lock:
+            if flag == "reply":
+                ids = [id for id in self._order if bool(self._entries[id][5]) == value]
+            else:
+                bit = 1 << [TWEET_FLAG_ATTRS[attr] for attr in LOG_FLAG_ATTRS].index(flag)
+                ids = [id for id in self._order if bool(self._entries[id][6] & bit) == value]
+            return [self._read(id) for id in ids]
+
+    def earliest_ts(self):
+        with self._lock:
+            return min((entry[4] for entry in self._entries.values()), default=0)
+
+    def latest_ts(self):
+        with self._lock:
+            return max((entry[4] for entry in self._entries.values()), default=0)
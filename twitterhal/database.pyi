@@ -1,12 +1,48 @@
+import mmap
 import shelve
+import sqlite3
+import struct
 from collections import UserList
-from threading import RLock
-from typing import Any, Dict, Generic, List, Optional, Type, TypeVar, Union
+from threading import Lock, RLock
+from typing import (
+    Any, BinaryIO, Callable, ContextManager, Dict, Generic, Iterable, Iterator, List, Optional, Sequence, Set, Tuple,
+    Type, TypeVar, Union
+)
 
-from redis import Redis
+from redis import ConnectionPool, Redis
+from redis.client import Pipeline, Script
+
+from twitterhal.models import Tweet, TweetList, TweetRecord
+from twitterhal.serialization import PickleCodec
 
 
 DBI = TypeVar("DBI")
+TweetListItem = Union[Tweet, TweetRecord]
+# type, seq, id, created_at, in_reply_to_status_id, flags, body
+LogRecord = Tuple[int, int, int, float, int, int, bytes]
+Mutation = Tuple[
+    Union[Callable[[Pipeline], Any], Tuple[str, List[Any]]], Optional[Callable[[List], Any]],
+    Optional[Callable[[List], bool]]
+]
+
+DEFAULT_PAGE_SIZE: int
+DEFAULT_SEGMENT_SIZE: int
+IMMUTABLE_TYPES: Tuple[type, ...]
+LOG_DELETE: int
+LOG_FLAG_ATTRS: Tuple[str, ...]
+LOG_FLAGS: int
+LOG_HEADER: struct.Struct
+LOG_PUT: int
+LOG_SEQ_STEP: int
+LOG_TWEET: int
+LIST_LUA_FUNCTIONS: str
+MIGRATION_CHECKPOINT_SECONDS: int
+REDIS_CONNECTION_KWARGS: Tuple[str, ...]
+REDIS_LIST_SCRIPTS: Dict[str, str]
+TWEET_STORE_LUA_FUNCTIONS: str
+TWEET_STORE_SCRIPTS: Dict[str, str]
+_redis_pools: Dict[Tuple[Tuple[str, str], ...], ConnectionPool]
+_redis_pools_lock: Lock
 
 
 class RedisUserList(UserList):
@@ -14,6 +50,21 @@ class RedisUserList(UserList):
     _redis_wrapped: bool
 
 
+def get_redis(**kwargs) -> Redis: ...
+def get_redis_pool(max_connections: Optional[int], **kwargs) -> ConnectionPool: ...
+def lua_mutation(script: str) -> str: ...
+def redis_pool_stats(
+    pool: Optional[ConnectionPool]
+) -> Union[Dict[str, Optional[int]], Dict[str, Dict[str, Optional[int]]]]: ...
+def stream_list(value: Union[List, UserList], start: int, page_size: Optional[int]) -> Iterator[Any]: ...
+
+
+class ChangeCountingList(list):
+    change_count: int
+
+    def __init__(self, *args): ...
+
+
 class DatabaseItem(Generic[DBI]):
     type: Type[DBI]
     default: Optional[DBI]
@@ -25,50 +76,321 @@ class DatabaseItem(Generic[DBI]):
 
 class BaseDatabase:
     is_open: bool
+    sync_stats: Dict[str, int]
+    _change_counts: Dict[str, Optional[int]]
+    _dirty: Set[str]
+    _load_lock: RLock
+    _preload: Union[Iterable[str], bool]
     _schema: Dict[str, DatabaseItem]
+    _sync_lock: RLock
+    _sync_stats: Dict[str, int]
 
     def __enter__(self) -> BaseDatabase: ...
     def __exit__(self, *args, **kwargs): ...
-    def __init__(self): ...
+    def __getattr__(self, name: str) -> Any: ...
+    def __init__(self, preload: Union[Iterable[str], bool]): ...
     def __setattr__(self, name: str, value: Any): ...
     def add_key(self, name: str, type_: Type[DBI], default: Optional[DBI], **default_kwargs): ...
+    def _load(self, key: str) -> Any: ...
+    def _mark_clean(self, key: str, change_count: Optional[int]): ...
+    @staticmethod
+    def _migrate_list(
+        key: str, source: Union[List, UserList], target: Union[List, UserList], key_state: Dict[str, Any],
+        batch_size: int, checkpoint: Callable[[], None], progress: Optional[Callable[[str, int, int], Any]]
+    ): ...
+    def _read_key(self, key: str) -> Any: ...
+    def _sync_keys(self, key: Optional[str]) -> List[str]: ...
+    def _verify_migration(self, key: str, other_db: BaseDatabase, batch_size: int) -> int: ...
+    def _write_dirty(self, write: Callable[[str, Any], int], key: Optional[str]): ...
     def close(self): ...
-    def migrate_to(self, other_db: BaseDatabase): ...
+    def is_dirty(self, key: str) -> bool: ...
+    def migrate_to(
+        self, other_db: BaseDatabase, batch_size: int, checkpoint_path: Optional[str],
+        progress: Optional[Callable[[str, int, int], Any]]
+    ) -> Dict[str, int]: ...
+    def is_loaded(self, key: str) -> bool: ...
     def open(self): ...
+    def pending_changes(self) -> int: ...
     def setattr(self, name: str, value: Any): ...
     def sync(self, key: Optional[str]): ...
 
 
 class ShelveDatabase(BaseDatabase):
+    _codec: PickleCodec
     _db_path: str
     _db: shelve.DbfilenameShelf
     _lock: RLock
 
     def __enter__(self) -> ShelveDatabase: ...
-    def __init__(self, db_path: str): ...
+    def __init__(self, db_path: str, codec: Optional[PickleCodec], preload: Union[Iterable[str], bool]): ...
+    def __setattr__(self, name: str, value: Any): ...
+    def _read_key(self, key: str) -> Any: ...
+    def _write_key(self, key: str, value: Any) -> int: ...
 
 
 class RedisDatabase(BaseDatabase):
+    pool_stats: Dict[str, Optional[int]]
+    _bgsave: Sequence[Tuple[int, int]]
+    _cache: bool
+    _codec: PickleCodec
+    _tweet_store: bool
     _namespace: Optional[str]
-    _pickle_protocol: int
+    _page_size: int
     _redis: Redis
     _redis_kwargs: Dict[str, Any]
 
     def __enter__(self) -> RedisDatabase: ...
-    def __init__(self, pickle_protocol: int, namespace: Optional[str], **kwargs): ...
+    def __init__(
+        self, pickle_protocol: int, namespace: Optional[str], cache: bool, tweet_store: bool, page_size: int,
+        bgsave: Sequence[Tuple[int, int]], codec: Optional[PickleCodec], preload: Union[Iterable[str], bool], **kwargs
+    ): ...
+    def _read_key(self, key: str) -> Any: ...
+    def _write_key(self, key: str, value: Any) -> int: ...
+    def bgsave_due(self) -> bool: ...
+    def get_list_class(self, userlist: UserList) -> Type[RedisList]: ...
     def get_redis_key(self, name: str) -> str: ...
 
 
 class RedisList(UserList):
+    _batch: Optional[List[Mutation]]
+    _cache: Optional[List]
+    _cache_version: Optional[int]
+    _lock: RLock
     _redis_wrapped: bool
+    _scripts: Dict[str, Script]
+    _tracked_version: Optional[int]
+    cache: bool
+    codec: PickleCodec
     data: List
     key: str
     list_type: Type
+    lua_functions: str
+    lua_scripts: Dict[str, str]
+    page_size: int
     pickle_protocol: int
     redis: Redis
+    version_key: str
+
+    @property
+    def script_keys(self) -> List[str]: ...
+
+    @staticmethod
+    def _position_args(i: Union[int, slice]) -> List[Any]: ...
+    def _execute(self, mutations: List[Mutation]) -> List[List]: ...
+    def _get_cache(self) -> List: ...
+    def _invalidate(self): ...
+    def _fetch(self) -> Tuple[int, List[bytes]]: ...
+    def _fetch_page(self, start: int, stop: int) -> Tuple[int, List[bytes]]: ...
+    def _pages(self, page_size: Optional[int], start: int) -> Iterator[Tuple[int, List[bytes]]]: ...
+    def _run(self, script: str, args: List[Any], client: Union[Redis, Pipeline, None]) -> Any: ...
+    def _write(
+        self, queue: Union[Callable[[Pipeline], Any], Tuple[str, List[Any]]], update: Optional[Callable[[List], Any]],
+        check: Optional[Callable[[List], bool]]
+    ) -> Optional[List]: ...
+    def batch(self) -> ContextManager[RedisList]: ...
+    def flush(self): ...
+    def is_stale(self) -> bool: ...
+    def stream(self, page_size: Optional[int], start: int) -> Iterator[Any]: ...
+    def stream_raw(self, page_size: Optional[int], start: int) -> Iterator[bytes]: ...
+    def track_version(self) -> int: ...
+    def version(self) -> int: ...
 
     def __getattr__(self, name: str) -> Any: ...
     def __init__(self, redis: Redis, key: str, initlist: Union[List, UserList], overwrite: bool, **kwargs): ...
-    def __new__(cls, redis: Redis, key: str, list_type: Optional[Type], pickle_protocol: int, **kwargs): ...
+    def __new__(
+        cls, redis: Redis, key: str, list_type: Optional[Type], pickle_protocol: int, cache: bool, page_size: int,
+        codec: Optional[PickleCodec], **kwargs
+    ): ...
+    @classmethod
+    def wrap(
+        cls, userlist: UserList, redis: Redis, key: str, overwrite: bool, unique: bool, pickle_protocol: int,
+        cache: bool, page_size: int, codec: Optional[PickleCodec]
+    ) -> UserList: ...
+
+
+class RedisTweetStore(RedisList):
+    created_key: str
+    flag_keys: Dict[str, str]
+    ids_key: str
+    is_tweet_store: bool
+    tweets_key: str
+
+    @property
+    def store_keys(self) -> List[str]: ...
+
+    def _item_args(self, item: TweetListItem) -> List[Any]: ...
+    def between(self, start: Optional[float], end: Optional[float]) -> List[TweetListItem]: ...
+    def contains_id(self, id: int) -> bool: ...
+    def earliest_ts(self) -> float: ...
+    def flagged(self, flag: str, value: bool) -> List[TweetListItem]: ...
+    def get_by_id(self, id: int) -> Optional[TweetListItem]: ...
+    def get_many(self, ids: List[int]) -> List[TweetListItem]: ...
+    def latest_ts(self) -> float: ...
+    def migrate_from_list(self): ...
+    def remove_older_than(self, t: float) -> Optional[int]: ...
+    def update_item(self, item: TweetListItem) -> Optional[bool]: ...
+
+
+class SQLiteDatabase(BaseDatabase):
+    _codec: PickleCodec
+    _connection: Optional[sqlite3.Connection]
+    _db_path: str
+    _lock: RLock
+    _timeout: float
+
+    def __enter__(self) -> SQLiteDatabase: ...
+    def __init__(
+        self, db_path: str, pickle_protocol: int, timeout: float, codec: Optional[PickleCodec],
+        preload: Union[Iterable[str], bool]
+    ): ...
+    def _read_key(self, key: str) -> Any: ...
+    def _write_key(self, key: str, value: Any) -> int: ...
+    def get_list_class(self, userlist: UserList) -> Type[SQLiteList]: ...
+
+
+class SQLiteList(UserList):
+    _lock: RLock
+    _sqlite_wrapped: bool
+    codec: PickleCodec
+    connection: sqlite3.Connection
+    data: List
+    insert_sql: str
+    key: str
+    list_type: Type
+    page_size: int
+    pickle_protocol: int
+    tweet_columns: List[str]
+
+    def __init__(
+        self, connection: sqlite3.Connection, key: str, initlist: Union[Iterable, UserList], overwrite: bool,
+        lock: Optional[RLock], pickle_protocol: int, list_type: Type, page_size: int, codec: Optional[PickleCodec]
+    ): ...
+    @classmethod
+    def create_tables(cls, connection: sqlite3.Connection): ...
+    @classmethod
+    def wrap(
+        cls, userlist: UserList, connection: sqlite3.Connection, key: str, overwrite: bool, unique: bool,
+        lock: Optional[RLock], pickle_protocol: int, page_size: int, codec: Optional[PickleCodec]
+    ) -> UserList: ...
+
+    def _delete_positions(self, positions: List[int]): ...
+    def _execute(self, sql: str, params: Sequence) -> sqlite3.Cursor: ...
+    def _insert(self, rows: List[Tuple], first_position: int): ...
+    def _next_position(self) -> int: ...
+    def _normalize_index(self, i: int, error: str) -> int: ...
+    def _positions(self, offset: int, limit: int) -> List[int]: ...
+    def _row(self, item: Any) -> Tuple: ...
+    def _select(self, where: str, params: Sequence, order: str, limit: int, offset: int) -> List: ...
+    def _transaction(self) -> ContextManager[sqlite3.Connection]: ...
+    def stream(self, page_size: Optional[int], start: int) -> Iterator[Any]: ...
+
+
+class SQLiteTweetStore(SQLiteList):
+    is_tweet_store: bool
+
+    def between(self, start: Optional[float], end: Optional[float]) -> List[TweetListItem]: ...
+    def contains_id(self, id: int) -> bool: ...
+    def earliest_ts(self) -> float: ...
+    def fill_columns(self): ...
+    def flagged(self, flag: str, value: bool) -> List[TweetListItem]: ...
+    def get_by_id(self, id: int) -> Optional[TweetListItem]: ...
+    def get_many(self, ids: Iterable[int]) -> List[TweetListItem]: ...
+    def latest_ts(self) -> float: ...
+    def remove_older_than(self, t: float) -> int: ...
+    def update_item(self, item: TweetListItem) -> bool: ...
+
+
+class LogDatabase(BaseDatabase):
+    _codec: PickleCodec
+    _compact_ratio: float
+    _db_path: str
+    _lists: Dict[str, LogList]
+    _lock: RLock
+    _logs: Dict[str, SegmentLog]
+    _segment_size: int
+
+    def __enter__(self) -> LogDatabase: ...
+    def __init__(
+        self, db_path: str, pickle_protocol: int, segment_size: int, compact_ratio: float,
+        codec: Optional[PickleCodec], preload: Union[Iterable[str], bool]
+    ): ...
+    def _get_log(self, key: str) -> SegmentLog: ...
+    def _read_key(self, key: str) -> Any: ...
+    def _value_path(self, key: str) -> str: ...
+    def _write_key(self, key: str, value: Any) -> int: ...
+    def get_list_class(self, userlist: UserList) -> Type[LogList]: ...
+
+
+class SegmentLog:
+    _file: Optional[BinaryIO]
+    _maps: Dict[int, mmap.mmap]
+    path: str
+    segment_size: int
+    segments: List[int]
+    size: int
+
+    def __init__(self, path: str, segment_size: int): ...
+    def _close_files(self): ...
+    def _recover(self): ...
+    def _segment_path(self, segment: int, path: Optional[str]) -> str: ...
+    def _write(self, f: BinaryIO, record: LogRecord) -> int: ...
+    def append(self, records: Iterable[LogRecord]) -> List[Tuple[int, int, int]]: ...
+    def close(self): ...
+    def flush(self, fsync: bool): ...
+    def read(self, segment: int, offset: int, length: int) -> bytes: ...
+    def rewrite(self, records: Iterable[LogRecord]) -> List[Tuple[int, int, int]]: ...
+    def scan(self) -> List[Tuple[int, int, int, float, int, int, int, int, int]]: ...
+
+
+class LogList(UserList):
+    _entries: Dict[int, Tuple[int, int, int, int, float, int, int]]
+    _live_bytes: int
+    _lock: RLock
+    _log_wrapped: bool
+    _next_id: int
+    _order: List[int]
+    _plain_puts: int
+    codec: PickleCodec
+    data: List
+    garbage: float
+    list_type: Type
+    log: SegmentLog
+    page_size: int
+    pickle_protocol: int
+    put_type: int
+
+    def __init__(
+        self, log: SegmentLog, initlist: Union[Iterable, UserList], overwrite: bool, lock: Optional[RLock],
+        pickle_protocol: int, list_type: Type, page_size: int, codec: Optional[PickleCodec]
+    ): ...
     @classmethod
-    def wrap(cls, userlist: UserList, redis: Redis, key: str, overwrite: bool, unique: bool, pickle_protocol: int) -> UserList: ...
+    def wrap(
+        cls, userlist: UserList, log: SegmentLog, overwrite: bool, unique: bool, lock: Optional[RLock],
+        pickle_protocol: int, page_size: int, codec: Optional[PickleCodec]
+    ) -> UserList: ...
+
+    def _delete(self, ids: List[int]): ...
+    def _load(self): ...
+    def _normalize_index(self, i: int, error: str) -> int: ...
+    def _put(self, records: List[LogRecord]): ...
+    def _read(self, id: int) -> Any: ...
+    def _record(self, item: Any, seq: int, id: Optional[int]) -> LogRecord: ...
+    def _rewrite(self, records: Iterable[LogRecord]): ...
+    def _seq_after(self, i: int) -> Optional[int]: ...
+    def compact(self, renumber: bool): ...
+    def stream(self, page_size: Optional[int], start: int) -> Iterator[Any]: ...
+
+
+class LogTweetStore(LogList):
+    is_tweet_store: bool
+
+    def between(self, start: Optional[float], end: Optional[float]) -> List[TweetListItem]: ...
+    def contains_id(self, id: int) -> bool: ...
+    def earliest_ts(self) -> float: ...
+    def fill_index(self): ...
+    def flagged(self, flag: str, value: bool) -> List[TweetListItem]: ...
+    def get_by_id(self, id: int) -> Optional[TweetListItem]: ...
+    def get_many(self, ids: Iterable[int]) -> List[TweetListItem]: ...
+    def latest_ts(self) -> float: ...
+    def remove_older_than(self, t: float) -> int: ...
+    def update_item(self, item: TweetListItem) -> bool: ...
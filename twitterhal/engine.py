@@ -1,19 +1,23 @@
+import collections
 import datetime
 import logging
 import queue
 import re
 import threading
 import time
-import warnings
+from concurrent import futures
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
 from typing import cast, TYPE_CHECKING
 
-import megahal
 import twitter
 from twitter.api import CHARACTER_LIMIT
 from twitter.ratelimit import EndpointRateLimit
 
 from twitterhal.conf import settings
+from twitterhal.generation import (
+    ConcurrentMegaHAL, create_megahal, process_pool_supported, ProcessPoolGenerator,
+)
 from twitterhal.gracefulkiller import killer
 from twitterhal.models import Tweet, TweetList
 from twitterhal.runtime import runner
@@ -56,6 +60,9 @@ class TwitterHAL:
         db_options = settings.DATABASE.get("options", {})
         if test:
             db_options.update(settings.DATABASE.get("test_options", {}))
+        codec = settings.get_database_codec()
+        if codec is not None:
+            db_options = dict(db_options, codec=codec)
         self.include_mentions = include_mentions or settings.INCLUDE_MENTIONS
         self.random_post_times = random_post_times or settings.RANDOM_POST_TIMES
         self.screen_name = screen_name or settings.SCREEN_NAME
@@ -67,8 +74,21 @@ class TwitterHAL:
         self.generate_random_lock = threading.Lock()
         self.megahal_lock = threading.Lock()
         self.megahal_open = False
+        self._generator = None
+        # Set by _get_missing_own_tweets()
+        self._own_tweets_fetched = False
+        # Set if MEGAHAL_PROCESSES is, but megahal doesn't allow it
+        self._generator_unsupported = False
+        # (time to retry, mention) for mentions we gave up replying to, see
+        # generate_tweet()
+        self.deferred_mentions = collections.deque()
+        # IDs of mentions requeue_deferred_mentions() put back in
+        # mention_queue, which have been learned from already
+        self.retried_mention_ids = set()
+        self.generation_stats = {"tweets": 0, "attempts": 0, "seconds": 0.0, "fallbacks": 0}
         self.mention_queue = queue.Queue()
         self.post_queue = queue.Queue()
+        self.random_tweet_pool_stats = {"hits": 0, "misses": 0, "discarded": 0}
         self.test = test
         if self.test:
             logger.info("TEST MODE")
@@ -108,13 +128,19 @@ class TwitterHAL:
     def close(self):
         logger.debug("Closing DB ...")
         self.db.close()
+        if self._generator is not None:
+            logger.debug("Stopping MegaHAL worker processes ...")
+            self._generator.close()
+            self._generator = None
         if self.megahal_open:
             logger.debug("Closing MegaHAL ...")
             self.megahal.close()
             self.megahal_open = False
 
     def prepare_runner(self):
-        self._get_missing_own_tweets()
+        if not self._own_tweets_fetched:
+            # open() usually did, see _init_post_status_limit()
+            self._get_missing_own_tweets()
         self._get_missing_mentions()
         self._flag_replied_mentions()
         for mention in self.db.mentions.unanswered:
@@ -125,11 +151,23 @@ class TwitterHAL:
 
     def register_workers(self):
         runner.register_worker(self.post_tweets_worker)
+        if settings.DATABASE_CHECKPOINT_SECONDS is not None or settings.DATABASE_CHECKPOINT_CHANGES is not None:
+            runner.register_worker(self.checkpoint_worker)
+        if settings.RANDOM_TWEET_POOL_SIZE:
+            runner.register_worker(self.random_tweet_pool_worker)
+        if settings.MEGAHAL_PROCESSES or settings.REPLY_THREADS > 1:
+            runner.register_worker(self.reply_generation_worker)
+        if settings.DEFERRED_LEARNING["enabled"]:
+            runner.register_worker(self.learning_worker)
 
     def register_loop_tasks(self):
         runner.register_loop_task(self.generate_random, sleep=60)
         runner.register_loop_task(self.get_new_mentions, sleep=15)
-        runner.register_loop_task(self.pop_mention_and_generate_reply)
+        if settings.TWEET_GENERATION["fallback"] == "queue":
+            runner.register_loop_task(self.requeue_deferred_mentions, sleep=60)
+        if not settings.MEGAHAL_PROCESSES and settings.REPLY_THREADS <= 1:
+            # Otherwise, reply_generation_worker does this
+            runner.register_loop_task(self.pop_mention_and_generate_reply)
 
     def register_post_loop_tasks(self):
         pass
@@ -140,6 +178,16 @@ class TwitterHAL:
         logger.debug(defaults)
         return defaults
 
+    def get_megahal_db_args(self):
+        """Return the brain database class and its options, as configured in
+        settings.MEGAHAL_DATABASE
+        """
+        Database = settings.get_megahal_database_class()
+        db_options = dict(settings.MEGAHAL_DATABASE.get("options", {}))
+        if self.test:
+            db_options.update(settings.MEGAHAL_DATABASE.get("test_options", {}))
+        return Database, db_options
+
     def get_megahal_api_kwargs(self, **kwargs):
         defaults = deepcopy(settings.MEGAHAL_API)
         defaults.update(kwargs)
@@ -157,32 +205,76 @@ class TwitterHAL:
         """
         self.db.add_key("posted_tweets", TweetList, unique=True)
         self.db.add_key("mentions", TweetList, unique=True)
+        # Texts of pre-generated random tweets, see random_tweet_pool_worker()
+        self.db.add_key("random_tweet_pool", list)
+        # Phrases waiting to be learned, see learning_worker()
+        self.db.add_key("learn_queue", list)
         logger.debug("Trying to initialize DB ...")
         self.db.open()
         logger.debug("DB initialized")
 
+    def migrate_db(self, other_db, **kwargs):
+        """Copy our database to `other_db`, a new BaseDatabase instance
+
+        other_db gets the schema init_db() defines, so subclasses' extra keys
+        are migrated too. Our database is initialized first if needed. See
+        BaseDatabase.migrate_to() for `kwargs` and return value.
+        """
+        if not self.db._is_open:
+            self.init_db()
+        db = self.db
+        # Let init_db() define other_db's schema and open it
+        self.db = other_db
+        try:
+            self.init_db()
+        finally:
+            self.db = db
+        try:
+            return self.db.migrate_to(other_db, **kwargs)
+        finally:
+            other_db.close()
+
     @property
     def megahal(self):
+        """MegaHAL instance, wrapped in a generation.ConcurrentMegaHAL so
+        threads can use it at the same time
+        """
         if not self.megahal_lock.acquire(timeout=120):
             logger.error("Timeout when acquiring megahal_lock")
             raise TimeoutError()
         try:
             if not self.megahal_open:
                 self.megahal_open = True
-                if megahal.VERSION >= (0, 4, 0):
-                    logger.info("Initializing MegaHAL, this could take a moment ...")
-                    Database = settings.get_megahal_database_class()
-                    db_options = settings.MEGAHAL_DATABASE.get("options", {})
-                    if self.test:
-                        db_options.update(settings.MEGAHAL_DATABASE.get("test_options", {}))
-                    db = Database(**db_options)
-                    self._megahal = megahal.MegaHAL(db=db, **self.get_megahal_api_kwargs())
-                else:
-                    self._megahal = megahal.MegaHAL(**self.get_megahal_api_kwargs())
+                self._megahal = ConcurrentMegaHAL(
+                    create_megahal(*self.get_megahal_db_args(), **self.get_megahal_api_kwargs()))
         finally:
             self.megahal_lock.release()
         return self._megahal
 
+    @property
+    def generator(self):
+        """ProcessPoolGenerator with settings.MEGAHAL_PROCESSES workers, or
+        None if that setting is 0, or if the installed megahal doesn't allow
+        it (see generation.process_pool_supported()). In the latter case,
+        replies are generated in this process's threads instead.
+        """
+        if self._generator is None and settings.MEGAHAL_PROCESSES and not self._generator_unsupported:
+            # The workers get copies of its brain
+            megahal = self.megahal
+            with self.megahal_lock:
+                if self._generator is None and not self._generator_unsupported:
+                    if process_pool_supported():
+                        logger.info(f"Starting {settings.MEGAHAL_PROCESSES} MegaHAL worker processes ...")
+                        self._generator = ProcessPoolGenerator(
+                            settings.MEGAHAL_PROCESSES, megahal, **self.get_megahal_api_kwargs())
+                    else:
+                        self._generator_unsupported = True
+                        logger.warning(
+                            "MEGAHAL_PROCESSES requires megahal < 0.4.0, whose brain is a file the worker processes "
+                            "can get copies of; generating replies in threads instead"
+                        )
+        return self._generator
+
     """ ---------- SINGLETON WORKERS TO BE RUN CONTINUOUSLY ---------- """
 
     def post_tweets_worker(self, restart=False):
@@ -204,6 +296,128 @@ class TwitterHAL:
                 killer.sleep(5)
         logger.debug("Recevied exit event")
 
+    def checkpoint_worker(self):
+        """
+        Worker that syncs the database every
+        settings.DATABASE_CHECKPOINT_SECONDS seconds, or as soon as
+        settings.DATABASE_CHECKPOINT_CHANGES changes are waiting to be
+        written, so a crash doesn't lose everything since startup.
+
+        Values are serialized without holding the database's lock, so other
+        threads are only blocked while they are written.
+        """
+        seconds = settings.DATABASE_CHECKPOINT_SECONDS
+        changes = settings.DATABASE_CHECKPOINT_CHANGES
+        last_checkpoint = time.monotonic()
+        while not killer.kill_now:
+            killer.sleep(1)
+            if (seconds is not None and time.monotonic() - last_checkpoint >= seconds) or \
+                    (changes is not None and self.db.pending_changes() >= changes):
+                self.checkpoint()
+                last_checkpoint = time.monotonic()
+        logger.debug("Received exit event")
+
+    def random_tweet_pool_worker(self):
+        """
+        Worker that keeps settings.RANDOM_TWEET_POOL_SIZE pre-generated random
+        tweets in self.db.random_tweet_pool, so generate_random() can put one
+        in post_queue right away instead of waiting for MegaHAL.
+
+        generate_tweet() makes sure they are not duplicates of posted tweets
+        when they are generated, and pop_random_tweet() checks again when
+        they are used. The pool is stored in the database, so it survives
+        restarts.
+        """
+        while not killer.kill_now:
+            if len(self.db.random_tweet_pool) < settings.RANDOM_TWEET_POOL_SIZE:
+                tweet = self.generate_tweet()
+                # generate_tweet() gives up on duplicates if we're exiting
+                if tweet is not None and not killer.kill_now and tweet.text not in self.db.random_tweet_pool:
+                    self.db.random_tweet_pool.append(tweet.text)
+                    logger.debug(f"Added to random tweet pool ({len(self.db.random_tweet_pool)}): {tweet}")
+            else:
+                killer.sleep(5)
+        logger.debug("Received exit event")
+
+    def reply_generation_worker(self):
+        """
+        Worker that replaces the pop_mention_and_generate_reply loop task
+        when settings.MEGAHAL_PROCESSES is set, or settings.REPLY_THREADS is
+        more than 1. It generates replies to up to that many mentions at a
+        time (MEGAHAL_PROCESSES, if set, so they keep all the MegaHAL worker
+        processes busy), and puts the replies in post_queue in the order the
+        mentions were taken from mention_queue.
+        """
+        processes = settings.MEGAHAL_PROCESSES or settings.REPLY_THREADS
+        # Futures of replies being generated, in mention order
+        pending = collections.deque()
+        with ThreadPoolExecutor(processes) as executor:
+            while not killer.kill_now:
+                while pending and pending[0].done():
+                    self._put_generated_reply(pending.popleft())
+                if len(pending) < processes and (self.force or self.can_post(len(pending) + 1)):
+                    try:
+                        mention = self.mention_queue.get(timeout=1)
+                    except queue.Empty:
+                        continue
+                    logger.debug(f"Generating reply to {mention}")
+                    pending.append(executor.submit(self._generate_reply, mention))
+                elif pending:
+                    futures.wait([pending[0]], timeout=1)
+                else:
+                    killer.sleep(1)
+            # generate_tweet() stops retrying when we're exiting
+            for future in pending:
+                self._put_generated_reply(future)
+        logger.debug("Received exit event")
+
+    def learning_worker(self):
+        """
+        Worker that learns the phrases in self.db.learn_queue, put there
+        instead of being learned right away when
+        settings.DEFERRED_LEARNING["enabled"] is True. They are learned in
+        batches of up to DEFERRED_LEARNING["batch_size"], as soon as there
+        are that many, or when DEFERRED_LEARNING["flush_seconds"] have passed
+        since the last batch.
+
+        The queue is stored in the database, so whatever is left in it on
+        exit is learned the next time we start.
+        """
+        options = settings.DEFERRED_LEARNING
+        last_flush = time.monotonic()
+        while not killer.kill_now:
+            killer.sleep(1)
+            length = len(self.db.learn_queue)
+            if length >= options["batch_size"] or \
+                    (length and time.monotonic() - last_flush >= options["flush_seconds"]):
+                self.learn_from_queue()
+                last_flush = time.monotonic()
+        logger.debug("Received exit event")
+
+    def checkpoint(self):
+        """Sync the database, and log how long it took and what was written
+
+        Also gives the MegaHAL worker processes, if any, a fresh copy of the
+        brain if self.megahal has learned anything since they got theirs.
+        """
+        if self._generator is not None and self._generator.learned_count != self.megahal.learned_count:
+            start = time.perf_counter()
+            try:
+                self._generator.refresh(self.megahal)
+            except Exception as e:
+                logger.error(f"Refreshing MegaHAL worker processes failed: {e}")
+            else:
+                logger.info(f"Refreshed MegaHAL worker processes in {time.perf_counter() - start:.3f} s")
+        start = time.perf_counter()
+        try:
+            self.db.sync()
+        except Exception as e:
+            logger.error(f"Checkpoint failed: {e}")
+            return
+        stats = self.db.sync_stats
+        logger.info(
+            f"Checkpoint: wrote {stats['keys']} keys, {stats['bytes']} bytes in {time.perf_counter() - start:.3f} s")
+
     """ ---------- LOOP TASKS ---------- """
 
     def generate_random(self):
@@ -219,10 +433,16 @@ class TwitterHAL:
         elif not self.generate_random_lock.acquire(blocking=False):
             logger.debug("Could not acquire lock")
         else:
-            logger.info("Generating new random tweet ...")
-            tweet = self.generate_tweet()
-            logger.debug(f"Putting random tweet in post_queue: {tweet}")
-            self.post_queue.put(tweet)
+            tweet = self.pop_random_tweet()
+            if tweet is None:
+                logger.info("Generating new random tweet ...")
+                tweet = self.generate_tweet()
+            if tweet is None:
+                # We'll try again the next time we're run
+                self.generate_random_lock.release()
+            else:
+                logger.debug(f"Putting random tweet in post_queue: {tweet}")
+                self.post_queue.put(tweet)
 
     def get_new_mentions(self):
         """Fetch new (unanswered) Tweets mentioning us
@@ -267,14 +487,33 @@ class TwitterHAL:
         """
         if self.force or self.can_post():
             try:
-                mention = self.mention_queue.get_nowait()
+                # Wait until the runner starts the next one of us, so a new
+                # mention is picked up as soon as get_new_mentions() puts it
+                # there
+                mention = self.mention_queue.get(timeout=settings.RUNNER_SLEEP_SECONDS)
             except queue.Empty:
                 pass
             else:
                 logger.debug(f"Generating reply to {mention}")
-                reply = self.generate_tweet(in_reply_to=mention)
-                logger.debug(f"Putting reply in post_queue: {reply}")
-                self.post_queue.put(reply)
+                reply = self._generate_reply(mention)
+                if reply is not None:
+                    logger.debug(f"Putting reply in post_queue: {reply}")
+                    self.post_queue.put(reply)
+
+    def requeue_deferred_mentions(self):
+        """Put mentions that generate_tweet() gave up on back in
+        mention_queue, once settings.TWEET_GENERATION["retry_seconds"] have
+        passed, unless they have been answered meanwhile. MegaHAL doesn't
+        learn from them again when they are retried.
+        """
+        while self.deferred_mentions and self.deferred_mentions[0][0] <= time.time():
+            mention = self.deferred_mentions.popleft()[1]
+            # The one in the database is the one that gets flagged
+            mention = self.db.mentions.get_by_id(mention.id) or mention
+            if not mention.is_answered:
+                logger.info(f"Retrying reply to {mention}")
+                self.retried_mention_ids.add(mention.id)
+                self.mention_queue.put(mention)
 
     """ ---------- PUBLIC METHODS USED BY WORKERS/TASKS ETC ---------- """
 
@@ -308,7 +547,7 @@ class TwitterHAL:
         logger.debug(f"self.post_status_limit.remaining: {self.post_status_limit.remaining}, count: {count}")
         return self.post_status_limit.remaining >= count
 
-    def generate_tweet(self, in_reply_to=None, prefixes=[], suffixes=[]):
+    def generate_tweet(self, in_reply_to=None, prefixes=[], suffixes=[], learn=True):
         """Generate a Tweet object
 
         Generate a new Tweet object from MegaHAL, with or without another Tweet
@@ -330,11 +569,28 @@ class TwitterHAL:
             suffixes (list of str, optional): List of strings that will be put
                 in the end of the generated Tweet, separated by space.
                 Hashtags maybe?
+            learn (bool, optional): Whether MegaHAL should learn from
+                `in_reply_to` before replying to it. Default: True
+
+        The first candidate MegaHAL generates that is neither empty nor a
+        fuzzy duplicate of a posted tweet is used. With
+        settings.MEGAHAL_PROCESSES, candidates are generated
+        settings.TWEET_GENERATION["batch_size"] at a time, in parallel, and
+        screened together; otherwise, one at a time. If none is found within
+        the "max_attempts" and "max_seconds" of settings.TWEET_GENERATION, or
+        we're exiting, its "fallback" policy decides what happens: "best"
+        (the default) uses the candidate least similar to posted tweets, and
+        keeps trying if all of them were empty, "skip" gives up, and "queue"
+        gives up but puts `in_reply_to` in self.deferred_mentions, to be
+        retried by requeue_deferred_mentions(). Attempts and time spent are
+        logged and added to self.generation_stats.
 
         Returns:
-            models.Tweet object
+            models.Tweet object, or None if we gave up. That only happens
+            with the "skip" and "queue" fallbacks, or if we're exiting.
         """
-        start_time = datetime.datetime.now().time().isoformat("seconds")
+        options = settings.TWEET_GENERATION
+        start = time.monotonic()
         if in_reply_to:
             mentions = ["@" + in_reply_to.user.screen_name]
             if self.include_mentions:
@@ -358,16 +614,53 @@ class TwitterHAL:
             suffix = ""
 
         phrase = in_reply_to.filtered_text if in_reply_to else ""
-        reply = self.megahal.get_reply(phrase, max_length=CHARACTER_LIMIT - len(prefix) - len(suffix))
-        while (not reply or self.db.posted_tweets.fuzzy_duplicates(reply.text)) and not killer.kill_now:
-            # If, for some reason, we got an empty or duplicate reply: keep
-            # trying, but don't learn from the input again
-            if not reply:
-                logger.info(f"Got empty reply, trying again (since {start_time})")
+        max_length = CHARACTER_LIMIT - len(prefix) - len(suffix)
+        reply, best, best_score, attempts = None, None, None, 0
+        while reply is None:
+            if self.generator is None:
+                # No point in generating more than one at a time in-process;
+                # the first one may do
+                count = 1
+            else:
+                count = max(min(options["batch_size"], options["max_attempts"] - attempts), 1)
+            # Only learn from the input once
+            candidates = [
+                c for c in self._get_reply_texts(phrase, max_length, count, learn=learn and not attempts) if c]
+            attempts += count
+            scores = self.db.posted_tweets.fuzzy_scores(candidates)
+            for candidate, score in zip(candidates, scores):
+                if not score:
+                    reply = candidate
+                    break
+                if best_score is None or score < best_score:
+                    best, best_score = candidate, score
             else:
-                logger.info(f"Got duplicate reply, trying again (since {start_time}): {reply}")
-            reply = self.megahal.get_reply_nolearn(phrase, max_length=CHARACTER_LIMIT - len(prefix) - len(suffix))
-        text = prefix + reply.text + suffix
+                if killer.kill_now:
+                    break
+                # With "best", there has to be something to fall back on
+                if (attempts >= options["max_attempts"] or time.monotonic() - start >= options["max_seconds"]) and \
+                        (best is not None or options["fallback"] != "best"):
+                    break
+                logger.info(
+                    f"Got {count - len(candidates)} empty and {len(candidates)} duplicate replies, trying again "
+                    f"({attempts} attempts)")
+        seconds = time.monotonic() - start
+        self.generation_stats["tweets"] += 1
+        self.generation_stats["attempts"] += attempts
+        self.generation_stats["seconds"] += seconds
+        if reply is None:
+            self.generation_stats["fallbacks"] += 1
+            if options["fallback"] == "best" and best is not None:
+                logger.info(f"No unique reply after {attempts} attempts, {seconds:.1f} s; using the best one: {best}")
+                reply = best
+            else:
+                logger.info(f"No unique reply after {attempts} attempts, {seconds:.1f} s; giving up")
+                if options["fallback"] == "queue" and in_reply_to is not None:
+                    self.deferred_mentions.append((time.time() + options["retry_seconds"], in_reply_to))
+                return None
+        else:
+            logger.info(f"Generated reply after {attempts} attempts, {seconds:.1f} s")
+        text = prefix + reply + suffix
         tweet = Tweet(
             text=text, filtered_text=text,
             in_reply_to_status_id=in_reply_to.id if in_reply_to is not None else None
@@ -375,6 +668,61 @@ class TwitterHAL:
         logger.debug(f"Generated: {tweet}")
         return tweet
 
+    def learn_from_queue(self, batch_size=None):
+        """Learn one batch of phrases from self.db.learn_queue
+
+        They are learned by self.megahal in one go, and only then removed
+        from the queue, so if we crash meanwhile, they will be learned again
+        rather than not at all.
+
+        Args:
+            batch_size (int, optional): Max number of phrases to learn.
+                Default: settings.DEFERRED_LEARNING["batch_size"]
+
+        Returns:
+            int: Number of phrases learned
+        """
+        batch_size = batch_size or settings.DEFERRED_LEARNING["batch_size"]
+        phrases = list(self.db.learn_queue[:batch_size])
+        if not phrases:
+            return 0
+        start = time.perf_counter()
+        try:
+            self.megahal.learn_many(phrases)
+        except Exception as e:
+            logger.error(f"Learning from queue failed: {e}")
+            return 0
+        # Other threads only append to it, so these are still first
+        del self.db.learn_queue[:len(phrases)]
+        logger.info(
+            f"Learned {len(phrases)} phrases in {time.perf_counter() - start:.3f} s, "
+            f"{len(self.db.learn_queue)} left in queue")
+        return len(phrases)
+
+    def pop_random_tweet(self):
+        """Take a pre-generated random tweet from self.db.random_tweet_pool
+
+        Tweets that have become duplicates of posted tweets since they were
+        generated are thrown away. Hits, misses and discarded tweets are
+        counted in self.random_tweet_pool_stats.
+
+        Returns:
+            models.Tweet object, or None if the pool is empty
+        """
+        while True:
+            try:
+                text = self.db.random_tweet_pool.pop(0)
+            except IndexError:
+                self.random_tweet_pool_stats["misses"] += 1
+                logger.info(f"Random tweet pool is empty ({self._random_tweet_pool_summary()})")
+                return None
+            if not self.db.posted_tweets.fuzzy_duplicates(text):
+                self.random_tweet_pool_stats["hits"] += 1
+                logger.info(f"Got random tweet from pool ({self._random_tweet_pool_summary()})")
+                return Tweet(text=text, filtered_text=text)
+            self.random_tweet_pool_stats["discarded"] += 1
+            logger.info(f"Discarded duplicate from random tweet pool: {text}")
+
     def process_new_mention(self, mention):
         """Hook for doing what you need to do when a new mention comes in"""
         return mention
@@ -399,10 +747,13 @@ class TwitterHAL:
     def post_random_tweet(self):
         """Post a new random Tweet
 
-        Not used in the daemon loop. Just posts a new random Tweet on demand.
+        Not used in the daemon loop. Just posts a new random Tweet on demand,
+        from the pool of pre-generated ones if there are any.
         """
-        tweet = self.generate_tweet()
-        if self.force or self.can_post():
+        tweet = self.pop_random_tweet() or self.generate_tweet()
+        if tweet is None:
+            logger.info("Could not generate a random tweet")
+        elif self.force or self.can_post():
             self._post_tweet(tweet)
 
     """ ---------- PRIVATE HELPER METHODS ---------- """
@@ -411,7 +762,7 @@ class TwitterHAL:
         # Make sure _get_missing_mentions() and _get_missing_own_tweets() is
         # run *before* this one
         logger.info("Flagging replied mentions ...")
-        in_reply_to_ids = [t.in_reply_to_status_id for t in self.db.posted_tweets.replies]
+        in_reply_to_ids = {t.in_reply_to_status_id for t in self.db.posted_tweets.replies}
         for mention in [t for t in self.db.mentions.unanswered if t.id in in_reply_to_ids]:
             mention.is_answered = True
 
@@ -432,6 +783,7 @@ class TwitterHAL:
             since_id = None
         tweets = self.api.GetUserTimeline(screen_name=self.screen_name, since_id=since_id, count=200)
         self.db.posted_tweets.extend([Tweet.from_status(t) for t in tweets])
+        self._own_tweets_fetched = True
 
     def _init_post_status_limit(self):
         """Initialize status/retweet post limit data
@@ -440,21 +792,19 @@ class TwitterHAL:
         make an effort to keep track of them ourselves, going after the limits
         specified at:
         https://developer.twitter.com/en/docs/tweets/post-and-engage/api-reference/post-statuses-retweet-id
+
+        Counts our posts within the last 3 hours from self.db.posted_tweets,
+        after fetching those of them it doesn't have yet (e.g. posted by
+        another instance, or while we were not running) from our timeline
+        with _get_missing_own_tweets(). If that fails, only the posts we
+        already have are counted.
         """
         since = time.time() - 3 * 60 * 60
         try:
-            latest_posts = self.api.GetUserTimeline(screen_name=self.screen_name, count=200, trim_user=True)
-        except twitter.TwitterError:
-            warnings.warn("Could not connect to Twitter API! Keys/secrets incorrect?")
-        else:
-            # Limit within the 3 hour window is 300 requests, but Twitter only lets
-            # us fetch 200 at a time
-            if latest_posts and len(latest_posts) > 190 and latest_posts[-1].created_at_in_seconds > since:
-                latest_posts += self.api.GetUserTimeline(
-                    screen_name=self.screen_name, count=200, since_id=latest_posts[-1].id, trim_user=True
-                )
-            latest_posts = [p for p in latest_posts if p.created_at_in_seconds > since]
-            self._set_post_status_limit(subtract=len(latest_posts))
+            self._get_missing_own_tweets()
+        except (twitter.TwitterError, ConnectionError) as e:
+            logger.warning(f"Could not fetch own posted tweets, post limit may be off: {e}")
+        self._set_post_status_limit(subtract=len(self.db.posted_tweets.since(since)))
 
     def _post_tweet(self, tweet):
         # Checking can_post is the responsibility of the caller.
@@ -493,6 +843,52 @@ class TwitterHAL:
             logger.debug("Releasing generate_random_lock")
             self.generate_random_lock.release()
 
+    def _generate_reply(self, mention):
+        """Generate a reply to `mention`, without learning from it if it's
+        being retried by requeue_deferred_mentions()
+        """
+        learn = mention.id not in self.retried_mention_ids
+        self.retried_mention_ids.discard(mention.id)
+        return self.generate_tweet(in_reply_to=mention, learn=learn)
+
+    def _get_reply_texts(self, phrase, max_length, count=1, learn=True):
+        """Generate `count` replies to `phrase` with MegaHAL, learning from it
+        first if `learn` is True, and return their texts ("" for those there
+        were none)
+
+        With settings.MEGAHAL_PROCESSES, the replies are generated in parallel
+        by the worker processes, but learning is still done by self.megahal,
+        and the workers only get what it has learned at the next
+        checkpoint().
+        With settings.DEFERRED_LEARNING["enabled"], `phrase` is put in
+        self.db.learn_queue for learning_worker() instead.
+        """
+        if learn and phrase:
+            if settings.DEFERRED_LEARNING["enabled"]:
+                self.db.learn_queue.append(phrase)
+            else:
+                self.megahal.learn(phrase)
+        if self.generator is None:
+            replies = [self.megahal.get_reply_nolearn(phrase, max_length=max_length) for _ in range(count)]
+            return [reply.text if reply else "" for reply in replies]
+        return [f.result() for f in [self.generator.submit(phrase, max_length=max_length) for _ in range(count)]]
+
+    def _put_generated_reply(self, future):
+        try:
+            reply = future.result()
+        except Exception as e:
+            logger.error(f"Reply generation raised: {e}")
+        else:
+            # None if generate_tweet() gave up
+            if reply is not None:
+                logger.debug(f"Putting reply in post_queue: {reply}")
+                self.post_queue.put(reply)
+
+    def _random_tweet_pool_summary(self):
+        stats = self.random_tweet_pool_stats
+        return f"{len(self.db.random_tweet_pool)} left, {stats['hits']} hits, {stats['misses']} misses, " \
+            f"{stats['discarded']} discarded"
+
     def _set_post_status_limit(self, subtract=0):
         if hasattr(self, "post_status_limit") and self.post_status_limit.reset > time.time():
             reset = self.post_status_limit.reset
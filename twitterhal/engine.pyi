@@ -1,13 +1,15 @@
 import datetime
 import queue
 import threading
-from typing import Any, Dict, List, Optional, Sequence
+from concurrent.futures import Future
+from typing import Any, Deque, Dict, List, Optional, Sequence, Set, Tuple, Type, Union
 
 import twitter
-from megahal import MegaHAL
+from megahal.megahal import DBInstance as MegaHALDBInstance
 from twitter.ratelimit import EndpointRateLimit
 
 from twitterhal.database import BaseDatabase
+from twitterhal.generation import ConcurrentMegaHAL, ProcessPoolGenerator
 from twitterhal.models import Tweet, TweetList
 from twitterhal.twitter_api import TwitterApi
 
@@ -15,23 +17,33 @@ from twitterhal.twitter_api import TwitterApi
 class DBInstance(BaseDatabase):
     posted_tweets: TweetList
     mentions: TweetList
+    random_tweet_pool: List[str]
+    learn_queue: List[str]
 
 
 class TwitterHAL:
     api: TwitterApi
     db: DBInstance
+    deferred_mentions: Deque[Tuple[float, Tweet]]
     force: bool
     generate_random_lock: threading.Lock
+    generation_stats: Dict[str, Union[int, float]]
+    generator: Optional[ProcessPoolGenerator]
     include_mentions: bool
     megahal_open: bool
     megahal_lock: threading.Lock
-    megahal: MegaHAL
+    megahal: ConcurrentMegaHAL
     mention_queue: queue.Queue[Tweet]
     post_queue: queue.Queue[Tweet]
     post_status_limit: EndpointRateLimit
     random_post_times: Sequence[datetime.time]
+    random_tweet_pool_stats: Dict[str, int]
+    retried_mention_ids: Set[Optional[int]]
     screen_name: str
     test: bool
+    _generator: Optional[ProcessPoolGenerator]
+    _generator_unsupported: bool
+    _own_tweets_fetched: bool
 
     def __del__(self): ...
     def __enter__(self) -> TwitterHAL: ...
@@ -40,28 +52,43 @@ class TwitterHAL:
                  include_mentions: Optional[bool], force: bool, test: bool): ...
     def _flag_replied_mentions(self): ...
     def _get_missing_mentions(self): ...
+    def _generate_reply(self, mention: Tweet) -> Optional[Tweet]: ...
     def _get_missing_own_tweets(self): ...
+    def _get_reply_texts(self, phrase: str, max_length: int, count: int, learn: bool) -> List[str]: ...
     def _init_post_status_limit(self): ...
     def _post_tweet(self, tweet: Tweet): ...
+    def _put_generated_reply(self, future: Future[Optional[Tweet]]): ...
+    def _random_tweet_pool_summary(self) -> str: ...
     def _set_post_status_limit(self, subtract: int): ...
     def _time_for_random_post(self) -> bool: ...
     def can_do_request(self, url: str, count: int) -> bool: ...
     def can_post(self, count: int = 1) -> bool: ...
+    def checkpoint(self): ...
+    def checkpoint_worker(self): ...
     def close(self): ...
     def generate_random(self): ...
-    def generate_tweet(self, in_reply_to: Optional[Tweet], prefixes: List[str], suffixes: List[str]) -> Tweet: ...
+    def generate_tweet(self, in_reply_to: Optional[Tweet], prefixes: List[str], suffixes: List[str],
+                       learn: bool) -> Optional[Tweet]: ...
     def get_megahal_api_kwargs(self, **kwargs) -> Dict[str, Any]: ...
+    def get_megahal_db_args(self) -> Tuple[Type[MegaHALDBInstance], Dict[str, Any]]: ...
     def get_new_mentions(self): ...
     def get_twitter_api_kwargs(self, **kwargs) -> Dict[str, Any]: ...
     def init_db(self): ...
+    def learn_from_queue(self, batch_size: Optional[int] = ...) -> int: ...
+    def learning_worker(self): ...
     def mark_mentions_answered(self): ...
+    def migrate_db(self, other_db: BaseDatabase, **kwargs) -> Dict[str, int]: ...
     def open(self): ...
     def pop_mention_and_generate_reply(self): ...
+    def pop_random_tweet(self) -> Optional[Tweet]: ...
     def post_from_queue(self): ...
     def post_random_tweet(self): ...
     def post_tweets_worker(self, restart: bool): ...
     def prepare_runner(self): ...
     def process_new_mention(self, mention: Tweet) -> Tweet: ...
+    def random_tweet_pool_worker(self): ...
     def register_loop_tasks(self): ...
     def register_post_loop_tasks(self): ...
     def register_workers(self): ...
+    def reply_generation_worker(self): ...
+    def requeue_deferred_mentions(self): ...
@@ -0,0 +1,443 @@
+"""Creating MegaHAL instances, sharing them between threads, and generating
+replies in worker processes
+
+ConcurrentMegaHAL lets many threads generate replies with one MegaHAL
+instance at the same time, while learning is done by one thread at a time,
+with nobody generating meanwhile. MegaHAL is pure Python, though, so threads
+generating replies at the same time share one core. ProcessPoolGenerator
+runs MegaHAL instances in worker processes instead, over copies of the main
+process's brain.
+"""
+import collections
+import logging
+import os
+import shelve
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+
+
+logger = logging.getLogger(__name__)
+
+# Keys of the brain shelve of megahal < 0.4.0 whose values its Brain keeps
+# and changes, see sync_megahal()
+BRAIN_SHELVE_KEYS = ("forward", "backward", "dictionary", "banwords", "auxwords", "swapwords")
+
+# The MegaHAL instance of a ProcessPoolGenerator worker process
+_worker_megahal = None
+
+
+def create_megahal(Database=None, db_options={}, **kwargs):
+    """Create a MegaHAL instance
+
+    Args:
+        Database (type, optional): Brain database class. Only used by
+            megahal >= 0.4.0, which requires it.
+        db_options (dict, optional): Kwargs for `Database`
+        **kwargs (optional): Sent to megahal.MegaHAL(), see
+            settings.MEGAHAL_API.
+
+    Returns:
+        megahal.MegaHAL object
+    """
+    # Imported here, as it's slow and many commands never need it
+    import megahal
+
+    # Versions without VERSION are older than that
+    if getattr(megahal, "VERSION", (0,)) >= (0, 4, 0):
+        logger.info("Initializing MegaHAL, this could take a moment ...")
+        from twitterhal.database import get_redis_pool, REDIS_CONNECTION_KWARGS, RedisDatabase
+
+        db_options = dict(db_options)
+        if isinstance(Database, type) and issubclass(Database, RedisDatabase) and \
+                "connection_pool" not in db_options:
+            # So it shares the connection pool of our database, if that uses
+            # the same server
+            redis_kwargs = {k: v for k, v in db_options.items() if k in REDIS_CONNECTION_KWARGS}
+            db_options["connection_pool"] = get_redis_pool(**redis_kwargs)
+        return megahal.MegaHAL(db=Database(**db_options), **kwargs)
+    return megahal.MegaHAL(**kwargs)
+
+
+def sync_megahal(megahal):
+    """Sync a MegaHAL instance's brain to its database or file, if it has a
+    sync() method
+
+    megahal < 0.4.0 keeps its brain in a shelve opened with writeback, and
+    its sync() empties the shelve's cache. The brain goes on using the
+    objects that were in it, though, so whatever it learned afterwards would
+    never be written, not even on close(). So they are put back in the
+    cache.
+    """
+    if not callable(getattr(megahal, "sync", None)):
+        return
+    megahal.sync()
+    brain = getattr(megahal, "_MegaHAL__brain", None)
+    db = getattr(brain, "db", None)
+    if isinstance(db, shelve.Shelf) and db.writeback:
+        for key in BRAIN_SHELVE_KEYS:
+            if hasattr(brain, key):
+                db.cache[key] = getattr(brain, key)
+
+
+def process_pool_supported():
+    """Return True if ProcessPoolGenerator can be used with the installed
+    megahal
+
+    That takes megahal < 0.4.0, which keeps its brain in a shelve file of its
+    own, so every worker process can be given a copy of it. Later versions
+    keep the brain in one of our databases, which BaseDatabase caches once
+    loaded, so workers sharing it would never see what the main process
+    learns.
+    """
+    import megahal
+
+    return getattr(megahal, "VERSION", (0,)) < (0, 4, 0)
+
+
+class ReadWriteLock:
+    def __init__(self):
+        """Lock which may be held by many readers, or by one writer
+
+        Writers have priority: once one is waiting, new readers wait until
+        it's done, so a steady stream of readers can't starve it. Not
+        reentrant.
+        """
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    def acquire_read(self, timeout=None):
+        """Returns:
+            True if the lock was acquired, False if `timeout` ran out
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: not self._writer and not self._writers_waiting, timeout):
+                return False
+            self._readers += 1
+            return True
+
+    def release_read(self):
+        with self._cond:
+            self._readers -= 1
+            if not self._readers:
+                self._cond.notify_all()
+
+    def acquire_write(self, timeout=None):
+        """Returns:
+            True if the lock was acquired, False if `timeout` ran out
+        """
+        with self._cond:
+            self._writers_waiting += 1
+            try:
+                if not self._cond.wait_for(lambda: not self._writer and not self._readers, timeout):
+                    return False
+            finally:
+                self._writers_waiting -= 1
+            self._writer = True
+            return True
+
+    def release_write(self):
+        with self._cond:
+            self._writer = False
+            self._cond.notify_all()
+
+    @contextmanager
+    def read(self, timeout=None):
+        """Context manager holding the lock for reading
+
+        Raises:
+            TimeoutError: if `timeout` ran out
+        """
+        if not self.acquire_read(timeout):
+            raise TimeoutError("Timeout when acquiring read lock")
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def write(self, timeout=None):
+        """Context manager holding the lock for writing
+
+        Raises:
+            TimeoutError: if `timeout` ran out
+        """
+        if not self.acquire_write(timeout):
+            raise TimeoutError("Timeout when acquiring write lock")
+        try:
+            yield
+        finally:
+            self.release_write()
+
+
+class ConcurrentMegaHAL:
+    def __init__(self, megahal, lock_timeout=120):
+        """Thread safe wrapper around a MegaHAL instance
+
+        Replies are generated under `lock`'s read lock, so any number of
+        threads can do that at once. Phrases to learn from are queued, and
+        learned in batches by whichever thread gets to flush() the queue,
+        under the write lock. So while threads are generating, learners don't
+        wait for each other, but pile up, and are taken care of in one go.
+
+        Other attributes are those of the wrapped MegaHAL instance, and are
+        not locked.
+
+        Args:
+            megahal (megahal.MegaHAL)
+            lock_timeout (int, optional): Seconds to wait for `lock` before
+                raising TimeoutError. Default: 120
+        """
+        self.megahal = megahal
+        self.lock = ReadWriteLock()
+        self.lock_timeout = lock_timeout
+        self.learn_queue = collections.deque()
+        self.learned_count = 0
+        self.batch_count = 0
+        self._flush_lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.megahal, name)
+
+    def learn(self, phrase):
+        """Queue `phrase` for learning, and flush the queue unless another
+        thread is already doing that (and will take care of it)
+        """
+        self.learn_queue.append(phrase)
+        self.flush(blocking=False)
+
+    def flush(self, blocking=True):
+        """Learn all queued phrases, holding the write lock once for all of
+        them
+
+        Args:
+            blocking (bool, optional): If False, and another thread is
+                flushing, return right away instead of waiting for it to
+                finish. Default: True
+
+        Returns:
+            int: Number of phrases learned
+        """
+        count = 0
+        while self.learn_queue:
+            if not self._flush_lock.acquire(blocking=blocking):
+                break
+            try:
+                with self.lock.write(self.lock_timeout):
+                    # Including those queued while we waited for the lock
+                    phrases = []
+                    while self.learn_queue:
+                        phrases.append(self.learn_queue.popleft())
+                    count += self._learn_many(phrases)
+            finally:
+                self._flush_lock.release()
+            # Whatever was queued after we emptied the queue, but before we
+            # released _flush_lock, was left to us
+        return count
+
+    def learn_many(self, phrases):
+        """Learn from all `phrases` right away, holding the write lock once
+        for all of them
+
+        The brain is synced afterwards, if possible (see sync_megahal()), so
+        its database or file gets all the changes in one go.
+
+        Returns:
+            int: Number of phrases learned
+        """
+        if not phrases:
+            return 0
+        with self.lock.write(self.lock_timeout):
+            count = self._learn_many(phrases)
+            sync_megahal(self.megahal)
+        return count
+
+    def _learn_many(self, phrases):
+        # The write lock has to be held
+        for phrase in phrases:
+            self.megahal.learn(phrase)
+        self.learned_count += len(phrases)
+        self.batch_count += 1
+        logger.debug(f"Learned {len(phrases)} phrases in one batch")
+        return len(phrases)
+
+    def get_reply(self, phrase, max_length=None):
+        """Learn from `phrase` (or at least queue it, if another thread is
+        learning) and generate a reply to it
+        """
+        if phrase:
+            self.learn(phrase)
+        return self.get_reply_nolearn(phrase, max_length=max_length)
+
+    def get_reply_nolearn(self, phrase, max_length=None):
+        with self.lock.read(self.lock_timeout):
+            return self.megahal.get_reply_nolearn(phrase, max_length=max_length)
+
+    @contextmanager
+    def synced(self):
+        """Context manager which syncs the brain to its database or file, if
+        possible (see sync_megahal()), and keeps everyone from learning or
+        generating until it exits
+        """
+        with self.lock.write(self.lock_timeout):
+            sync_megahal(self.megahal)
+            yield
+
+    def close(self):
+        """Learn what's queued, and close the MegaHAL instance"""
+        self.flush()
+        with self.lock.write(self.lock_timeout):
+            self.megahal.close()
+
+
+# Suffixes of the files a shelve consists of, depending on the dbm module
+# used: gdbm uses none, ndbm ".db" (or ".dir" and ".pag"), dumb ".dat", ".dir"
+# and ".bak"
+SHELVE_SUFFIXES = ("", ".db", ".dat", ".dir", ".pag", ".bak")
+
+
+def _copy_brain(brainfile, dest):
+    """Copy the files of the brain shelve `brainfile` to `dest` (with the
+    same suffixes)
+
+    Returns:
+        int: Number of files copied
+    """
+    count = 0
+    for suffix in SHELVE_SUFFIXES:
+        if os.path.isfile(brainfile + suffix):
+            shutil.copyfile(brainfile + suffix, dest + suffix)
+            count += 1
+    return count
+
+
+def _init_worker(tmpdir, megahal_kwargs):
+    import signal
+
+    global _worker_megahal
+    # The main process handles these, and shuts us down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    # A copy of our own, since megahal opens its shelve with writeback and
+    # syncs it when garbage collected, and gdbm only lets one process open it
+    brainfile = os.path.join(tempfile.mkdtemp(prefix="worker-", dir=tmpdir), "brain")
+    _copy_brain(os.path.join(tmpdir, "snapshot", "brain"), brainfile)
+    _worker_megahal = create_megahal(**dict(megahal_kwargs, brainfile=brainfile))
+
+
+def _get_reply_nolearn(phrase, max_length):
+    reply = _worker_megahal.get_reply_nolearn(phrase, max_length=max_length)
+    return reply.text if reply else ""
+
+
+class ProcessPoolGenerator:
+    def __init__(self, processes, megahal=None, **megahal_kwargs):
+        """Generates MegaHAL replies in a pool of worker processes
+
+        Every worker has a MegaHAL instance of its own, created with the same
+        arguments as the main process's by create_megahal(), but over a
+        private copy of the brain file, as it was when the pool was started
+        or last refresh()ed. The workers never learn, and their copies are
+        thrown away; learning is left to the main process's MegaHAL, so it
+        is serialized, and the workers get what it has learned with the next
+        refresh().
+
+        That requires megahal < 0.4.0, see process_pool_supported().
+        Otherwise, ValueError is raised.
+
+        Worker processes are started with "spawn" rather than "fork", since
+        forking a process which runs threads is asking for trouble, so
+        everything has to be picklable.
+
+        Args:
+            processes (int): Number of worker processes
+            megahal (ConcurrentMegaHAL, optional): The main process's
+                MegaHAL, see refresh()
+            **megahal_kwargs (optional): See create_megahal()
+        """
+        from megahal.megahal import DEFAULT_BRAINFILE
+
+        if not process_pool_supported():
+            raise ValueError(
+                "MegaHAL worker processes require megahal < 0.4.0, whose brain is a file they can get copies of")
+        self.processes = processes
+        self.brainfile = megahal_kwargs.get("brainfile") or DEFAULT_BRAINFILE
+        self.megahal_kwargs = megahal_kwargs
+        # megahal.learned_count when the brain was last copied
+        self.learned_count = 0
+        self._executor = None
+        self._lock = threading.Lock()
+        self._tmpdir = None
+        self.refresh(megahal)
+
+    def refresh(self, megahal=None):
+        """Copy the brain file as it is now, and replace the worker processes
+        with new ones using the copy
+
+        The old workers finish the replies they have been given first, and
+        their copies are removed.
+
+        Args:
+            megahal (ConcurrentMegaHAL, optional): The main process's
+                MegaHAL. If given, its brain is synced, and it can't learn,
+                while the brain is copied. If not, nothing must write to the
+                brain file meanwhile.
+        """
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        tmpdir = tempfile.mkdtemp(prefix="twitterhal-brain-")
+        os.mkdir(os.path.join(tmpdir, "snapshot"))
+        snapshot = os.path.join(tmpdir, "snapshot", "brain")
+        if megahal is not None:
+            with megahal.synced():
+                _copy_brain(self.brainfile, snapshot)
+                learned_count = megahal.learned_count
+        else:
+            _copy_brain(self.brainfile, snapshot)
+            learned_count = self.learned_count
+        executor = ProcessPoolExecutor(
+            self.processes,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(tmpdir, self.megahal_kwargs),
+        )
+        with self._lock:
+            old_executor, old_tmpdir = self._executor, self._tmpdir
+            self._executor, self._tmpdir = executor, tmpdir
+            self.learned_count = learned_count
+        self._shutdown(old_executor, old_tmpdir)
+
+    def submit(self, phrase, max_length=None):
+        """Start generating a reply to `phrase` (without learning from it)
+
+        Returns:
+            concurrent.futures.Future, whose result will be the text of the
+                reply, or "" if there was none
+        """
+        with self._lock:
+            return self._executor.submit(_get_reply_nolearn, phrase, max_length)
+
+    def get_reply_nolearn(self, phrase, max_length=None):
+        """Generate a reply to `phrase` without learning from it, and return
+        its text (or "" if there was none)
+        """
+        return self.submit(phrase, max_length=max_length).result()
+
+    def close(self):
+        """Shut down the worker processes, after they finish what they're
+        doing, and remove their brain copies
+        """
+        with self._lock:
+            executor, tmpdir = self._executor, self._tmpdir
+            self._executor, self._tmpdir = None, None
+        self._shutdown(executor, tmpdir)
+
+    def _shutdown(self, executor, tmpdir):
+        if executor is not None:
+            executor.shutdown(wait=True)
+        if tmpdir is not None:
+            shutil.rmtree(tmpdir, ignore_errors=True)
@@ -0,0 +1,72 @@
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Any, ContextManager, Deque, Dict, List, Optional, Tuple, Type
+
+from megahal import MegaHAL
+from megahal.megahal import DBInstance as MegaHALDBInstance
+
+
+BRAIN_SHELVE_KEYS: Tuple[str, ...]
+SHELVE_SUFFIXES: Tuple[str, ...]
+_worker_megahal: Optional[MegaHAL]
+
+
+def _copy_brain(brainfile: str, dest: str) -> int: ...
+def _get_reply_nolearn(phrase: str, max_length: Optional[int]) -> str: ...
+def _init_worker(tmpdir: str, megahal_kwargs: Dict[str, Any]): ...
+def create_megahal(Database: Optional[Type[MegaHALDBInstance]], db_options: Dict[str, Any], **kwargs) -> MegaHAL: ...
+def process_pool_supported() -> bool: ...
+def sync_megahal(megahal: MegaHAL): ...
+
+
+class ReadWriteLock:
+    _cond: threading.Condition
+    _readers: int
+    _writer: bool
+    _writers_waiting: int
+
+    def __init__(self): ...
+    def acquire_read(self, timeout: Optional[float] = ...) -> bool: ...
+    def acquire_write(self, timeout: Optional[float] = ...) -> bool: ...
+    def read(self, timeout: Optional[float] = ...) -> ContextManager[None]: ...
+    def release_read(self): ...
+    def release_write(self): ...
+    def write(self, timeout: Optional[float] = ...) -> ContextManager[None]: ...
+
+
+class ConcurrentMegaHAL:
+    batch_count: int
+    learn_queue: Deque[str]
+    learned_count: int
+    lock: ReadWriteLock
+    lock_timeout: Optional[float]
+    megahal: MegaHAL
+    _flush_lock: threading.Lock
+
+    def __getattr__(self, name: str) -> Any: ...
+    def __init__(self, megahal: MegaHAL, lock_timeout: Optional[float] = ...): ...
+    def close(self): ...
+    def flush(self, blocking: bool = ...) -> int: ...
+    def get_reply(self, phrase: str, max_length: Optional[int] = ...) -> Any: ...
+    def get_reply_nolearn(self, phrase: str, max_length: Optional[int] = ...) -> Any: ...
+    def learn(self, phrase: str): ...
+    def learn_many(self, phrases: List[str]) -> int: ...
+    def synced(self) -> ContextManager[None]: ...
+    def _learn_many(self, phrases: List[str]) -> int: ...
+
+
+class ProcessPoolGenerator:
+    brainfile: str
+    learned_count: int
+    megahal_kwargs: Dict[str, Any]
+    processes: int
+    _executor: Optional[ProcessPoolExecutor]
+    _lock: threading.Lock
+    _tmpdir: Optional[str]
+
+    def __init__(self, processes: int, megahal: Optional[ConcurrentMegaHAL], **megahal_kwargs): ...
+    def _shutdown(self, executor: Optional[ProcessPoolExecutor], tmpdir: Optional[str]): ...
+    def close(self): ...
+    def get_reply_nolearn(self, phrase: str, max_length: Optional[int]) -> str: ...
+    def refresh(self, megahal: Optional[ConcurrentMegaHAL]): ...
+    def submit(self, phrase: str, max_length: Optional[int]) -> Future[str]: ...
@@ -1,25 +1,75 @@
 import logging
-from collections import UserList
+import math
+import threading
+import weakref
+from bisect import bisect_left, bisect_right
+from collections import UserList, defaultdict
 from datetime import datetime
 from email.utils import formatdate
 
-from Levenshtein import ratio
-from twitter.models import Status
+from twitter.models import Status, User
 
 from twitterhal.conf import settings
-from twitterhal.util import strip_phrase
+from twitterhal.util import strip_phrase, strip_phrases
 
 
 logger = logging.getLogger(__name__)
 
+# Flags kept in TweetList's secondary indexes, and how to test a Tweet for them
+TWEET_FLAGS = {
+    "answered": lambda tweet: bool(getattr(tweet, "is_answered", False)),
+    "processed": lambda tweet: bool(getattr(tweet, "is_processed", False)),
+    "reply": lambda tweet: getattr(tweet, "in_reply_to_status_id", None) is not None,
+}
+# Tweet attribute -> the flag it decides
+TWEET_FLAG_ATTRS = {
+    "is_answered": "answered",
+    "is_processed": "processed",
+    "in_reply_to_status_id": "reply",
+}
+# Attributes whose changes are reported to the TweetLists containing a Tweet
+TWEET_INDEXED_ATTRS = ("id", "filtered_text", "created_at", "created_at_in_seconds", *TWEET_FLAG_ATTRS)
+# Minimum Levenshtein ratio for two texts to be considered duplicates
+FUZZY_DUPLICATE_RATIO = 0.8
 
-class Tweet(Status):
+
+class TweetListMember:
+    """Mixin for objects stored in TweetList.
+
+    Changes to the attributes in TWEET_INDEXED_ATTRS are reported to every
+    TweetList containing the object, so they can keep their indexes up to
+    date.
+    """
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        if name in TWEET_INDEXED_ATTRS:
+            for tweet_list in self._get_tweet_lists():
+                tweet_list._tweet_changed(self, name)
+
+    def _add_tweet_list(self, tweet_list):
+        refs = [ref for ref in getattr(self, "_tweet_lists", []) if ref() is not None]
+        if not any(ref() is tweet_list for ref in refs):
+            refs.append(weakref.ref(tweet_list))
+        object.__setattr__(self, "_tweet_lists", refs)
+
+    def _get_tweet_lists(self):
+        refs = getattr(self, "_tweet_lists", None)
+        if not refs:
+            return []
+        tweet_lists = [ref() for ref in refs]
+        return [tweet_list for tweet_list in tweet_lists if tweet_list is not None]
+
+
+class Tweet(TweetListMember, Status):
     """Extended version of Status from the `twitter` package.
 
     Not dependent on whether we run 'extended mode' or not; self.text will
     contain status.full_text if available, otherwise status.text.
 
-    self.filtered_text: tweet text filtered by utils.strip_phrase().
+    self.filtered_text: tweet text filtered by utils.strip_phrase(). Unless
+        given to __init__(), it's computed on first access.
 
     self.is_answered: tweet that mentions us, to denote whether it's been
         answered.
@@ -35,22 +85,26 @@ class Tweet(Status):
             "is_processed": None,
         })
         self.text = self.full_text or self.text
-        if filtered_text is None:
-            self.filtered_text = strip_phrase(self.text or "")
-        else:
+        if filtered_text is not None:
             self.filtered_text = filtered_text
         self.is_answered = is_answered
         self.is_processed = is_processed
         self.created_at = self.created_at or formatdate()
 
     def __eq__(self, other):
-        if issubclass(other.__class__, Status):
+        if isinstance(other, (Status, TweetRecord)):
             return self.id == other.id
         return False
 
     def __hash__(self):
         return hash(str(self.id))
 
+    def __getstate__(self):
+        # Weak references cannot be pickled, and are of no use elsewhere
+        state = self.__dict__.copy()
+        state.pop("_tweet_lists", None)
+        return state
+
     def __repr__(self):
         if self.user:
             return f"Tweet<id={self.id}, screen_name={self.user.screen_name}, created={self.created_at}, " + \
@@ -61,6 +115,18 @@ class Tweet(Status):
     def __str__(self):
         return repr(self)
 
+    @property
+    def filtered_text(self):
+        # Stored in __dict__ under its own name, so it gets pickled along
+        # with the rest once computed
+        if self.__dict__.get("filtered_text") is None:
+            self.__dict__["filtered_text"] = strip_phrase(self.text or "")
+        return self.__dict__["filtered_text"]
+
+    @filtered_text.setter
+    def filtered_text(self, value):
+        self.__dict__["filtered_text"] = value
+
     def extend(self, other):
         """Extend this object with (non-default) attributes from `other`
 
@@ -76,8 +142,8 @@ class Tweet(Status):
     def from_status(cls, status):
         """Make a Tweet object out of a twitter.models.Status object
 
-        Will set .text to .full_text if available, and then .filtered_text to
-        strip_phrase(.text)
+        Will set .text to .full_text if available. .filtered_text will be
+        strip_phrase(.text), once accessed.
         """
         kwargs = {}
         for param, default in status.param_defaults.items():
@@ -85,10 +151,316 @@ class Tweet(Status):
         return cls(**kwargs)
 
 
+class TweetRecord(TweetListMember):
+    """Compact version of Tweet, which is what TweetList stores by default.
+
+    Holds only the fields TwitterHAL uses, in __slots__, and pickles to a
+    plain tuple of them. Has the same attributes as Tweet for those fields
+    (including .user.screen_name and .created_at), so it can be used in its
+    place for most purposes. Use to_tweet() to get a full Tweet.
+
+    Like with Tweet, filtered_text is computed on first access if not given.
+    """
+    fields = (
+        "id", "text", "filtered_text", "user_id", "user_screen_name", "in_reply_to_status_id",
+        "created_at_in_seconds", "is_answered", "is_processed",
+    )
+    __slots__ = tuple(field for field in fields if field != "filtered_text") + ("_filtered_text", "_tweet_lists")
+
+    def __init__(
+        self, id=None, text=None, filtered_text=None, user_id=None, user_screen_name=None,
+        in_reply_to_status_id=None, created_at_in_seconds=None, is_answered=False, is_processed=False
+    ):
+        self.id = id
+        self.text = text
+        self._filtered_text = filtered_text
+        self.user_id = user_id
+        self.user_screen_name = user_screen_name
+        self.in_reply_to_status_id = in_reply_to_status_id
+        self.created_at_in_seconds = created_at_in_seconds
+        self.is_answered = is_answered
+        self.is_processed = is_processed
+
+    def __eq__(self, other):
+        if isinstance(other, (Status, TweetRecord)):
+            return self.id == other.id
+        return False
+
+    def __hash__(self):
+        return hash(str(self.id))
+
+    def __reduce__(self):
+        # Don't compute filtered_text just for pickling it
+        return (
+            self.__class__,
+            tuple(self._filtered_text if field == "filtered_text" else getattr(self, field) for field in self.fields)
+        )
+
+    def __repr__(self):
+        return f"<TweetRecord(id={self.id}, screen_name={self.user_screen_name}, created={self.created_at}, " + \
+            f"text={self.text})>"
+
+    def __str__(self):
+        return repr(self)
+
+    @property
+    def filtered_text(self):
+        if self._filtered_text is None:
+            self._filtered_text = strip_phrase(self.text or "")
+        return self._filtered_text
+
+    @filtered_text.setter
+    def filtered_text(self, value):
+        self._filtered_text = value
+
+    @property
+    def created_at(self):
+        if self.created_at_in_seconds is None:
+            return None
+        return formatdate(self.created_at_in_seconds)
+
+    @property
+    def user(self):
+        if self.user_id is None and self.user_screen_name is None:
+            return None
+        return User(id=self.user_id, screen_name=self.user_screen_name)
+
+    @classmethod
+    def from_tweet(cls, tweet):
+        """Make a TweetRecord out of a Tweet (or twitter.models.Status)"""
+        if not isinstance(tweet, Tweet):
+            tweet = Tweet.from_status(tweet)
+        return cls(
+            id=tweet.id,
+            text=tweet.text,
+            filtered_text=tweet.__dict__.get("filtered_text"),
+            user_id=tweet.user.id if tweet.user else None,
+            user_screen_name=tweet.user.screen_name if tweet.user else None,
+            in_reply_to_status_id=tweet.in_reply_to_status_id,
+            created_at_in_seconds=tweet.created_at_in_seconds,
+            is_answered=tweet.is_answered,
+            is_processed=tweet.is_processed,
+        )
+
+    def to_tweet(self):
+        """Make a full Tweet out of this record"""
+        return Tweet(
+            id=self.id,
+            text=self.text,
+            filtered_text=self._filtered_text,
+            user=self.user,
+            in_reply_to_status_id=self.in_reply_to_status_id,
+            created_at=self.created_at,
+            is_answered=self.is_answered,
+            is_processed=self.is_processed,
+        )
+
+
+# Types that may be stored and indexed in TweetList
+TWEET_TYPES = (Status, TweetRecord)
+
+
+class FuzzyIndex:
+    """Index of texts, for finding those similar to a given text.
+
+    Levenshtein.ratio() is 2 * LCS / (len1 + len2), and the longest common
+    subsequence can never be longer than the shortest string. So two texts
+    can only have ratio > r if their lengths are within a factor of
+    (2 - r) / r of each other. Texts are bucketed by length, and only the
+    buckets within that window are checked with the actual ratio().
+
+    (Shingle/MinHash or trigram filters would only give approximate results
+    at a threshold as lenient as 0.8, so they are not used.)
+
+    Thread safe: searches copy the candidates under a lock, and compare them
+    after releasing it, so tweets can be added while others are screened.
+    """
+
+    def __init__(self):
+        self._buckets = defaultdict(dict)
+        self._lengths = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._lengths)
+
+    def add(self, key, text):
+        text = text or ""
+        with self._lock:
+            self._remove(key)
+            self._lengths[key] = len(text)
+            self._buckets[len(text)][key] = text
+
+    def remove(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def _remove(self, key):
+        length = self._lengths.pop(key, None)
+        if length is not None:
+            del self._buckets[length][key]
+            if not self._buckets[length]:
+                del self._buckets[length]
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+            self._lengths.clear()
+
+    def _candidates(self, text, min_ratio):
+        """Return (key, text) for every text long/short enough to possibly
+        have a ratio greater than `min_ratio` with `text`
+        """
+        length = len(text)
+        # Generous rounding; we only want to rule out the impossible ones
+        min_length = math.floor(length * min_ratio / (2 - min_ratio))
+        max_length = math.ceil(length * (2 - min_ratio) / min_ratio)
+        with self._lock:
+            if max_length - min_length >= len(self._buckets):
+                lengths = [n for n in self._buckets if min_length <= n <= max_length]
+            else:
+                lengths = [n for n in range(min_length, max_length + 1) if n in self._buckets]
+            return [item for n in lengths for item in self._buckets[n].items()]
+
+    def search(self, text, min_ratio=FUZZY_DUPLICATE_RATIO):
+        """Return keys of all texts whose Levenshtein ratio with `text` is
+        greater than `min_ratio`
+        """
+        # Imported on demand, as importing it takes a while
+        from Levenshtein import ratio
+
+        return [key for key, candidate in self._candidates(text, min_ratio) if ratio(candidate, text) > min_ratio]
+
+    def max_ratio(self, text, min_ratio=FUZZY_DUPLICATE_RATIO):
+        """Return the highest Levenshtein ratio between `text` and any of the
+        texts, if it is greater than `min_ratio`; otherwise 0.0
+        """
+        from Levenshtein import ratio
+
+        ratios = [ratio(candidate, text) for _, candidate in self._candidates(text, min_ratio)]
+        return max([r for r in ratios if r > min_ratio], default=0.0)
+
+
+class Timeline:
+    """Keys sorted by timestamp, for range queries with bisect.
+
+    Adding keys in chronological order, and removing the oldest ones, are the
+    cheap operations.
+    """
+
+    def __init__(self):
+        self._timestamps = []
+        self._keys = []
+        self._timestamps_by_key = {}
+
+    def __len__(self):
+        return len(self._keys)
+
+    @property
+    def earliest(self):
+        return self._timestamps[0] if self._timestamps else 0
+
+    @property
+    def latest(self):
+        return self._timestamps[-1] if self._timestamps else 0
+
+    def add(self, key, timestamp):
+        if key in self._timestamps_by_key:
+            self.remove(key)
+        timestamp = timestamp or 0
+        idx = bisect_right(self._timestamps, timestamp)
+        self._timestamps.insert(idx, timestamp)
+        self._keys.insert(idx, key)
+        self._timestamps_by_key[key] = timestamp
+
+    def remove(self, key):
+        timestamp = self._timestamps_by_key.pop(key, None)
+        if timestamp is not None:
+            idx = bisect_left(self._timestamps, timestamp)
+            while self._keys[idx] != key:
+                idx += 1
+            del self._timestamps[idx]
+            del self._keys[idx]
+
+    def clear(self):
+        self._timestamps.clear()
+        self._keys.clear()
+        self._timestamps_by_key.clear()
+
+    def keys_between(self, start=None, end=None):
+        """Return keys with start <= timestamp < end, in chronological order"""
+        lo = 0 if start is None else bisect_left(self._timestamps, start)
+        hi = len(self._timestamps) if end is None else bisect_left(self._timestamps, end)
+        return self._keys[lo:hi]
+
+    def remove_older_than(self, timestamp):
+        """Remove and return keys with timestamp < `timestamp`"""
+        idx = bisect_left(self._timestamps, timestamp)
+        keys = self._keys[:idx]
+        del self._timestamps[:idx]
+        del self._keys[:idx]
+        for key in keys:
+            del self._timestamps_by_key[key]
+        return keys
+
+
+def get_timestamp(tweet):
+    """created_at_in_seconds of a Tweet, TweetRecord or Status; 0 if unknown"""
+    try:
+        return tweet.created_at_in_seconds or 0
+    except (AttributeError, TypeError):
+        return 0
+
+
+def to_timestamp(t):
+    if isinstance(t, datetime):
+        t = t.timestamp()
+    if not isinstance(t, (int, float)):
+        raise ValueError("Argument must be a timestamp or datetime")
+    return t
+
+
 class TweetList(UserList):
-    """A list of Tweet objects."""
+    """A list of Tweet objects.
+
+    If `compact` is True, Tweets (and Status objects) are converted to
+    TweetRecord on the way in. Changes to indexed attributes of the original
+    Tweet are still mirrored to its record.
+
+    If `unique` is True, an index mapping status ID -> list position is kept
+    up to date on every mutation, so membership checks, deduplication on
+    extend and get_by_id() don't have to scan the whole list.
+
+    Unique lists also keep sets of the IDs that have each of the flags in
+    TWEET_FLAGS. The derived views (.answered, .unanswered, .replies etc) are
+    built from those and cached until a mutation or flag change affects them,
+    so they should be treated as read-only.
+
+    The first call to fuzzy_duplicates() on a unique list sets up a
+    FuzzyIndex of its Tweets' filtered_text, which is then kept up to date.
+
+    Unique lists also keep a Timeline of their Tweets, making timestamp
+    queries (earliest_ts, since(), between() etc) and remove_older_than()
+    cheap. The latter is cheapest when the oldest Tweets are also first in
+    the list, which they will be if they were added chronologically.
+
+    If `data` is a database.RedisTweetStore, membership checks, get_by_id(),
+    the flag views and timestamp queries are run on the Redis server instead,
+    and flag changes are written back to it atomically. The FuzzyIndex is
+    still kept locally, and updated as items are added to and removed from
+    the store through this list.
 
-    def __init__(self, initlist=None, unique=False):
+    If `data` is a database.RedisList, which others (e.g. other processes)
+    may change too, its version counter is checked before the indexes are
+    used, and they are rebuilt if someone else has changed it.
+
+    `change_count` is incremented by every mutation, including changes to
+    the indexed attributes (TWEET_INDEXED_ATTRS) of contained Tweets, so
+    databases can tell whether the list has to be written again.
+    """
+    change_count = 0
+
+    def __init__(self, initlist=None, unique=False, compact=True):
         """Initialize the list.
 
         Args:
@@ -97,74 +469,385 @@ class TweetList(UserList):
                 unique Tweets, based on status ID. (Yes, I could use a set for
                 that, but I want to be able to use the same structure for
                 different kinds of Tweet lists)
+            compact (bool, optional): If True, store Tweets as TweetRecord
+                objects, which take up a lot less memory and storage. Set to
+                False if you need to store full Tweet objects, e.g. because
+                you have extended them with more attributes. Default: True
         """
         self.unique = unique
-        self.data = []
+        self.compact = compact
+        self._index = {}
         if initlist is not None:
+            if self.compact:
+                initlist = [self._to_stored(item) for item in initlist]
             if self.unique:
-                self.data = list(set(initlist))
+                # dict.fromkeys() dedupes just like set(), but keeps order
+                self.data = list(dict.fromkeys(initlist))
             else:
                 self.data = initlist
         else:
             self.data = []
 
+    @property  # type: ignore
+    def data(self):
+        return self._data
+
+    @data.setter
+    def data(self, value):
+        # `data` may be replaced wholesale, e.g. by RedisList.wrap(), so the
+        # index has to be rebuilt from scratch
+        self._data = value
+        self._changed()
+        # A RedisTweetStore can do lookups, flag and range queries itself
+        self._store = value if getattr(value, "is_tweet_store", False) else None
+        self._reindex()
+
+    def __getstate__(self):
+        # Pickle in the same format as before the index existed, so old and
+        # new shelve files remain interchangeable
+        state = self.__dict__.copy()
+        data = state.pop("_data")
+        # Lists backed by Redis or SQLite (e.g. when migrating to
+        # ShelveDatabase) are pickled as plain lists, streamed page by page
+        state["data"] = data if isinstance(data, list) else list(data)
+        for key in (
+            "_index", "_offset", "_flag_ids", "_fuzzy_index", "_timeline", "_views", "_store", "_redis_wrapped",
+            "_sqlite_wrapped", "_log_wrapped", "change_count",
+        ):
+            state.pop(key, None)
+        return state
+
+    def __setstate__(self, state):
+        state = state.copy()
+        data = state.pop("data", [])
+        # Lists pickled before `compact` existed get converted
+        state.setdefault("compact", True)
+        self.__dict__.update(state)
+        if self.compact and isinstance(data, list):
+            data = [self._to_stored(item) for item in data]
+        self.data = data
+
+    def __copy__(self):
+        return self.__class__(list(self.data), unique=self.unique, compact=self.compact)
+
+    def __contains__(self, item):
+        if self.unique:
+            self._check_data()
+            return self._contains(item)
+        return item in self.data
+
+    def _contains(self, item):
+        # Membership check for unique lists, without _check_data()
+        if not isinstance(item, TWEET_TYPES):
+            return False
+        if self._store is not None:
+            return self._store.contains_id(item.id)
+        return item.id in self._index
+
     def __setitem__(self, i, item):
-        if not self.unique or item not in self.data or self.data.index(item) == i:
+        self._changed()
+        if isinstance(i, slice):
+            self.data[i] = [self._to_stored(t) for t in item]
+            self._reindex()
+            return
+        if not self.unique:
+            self.data[i] = self._to_stored(item)
+            return
+        self._check_data()
+        if self._store is not None:
+            # The store refuses IDs it already has elsewhere
+            try:
+                self.data[i] = self._to_stored(item)
+            except ValueError:
+                pass
+            else:
+                self._fuzzy_index = None
+            return
+        if i < 0:
+            i += len(self.data)
+        if not self._contains(item) or self._position(item.id) == i:
+            old_item = self.data[i]
+            item = self._to_stored(item)
             self.data[i] = item
+            self._unindex_item(old_item)
+            self._index_item(item, i)
+
+    def __delitem__(self, i):
+        del self.data[i]
+        self._changed()
+        self._reindex()
 
     def __add__(self, other):
         if isinstance(other, UserList):
             other = other.data
         if self.unique:
-            return self.__class__(self.data + [t for t in other if t not in self.data], unique=True)
-        return self.__class__(self.data + other)
+            return self.__class__(list(self.data) + list(other), unique=True, compact=self.compact)
+        return self.__class__(self.data + other, compact=self.compact)
 
     def __radd__(self, other):
+        unique = False
+        compact = self.compact
         if isinstance(other, UserList):
             if isinstance(other, self.__class__):
                 unique = other.unique
-            else:
-                unique = False
+                compact = other.compact
             other = other.data
         if unique:
-            return self.__class__(other + [t for t in self.data if t not in other], unique=True)
-        return self.__class__(other + self.data)
+            return self.__class__(list(other) + list(self.data), unique=True, compact=compact)
+        return self.__class__(other + self.data, compact=compact)
 
     def __iadd__(self, other):
-        if isinstance(other, UserList):
-            other = other.data
-        if self.unique:
-            self.data += [t for t in other if t not in self.data]
-        else:
-            self.data += other
+        self.extend(other)
+        return self
+
+    def __imul__(self, n):
+        self.data *= n
+        self._changed()
+        self._reindex()
         return self
 
     def __sizeof__(self):
         return self.data.__sizeof__()
 
+    def _get_view(self, flag, value):
+        test = TWEET_FLAGS[flag]
+        if not self.unique:
+            return self.__class__([t for t in self.data if test(t) == value], compact=self.compact)
+        if self._store is not None:
+            return self.__class__(self._store.flagged(flag, value), unique=True, compact=self.compact)
+        self._check_data()
+        if (flag, value) not in self._views:
+            ids = self._flag_ids[flag]
+            self._views[(flag, value)] = self.__class__(
+                [t for t in self.data if isinstance(t, TWEET_TYPES) and (t.id in ids) == value],
+                unique=True, compact=self.compact)
+        return self._views[(flag, value)]
+
+    def _position(self, id):
+        # Index values are offset by the number of items removed from the
+        # start of the list since last reindex; see remove_older_than()
+        pos = self._index.get(id)
+        return None if pos is None else pos - self._offset
+
+    def _index_item(self, item, pos):
+        if self.unique and self._store is not None and isinstance(item, TWEET_TYPES):
+            # The store keeps its own indexes, except the fuzzy one
+            if self._fuzzy_index is not None:
+                self._fuzzy_index.add(item.id, getattr(item, "filtered_text", None))
+            return
+        if self.unique and self._store is None and isinstance(item, TWEET_TYPES) and item.id not in self._index:
+            self._index[item.id] = pos + self._offset
+            self._timeline.add(item.id, get_timestamp(item))
+            for flag, test in TWEET_FLAGS.items():
+                if test(item):
+                    self._flag_ids[flag].add(item.id)
+            self._views.clear()
+            if self._fuzzy_index is not None:
+                self._fuzzy_index.add(item.id, getattr(item, "filtered_text", None))
+            if isinstance(item, TweetListMember) and isinstance(self._data, list):
+                item._add_tweet_list(self)
+
+    def _unindex_item(self, item):
+        if self.unique and isinstance(item, TWEET_TYPES):
+            self._unindex_id(item.id)
+
+    def _unindex_id(self, id):
+        if self._store is not None:
+            if self._fuzzy_index is not None:
+                self._fuzzy_index.remove(id)
+            return
+        if self._index.pop(id, None) is not None:
+            self._timeline.remove(id)
+            for ids in self._flag_ids.values():
+                ids.discard(id)
+            self._views.clear()
+            if self._fuzzy_index is not None:
+                self._fuzzy_index.remove(id)
+
+    def _changed(self):
+        self.change_count += 1
+
+    def _check_data(self):
+        """Rebuild the indexes if `data` is a RedisList (or RedisTweetStore)
+        that someone else has changed since they were built
+        """
+        if self.unique and hasattr(self._data, "is_stale") and self._data.is_stale():
+            logger.debug("List changed by someone else; rebuilding indexes")
+            self._reindex()
+
+    def _reindex(self):
+        if self.unique and hasattr(self._data, "track_version"):
+            # Before reading, so changes made meanwhile make it stale
+            self._data.track_version()
+        self._index = {}
+        self._offset = 0
+        self._timeline = Timeline()
+        self._flag_ids = {flag: set() for flag in TWEET_FLAGS}
+        self._views = {}
+        # Built again on demand, see _get_fuzzy_index()
+        self._fuzzy_index = None
+        # A store keeps its own indexes, so it doesn't have to be read
+        if self.unique and self._store is None:
+            for pos, item in enumerate(self.data):
+                self._index_item(item, pos)
+
+    def _tweet_changed(self, tweet, name):
+        """Called by `tweet` when one of its indexed attributes has changed"""
+        if name == "id":
+            self._changed()
+            self._reindex()
+            return
+        self._check_data()
+        if self._store is not None:
+            # The store keeps its own indexes, and ignores unknown IDs
+            if name == "filtered_text":
+                if self._fuzzy_index is not None:
+                    self._fuzzy_index.add(tweet.id, tweet.filtered_text)
+            elif self._store.update_item(self._to_stored(tweet)):
+                self._changed()
+            return
+        pos = self._position(tweet.id)
+        if pos is None:
+            return
+        self._changed()
+        if isinstance(self._data, list) and self._data[pos] is not tweet:
+            # If `data` is a plain list, it should contain this very object,
+            # unless `tweet` was converted to a TweetRecord when it was added
+            stored = self._data[pos]
+            if isinstance(stored, TweetRecord) and isinstance(tweet, Tweet):
+                if name == "created_at":
+                    name = "created_at_in_seconds"
+                setattr(stored, name, getattr(tweet, name))
+            return
+        # If `data` is not a plain list, `tweet` is a copy fetched from
+        # storage (see get_by_id()), or the original of a stored TweetRecord
+        if name == "filtered_text":
+            if self._fuzzy_index is not None:
+                self._fuzzy_index.add(tweet.id, tweet.filtered_text)
+            return
+        if name in ("created_at", "created_at_in_seconds"):
+            self._timeline.add(tweet.id, get_timestamp(tweet))
+            return
+        flag = TWEET_FLAG_ATTRS[name]
+        ids = self._flag_ids[flag]
+        has_flag = TWEET_FLAGS[flag](tweet)
+        if has_flag != (tweet.id in ids):
+            if has_flag:
+                ids.add(tweet.id)
+            else:
+                ids.discard(tweet.id)
+            self._views.pop((flag, True), None)
+            self._views.pop((flag, False), None)
+            if not isinstance(self._data, list):
+                # Write the change back to storage
+                self._data[pos] = self._to_stored(tweet)
+
+    def _to_stored(self, item):
+        """Return `item` in the form it should be stored in this list"""
+        if self.compact and isinstance(item, Status):
+            if isinstance(item, Tweet):
+                # Have changes to the original mirrored to the record
+                item._add_tweet_list(self)
+            return TweetRecord.from_tweet(item)
+        return item
+
     def append(self, item):
-        if not self.unique or item not in self.data:
+        if not self.unique or item not in self:
+            item = self._to_stored(item)
+            pos = len(self.data)
             self.data.append(item)
+            self._changed()
+            self._index_item(item, pos)
 
     def insert(self, i, item):
-        if not self.unique or item not in self.data:
-            self.data.insert(i, item)
+        if not self.unique or item not in self:
+            self.data.insert(i, self._to_stored(item))
+            self._changed()
+            self._reindex()
+
+    def pop(self, i=-1):
+        self._check_data()
+        item = self.data.pop(i)
+        self._changed()
+        if i == -1:
+            self._unindex_item(item)
+        else:
+            self._reindex()
+        return item
+
+    def remove(self, item):
+        if self.unique and isinstance(item, TWEET_TYPES):
+            self._check_data()
+            if self._store is not None:
+                # Removed by ID
+                self.data.remove(item)
+                self._changed()
+                self._unindex_id(item.id)
+                return
+            # By position rather than by value, since a RedisList compares
+            # encoded values, and a stored record's may differ from `item`'s
+            pos = self._position(item.id)
+            if pos is None:
+                raise ValueError("list.remove(x): x not in list")
+            del self.data[pos]
+        else:
+            self.data.remove(self._to_stored(item))
+        self._changed()
+        self._reindex()
+
+    def clear(self):
+        self.data.clear()
+        self._changed()
+        self._reindex()
+
+    def reverse(self):
+        self.data.reverse()
+        self._changed()
+        self._reindex()
+
+    def sort(self, *args, **kwargs):
+        self.data.sort(*args, **kwargs)
+        self._changed()
+        self._reindex()
+
+    def copy(self):
+        return self.__copy__()
 
     def extend(self, other):
         if isinstance(other, UserList):
             other = other.data
         if self.unique:
-            self.data.extend([t for t in other if t not in self.data])
-        else:
+            self._check_data()
+            new_items = {}
+            for item in other:
+                if not self._contains(item):
+                    new_items.setdefault(item, None)
+            other = list(new_items)
+        if self.compact:
+            other = [self._to_stored(item) for item in other]
+        if other:
+            pos = len(self.data)
             self.data.extend(other)
+            self._changed()
+            for idx, item in enumerate(other):
+                self._index_item(item, pos + idx)
 
     def get_by_id(self, id):
         if not self.unique:
             raise ValueError("Refusing to run get_by_id() when unique == False")
-        try:
-            return [t for t in self.data if t.id == id][0]
-        except IndexError:
-            return None
+        self._check_data()
+        if self._store is not None:
+            tweet = self._store.get_by_id(id)
+        else:
+            pos = self._position(id)
+            if pos is None:
+                return None
+            tweet = self.data[pos]
+        if isinstance(tweet, TweetListMember) and not isinstance(self._data, list):
+            # Copy fetched from storage; register it so flag changes on it are
+            # written back
+            tweet._add_tweet_list(self)
+        return tweet
 
     def only_in_language(self, language_code):
         """Filter for those Tweets that seem to be in a given language.
@@ -181,18 +864,23 @@ class TweetList(UserList):
         if not isinstance(language_code, str):
             raise ValueError("language_code has to be string")
         result = []
+        # Iterate rather than index, so Redis-backed lists are streamed
         languages = detectlanguage.detect([tweet.filtered_text for tweet in self.data])
-        for idx, lang in enumerate(languages):
+        for tweet, lang in zip(self.data, languages):
             try:
                 if lang[0]["language"] == language_code:
-                    result.append(self.data[idx])
+                    result.append(tweet)
             except IndexError:
                 pass
-        return self.__class__(result, unique=self.unique)
+        return self.__class__(result, unique=self.unique, compact=self.compact)
 
     def remove_older_than(self, t):
         """Clears the list of Tweets older than a given value.
 
+        On unique lists, this does not copy the remaining Tweets, and if the
+        ones to remove are all at the start of the list, it does not have to
+        rebuild the indexes either.
+
         Args:
             t (float, int, datetime): Remove all that are older than this;
                 float or int is interpreted as UNIX timestamps.
@@ -200,37 +888,162 @@ class TweetList(UserList):
         Returns:
             int: Number of items removed
         """
-        if isinstance(t, datetime):
-            t = t.timestamp()
-        if not isinstance(t, (int, float)):
-            raise ValueError("Argument must be a timestamp or datetime")
-        data = self.data.copy()
-        old_count = len(data)
-        self.data.clear()
-        self.data.extend([tweet for tweet in data if tweet.created_at_in_seconds >= t])
-        return old_count - len(self.data)
+        t = to_timestamp(t)
+        if not self.unique:
+            # Only keep the tweets to keep, so Redis-backed lists are
+            # streamed instead of copied
+            keep, count = [], 0
+            for tweet in self.data:
+                if get_timestamp(tweet) >= t:
+                    keep.append(tweet)
+                else:
+                    count += 1
+            if count:
+                self.data.clear()
+                self.data.extend(keep)
+                self._changed()
+            return count
+        self._check_data()
+        if self._store is not None:
+            # Other processes may have changed the store, so our indexes
+            # can't be trusted to know what's in it
+            count = self._store.remove_older_than(t)
+            if count:
+                self._changed()
+                self._reindex()
+            return count
+        ids = self._timeline.remove_older_than(t)
+        if not ids:
+            return 0
+        positions = sorted(self._position(id) for id in ids)
+        self._changed()
+        if positions[-1] == len(positions) - 1:
+            del self.data[:len(positions)]
+            self._offset += len(positions)
+            for id in ids:
+                self._unindex_id(id)
+        else:
+            for pos in reversed(positions):
+                del self.data[pos]
+            self._reindex()
+        return len(positions)
+
+    def since(self, t):
+        """Return TweetList of Tweets created at or after `t`, in
+        chronological order
+
+        Args:
+            t (float, int, datetime): float or int is interpreted as UNIX
+                timestamp.
+        """
+        return self.between(t, None)
+
+    def between(self, start, end):
+        """Return TweetList of Tweets created at or after `start` but before
+        `end`, in chronological order
+
+        Args:
+            start, end (float, int, datetime, or None): float or int is
+                interpreted as UNIX timestamps. None means no limit.
+        """
+        start = None if start is None else to_timestamp(start)
+        end = None if end is None else to_timestamp(end)
+        if not self.unique:
+            return self.__class__(
+                sorted(
+                    [
+                        tweet for tweet in self.data
+                        if (start is None or get_timestamp(tweet) >= start) and
+                        (end is None or get_timestamp(tweet) < end)
+                    ],
+                    key=get_timestamp
+                ),
+                compact=self.compact
+            )
+        if self._store is not None:
+            return self.__class__(self._store.between(start, end), unique=True, compact=self.compact)
+        self._check_data()
+        return self.__class__(
+            [self.data[self._position(id)] for id in self._timeline.keys_between(start, end)],
+            unique=True, compact=self.compact
+        )
 
     def fuzzy_duplicates(self, item):
         """Return TweetList of Tweets whose text is sufficiently similar to
         `item` (Levenshtein ratio > 0.8)
         """
-        if isinstance(item, Status):
+        if isinstance(item, Status) and not isinstance(item, Tweet):
             item = Tweet.from_status(item)
-        if isinstance(item, Tweet):
+        if isinstance(item, (Tweet, TweetRecord)):
             string = item.filtered_text
         elif isinstance(item, str):
             string = strip_phrase(item)
         else:
-            raise ValueError("item has to be str, Tweet, or Status")
-        return self.__class__([t for t in self.data if ratio(t.filtered_text, string) > 0.8], unique=self.unique)
+            raise ValueError("item has to be str, Tweet, TweetRecord, or Status")
+        if not self.unique:
+            # Imported on demand, as importing it takes a while
+            from Levenshtein import ratio
+            return self.__class__(
+                [t for t in self.data if ratio(t.filtered_text, string) > FUZZY_DUPLICATE_RATIO],
+                compact=self.compact)
+        self._check_data()
+        keys = self._get_fuzzy_index().search(string)
+        if self._store is not None:
+            # The store has no positions to sort by; use its own order
+            # instead, like between() does
+            items = sorted(self._store.get_many(keys), key=lambda t: (get_timestamp(t), t.id))
+            return self.__class__(items, unique=True, compact=self.compact)
+        keys = sorted(keys, key=self._position)
+        return self.__class__([self.data[self._position(key)] for key in keys], unique=True, compact=self.compact)
+
+    def fuzzy_scores(self, items):
+        """Screen a batch of candidate texts for fuzzy duplicates in one pass
+
+        Args:
+            items (iterable of str): Texts, not yet stripped
+
+        Returns:
+            list of float: For every item, the highest Levenshtein ratio
+                between it and a Tweet in this list, if that makes it a
+                duplicate (> 0.8); otherwise 0.0. Lower is better.
+        """
+        strings = strip_phrases(items)
+        if not self.unique:
+            from Levenshtein import ratio
+            texts = [t.filtered_text for t in self.data]
+            return [
+                max([r for r in (ratio(text, string) for text in texts) if r > FUZZY_DUPLICATE_RATIO], default=0.0)
+                for string in strings
+            ]
+        self._check_data()
+        index = self._get_fuzzy_index()
+        return [index.max_ratio(string) for string in strings]
+
+    def _get_fuzzy_index(self):
+        if self._fuzzy_index is None:
+            self._fuzzy_index = FuzzyIndex()
+            for t in self.data:
+                if isinstance(t, TWEET_TYPES):
+                    self._fuzzy_index.add(t.id, t.filtered_text)
+        return self._fuzzy_index
 
     @property
     def earliest_ts(self):
-        return min([t.created_at_in_seconds for t in self.data], default=0)
+        if self._store is not None:
+            return self._store.earliest_ts()
+        if self.unique:
+            self._check_data()
+            return self._timeline.earliest
+        return min([get_timestamp(t) for t in self.data], default=0)
 
     @property
     def latest_ts(self):
-        return max([t.created_at_in_seconds for t in self.data], default=0)
+        if self._store is not None:
+            return self._store.latest_ts()
+        if self.unique:
+            self._check_data()
+            return self._timeline.latest
+        return max([get_timestamp(t) for t in self.data], default=0)
 
     @property
     def earliest_date(self):
@@ -244,32 +1057,32 @@ class TweetList(UserList):
 
     @property
     def processed(self):
-        """Return TweetList of all Tweets that are flagged as processed"""
-        return self.__class__([t for t in self.data if t.is_processed], unique=self.unique)
+        """TweetList of all Tweets that are flagged as processed"""
+        return self._get_view("processed", True)
 
     @property
     def non_processed(self):
-        """Return TweetList of all Tweets that are NOT flagged as processed"""
-        return self.__class__([t for t in self.data if not t.is_processed], unique=self.unique)
+        """TweetList of all Tweets that are NOT flagged as processed"""
+        return self._get_view("processed", False)
 
     @property
     def answered(self):
-        """Return TweetList of all Tweets that are flagged as replied"""
-        return self.__class__([t for t in self.data if t.is_answered], unique=self.unique)
+        """TweetList of all Tweets that are flagged as replied"""
+        return self._get_view("answered", True)
 
     @property
     def unanswered(self):
-        """Return TweetList of all Tweets that are NOT flagged as replied"""
-        return self.__class__([t for t in self.data if not t.is_answered], unique=self.unique)
+        """TweetList of all Tweets that are NOT flagged as replied"""
+        return self._get_view("answered", False)
 
     @property
     def original_posts(self):
-        """Return TweetList of all Tweets that are original posts, i.e. NOT
-        replies to another tweet
+        """TweetList of all Tweets that are original posts, i.e. NOT replies
+        to another tweet
         """
-        return self.__class__([t for t in self.data if t.in_reply_to_status_id is None], unique=self.unique)
+        return self._get_view("reply", False)
 
     @property
     def replies(self):
-        """Return TweetList of all Tweets that are replies to another tweet"""
-        return self.__class__([t for t in self.data if t.in_reply_to_status_id is not None], unique=self.unique)
+        """TweetList of all Tweets that are replies to another tweet"""
+        return self._get_view("reply", True)
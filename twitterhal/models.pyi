@@ -1,19 +1,36 @@
+import weakref
 from collections import UserList
 from datetime import datetime
 from shelve import DbfilenameShelf
-from threading import RLock
+from threading import Lock, RLock
 from typing import (
-    Any, Dict, Generic, Iterable, List, Optional, Type, TypeVar, Union,
+    Any, Callable, Dict, Generic, Iterable, List, Optional, Set, Tuple, Type,
+    TypeVar, Union,
 )
 
 from redis import Redis
-from twitter.models import Status
+from twitter.models import Status, User
+
+from twitterhal.database import RedisTweetStore
 
 
 DBI = TypeVar("DBI")
 
+TWEET_FLAGS: Dict[str, Callable[[Any], bool]]
+TWEET_FLAG_ATTRS: Dict[str, str]
+TWEET_INDEXED_ATTRS: Tuple[str, ...]
+FUZZY_DUPLICATE_RATIO: float
+
+
+class TweetListMember:
+    _tweet_lists: List[weakref.ref]
+
+    def __setattr__(self, name: str, value: Any): ...
+    def _add_tweet_list(self, tweet_list: TweetList): ...
+    def _get_tweet_lists(self) -> List[TweetList]: ...
+
 
-class Tweet(Status):
+class Tweet(TweetListMember, Status):
     created_at: Optional[str]
     filtered_text: str
     full_text: Optional[str]
@@ -26,15 +43,79 @@ class Tweet(Status):
     def __eq__(self, other: Any) -> bool: ...
     def __hash__(self) -> int: ...
     def __init__(self, is_answered: bool, is_processed: bool, filtered_text: Optional[str], **kwargs): ...
-    def __setattr__(self, name: str, value: Any): ...
     def extend(self, other: Union[Status, Tweet]): ...
     @classmethod
     def from_status(cls, status: Status) -> "Tweet": ...
 
 
-class TweetList(UserList, Iterable[Tweet]):
+class TweetRecord(TweetListMember):
+    created_at: Optional[str]
+    created_at_in_seconds: Optional[int]
+    fields: Tuple[str, ...]
+    filtered_text: str
+    id: Optional[int]
+    in_reply_to_status_id: Optional[int]
+    is_answered: bool
+    is_processed: bool
+    text: Optional[str]
+    user: Optional[User]
+    user_id: Optional[int]
+    user_screen_name: Optional[str]
+
+    def __eq__(self, other: Any) -> bool: ...
+    def __hash__(self) -> int: ...
+    def __init__(self, id: Optional[int], text: Optional[str], filtered_text: Optional[str], user_id: Optional[int],
+                 user_screen_name: Optional[str], in_reply_to_status_id: Optional[int],
+                 created_at_in_seconds: Optional[int], is_answered: bool, is_processed: bool): ...
+    @classmethod
+    def from_tweet(cls, tweet: Union[Status, Tweet]) -> TweetRecord: ...
+    def to_tweet(self) -> Tweet: ...
+
+
+TWEET_TYPES: Tuple[type, ...]
+
+
+class FuzzyIndex:
+    _buckets: Dict[int, Dict[Any, str]]
+    _lengths: Dict[Any, int]
+    _lock: Lock
+
+    def __init__(self): ...
+    def __len__(self) -> int: ...
+    def _candidates(self, text: str, min_ratio: float) -> List[Tuple[Any, str]]: ...
+    def _remove(self, key: Any): ...
+    def add(self, key: Any, text: Optional[str]): ...
+    def clear(self): ...
+    def max_ratio(self, text: str, min_ratio: float = ...) -> float: ...
+    def remove(self, key: Any): ...
+    def search(self, text: str, min_ratio: float = ...) -> List[Any]: ...
+
+
+class Timeline:
+    _keys: List[Any]
+    _timestamps: List[int]
+    _timestamps_by_key: Dict[Any, int]
+    earliest: int
+    latest: int
+
+    def __init__(self): ...
+    def __len__(self) -> int: ...
+    def add(self, key: Any, timestamp: Optional[int]): ...
+    def clear(self): ...
+    def keys_between(self, start: Union[float, int, None], end: Union[float, int, None]) -> List[Any]: ...
+    def remove(self, key: Any): ...
+    def remove_older_than(self, timestamp: Union[float, int]) -> List[Any]: ...
+
+
+def get_timestamp(tweet: Any) -> int: ...
+def to_timestamp(t: Union[float, int, datetime]) -> Union[float, int]: ...
+
+
+class TweetList(UserList, Iterable[Union[Tweet, TweetRecord]]):
     answered: TweetList
-    data: Union[List[Tweet], UserList[Tweet]]  # type: ignore
+    change_count: int
+    compact: bool
+    data: Union[List[Union[Tweet, TweetRecord]], UserList[Union[Tweet, TweetRecord]]]  # type: ignore
     earliest_date: Optional[datetime]
     earliest_ts: int
     latest_date: Optional[datetime]
@@ -45,9 +126,31 @@ class TweetList(UserList, Iterable[Tweet]):
     replies: TweetList
     unanswered: TweetList
     unique: bool
+    _flag_ids: Dict[str, Set[Optional[int]]]
+    _fuzzy_index: Optional[FuzzyIndex]
+    _index: Dict[Optional[int], int]
+    _offset: int
+    _timeline: Timeline
+    _store: Optional[RedisTweetStore]
+    _views: Dict[Tuple[str, bool], TweetList]
 
-    def __init__(self, initlist: Union[List[Tweet], UserList[Tweet], None], unique: bool): ...
+    def __init__(self, initlist: Union[List[Tweet], UserList[Tweet], None], unique: bool, compact: bool): ...
     def fuzzy_duplicates(self, item: Union[str, Tweet, Status]) -> TweetList: ...
+    def fuzzy_scores(self, items: Iterable[str]) -> List[float]: ...
+    def _changed(self): ...
+    def _check_data(self): ...
+    def _contains(self, item: Any) -> bool: ...
+    def _get_fuzzy_index(self) -> FuzzyIndex: ...
+    def _get_view(self, flag: str, value: bool) -> TweetList: ...
+    def _index_item(self, item: Any, pos: int): ...
+    def _position(self, id: Optional[int]) -> Optional[int]: ...
+    def _reindex(self): ...
+    def _to_stored(self, item: Any) -> Any: ...
+    def _tweet_changed(self, tweet: Union[Tweet, TweetRecord], name: str): ...
+    def _unindex_id(self, id: Optional[int]): ...
+    def _unindex_item(self, item: Any): ...
+    def between(self, start: Union[float, int, datetime, None], end: Union[float, int, datetime, None]) -> TweetList: ...
     def get_by_id(self, id: int) -> Optional[Tweet]: ...
     def only_in_language(self, language_code: str) -> TweetList: ...
     def remove_older_than(self, t: Union[float, int, datetime]) -> int: ...
+    def since(self, t: Union[float, int, datetime]) -> TweetList: ...
@@ -0,0 +1,221 @@
+"""Codecs, which turn the values databases store into bytes and back
+
+Every encoded value carries a tag saying how it was encoded, so values
+written by different codecs (e.g. while migrating from one to another) can be
+mixed freely: loads() decodes them all, whichever codec does the reading.
+Values encoded by anything but pickle start with TAG_PREFIX, a tag byte and a
+format version byte. Anything else is a plain pickle, which has its own
+version tag (the protocol), and is what databases stored before codecs
+existed.
+"""
+import pickle
+import zlib
+
+from twitterhal.models import TweetList, TweetRecord
+
+
+# No pickle opcode is 0x00, so this can't be the start of a plain pickle
+TAG_PREFIX = b"\x00"
+# A TweetRecord or TweetList in TweetCodec's binary format
+TAG_RECORD = b"R"
+TAG_TWEET_LIST = b"L"
+# Another encoded value (with its own tag), compressed with zlib
+TAG_ZLIB = b"Z"
+# Current format version for each tag. Bump it whenever the format changes,
+# and keep decoding the old ones.
+TAG_VERSIONS = {TAG_RECORD: 1, TAG_TWEET_LIST: 1, TAG_ZLIB: 1}
+# Smaller values are not worth compressing
+DEFAULT_COMPRESS_MIN_SIZE = 256
+# TweetRecord attributes in the order TweetCodec writes them (which is also
+# the order of TweetRecord.__init__() arguments), and their types. Bools are
+# stored as bits of the field mask; the other fields only when not None.
+RECORD_LAYOUT = (
+    ("id", int), ("text", str), ("_filtered_text", str), ("user_id", int), ("user_screen_name", str),
+    ("in_reply_to_status_id", int), ("created_at_in_seconds", int), ("is_answered", bool), ("is_processed", bool),
+)
+# Kinds of TweetList items in TweetCodec's format
+ITEM_RECORD, ITEM_PICKLE = 0, 1
+
+
+def _tag(tag):
+    return TAG_PREFIX + tag + bytes([TAG_VERSIONS[tag]])
+
+
+def _pack_uint(value, out):
+    """Append `value` to bytearray `out` as a varint (7 bits per byte)"""
+    while value > 0x7F:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _unpack_uint(data, pos):
+    """Return (varint at data[pos], position after it)"""
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def _encode_record(record, out):
+    """Append `record` to bytearray `out` in TweetCodec's format
+
+    Returns False, leaving `out` as it was, if some value is of a type the
+    format doesn't cover.
+    """
+    mask, body = 0, bytearray()
+    for bit, (attr, type_) in enumerate(RECORD_LAYOUT):
+        value = getattr(record, attr)
+        if value is None and type_ is not bool:
+            continue
+        if type(value) is not type_:
+            return False
+        if type_ is bool:
+            if value:
+                mask |= 1 << bit
+            continue
+        mask |= 1 << bit
+        if type_ is int:
+            # Zigzag, so negative numbers are small too
+            _pack_uint(value * 2 if value >= 0 else -value * 2 - 1, body)
+        else:
+            value = value.encode("utf-8")
+            _pack_uint(len(value), body)
+            body += value
+    _pack_uint(mask, out)
+    out += body
+    return True
+
+
+def _decode_record(data, pos):
+    """Return (TweetRecord at data[pos], position after it)"""
+    mask, pos = _unpack_uint(data, pos)
+    values = []
+    for bit, (_, type_) in enumerate(RECORD_LAYOUT):
+        present = mask & (1 << bit)
+        if type_ is bool:
+            values.append(bool(present))
+        elif not present:
+            values.append(None)
+        elif type_ is int:
+            value, pos = _unpack_uint(data, pos)
+            values.append(-(value + 1) // 2 if value & 1 else value // 2)
+        else:
+            length, pos = _unpack_uint(data, pos)
+            values.append(data[pos:pos + length].decode("utf-8"))
+            pos += length
+    return TweetRecord(*values), pos
+
+
+def _decode_tweet_list(data, pos, version):
+    mask, pos = _unpack_uint(data, pos)
+    count, pos = _unpack_uint(data, pos)
+    items = []
+    for _ in range(count):
+        kind = data[pos]
+        if kind == ITEM_RECORD:
+            item, pos = _decode_record(data, pos + 1)
+        else:
+            length, pos = _unpack_uint(data, pos + 1)
+            item = pickle.loads(data[pos:pos + length])
+            pos += length
+        items.append(item)
+    tweet_list = TweetList.__new__(TweetList)
+    tweet_list.__setstate__({"unique": bool(mask & 1), "compact": bool(mask & 2), "data": items})
+    return tweet_list
+
+
+DECODERS = {
+    TAG_RECORD: lambda data, pos, version: _decode_record(data, pos)[0],
+    TAG_TWEET_LIST: _decode_tweet_list,
+    TAG_ZLIB: lambda data, pos, version: loads(zlib.decompress(data[pos:])),
+}
+
+
+def loads(data):
+    """Decode a value encoded by any codec (or a plain pickle)"""
+    if data[:1] != TAG_PREFIX:
+        return pickle.loads(data)
+    tag, version = data[1:2], data[2]
+    if tag not in DECODERS or version > TAG_VERSIONS[tag]:
+        raise ValueError(f"Unknown encoding: tag {tag!r}, version {version}")
+    return DECODERS[tag](data, 3, version)
+
+
+class PickleCodec:
+    def __init__(self, pickle_protocol=pickle.DEFAULT_PROTOCOL, compress_level=None,
+                 compress_min_size=DEFAULT_COMPRESS_MIN_SIZE):
+        """Encodes values with pickle
+
+        Uncompressed values are plain pickles, which is what databases
+        stored before codecs existed, so this is the default.
+
+        Args:
+            pickle_protocol (int, optional): https://docs.python.org/3.7/library/pickle.html#data-stream-format
+            compress_level (int, optional): If set, values of at least
+                `compress_min_size` bytes are compressed with zlib at this
+                level (1-9), unless that doesn't make them smaller.
+                Default: None (no compression).
+            compress_min_size (int, optional): Default:
+                DEFAULT_COMPRESS_MIN_SIZE.
+        """
+        self.pickle_protocol = pickle_protocol
+        self.compress_level = compress_level
+        self.compress_min_size = compress_min_size
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(pickle_protocol={self.pickle_protocol}, " \
+            f"compress_level={self.compress_level})"
+
+    def encode(self, value):
+        """Return `value` encoded, but not compressed"""
+        return pickle.dumps(value, protocol=self.pickle_protocol)
+
+    def dumps(self, value):
+        """Return `value` encoded, and compressed if so configured"""
+        data = self.encode(value)
+        if self.compress_level is not None and len(data) >= self.compress_min_size:
+            compressed = _tag(TAG_ZLIB) + zlib.compress(data, self.compress_level)
+            if len(compressed) < len(data):
+                return compressed
+        return data
+
+    def loads(self, data):
+        return loads(data)
+
+
+class TweetCodec(PickleCodec):
+    """Encodes TweetRecords, and TweetLists of them, in a compact binary
+    format, and anything else with pickle
+
+    A record takes a varint field mask (with the flags as bits) followed by
+    its non-None fields: varints for numbers, length-prefixed UTF-8 for
+    strings. That saves about 60 bytes per record compared to pickle, mostly
+    the class reference and opcodes pickle adds. Records with values of other
+    types (e.g. a float timestamp) are pickled.
+    """
+
+    def encode(self, value):
+        if type(value) is TweetRecord:
+            out = bytearray(_tag(TAG_RECORD))
+            if _encode_record(value, out):
+                return bytes(out)
+        elif type(value) is TweetList:
+            state = value.__getstate__()
+            if state.keys() == {"unique", "compact", "data"}:
+                out = bytearray(_tag(TAG_TWEET_LIST))
+                _pack_uint(bool(state["unique"]) | bool(state["compact"]) << 1, out)
+                _pack_uint(len(state["data"]), out)
+                for item in state["data"]:
+                    out.append(ITEM_RECORD)
+                    if type(item) is not TweetRecord or not _encode_record(item, out):
+                        out[-1] = ITEM_PICKLE
+                        data = pickle.dumps(item, protocol=self.pickle_protocol)
+                        _pack_uint(len(data), out)
+                        out += data
+                return bytes(out)
+        return super().encode(value)
@@ -0,0 +1,38 @@
+from typing import Any, Callable, Dict, Optional, Tuple, Type
+
+from twitterhal.models import TweetList, TweetRecord
+
+
+DECODERS: Dict[bytes, Callable[[bytes, int, int], Any]]
+DEFAULT_COMPRESS_MIN_SIZE: int
+ITEM_PICKLE: int
+ITEM_RECORD: int
+RECORD_LAYOUT: Tuple[Tuple[str, Type], ...]
+TAG_PREFIX: bytes
+TAG_RECORD: bytes
+TAG_TWEET_LIST: bytes
+TAG_VERSIONS: Dict[bytes, int]
+TAG_ZLIB: bytes
+
+
+def _decode_record(data: bytes, pos: int) -> Tuple[TweetRecord, int]: ...
+def _decode_tweet_list(data: bytes, pos: int, version: int) -> TweetList: ...
+def _encode_record(record: TweetRecord, out: bytearray) -> bool: ...
+def _pack_uint(value: int, out: bytearray): ...
+def _tag(tag: bytes) -> bytes: ...
+def _unpack_uint(data: bytes, pos: int) -> Tuple[int, int]: ...
+def loads(data: bytes) -> Any: ...
+
+
+class PickleCodec:
+    compress_level: Optional[int]
+    compress_min_size: int
+    pickle_protocol: int
+
+    def __init__(self, pickle_protocol: int, compress_level: Optional[int], compress_min_size: int): ...
+    def dumps(self, value: Any) -> bytes: ...
+    def encode(self, value: Any) -> bytes: ...
+    def loads(self, data: bytes) -> Any: ...
+
+
+class TweetCodec(PickleCodec): ...
@@ -2,12 +2,9 @@ import datetime
 import html
 import re
 import sys
+from functools import lru_cache
 
-import emoji
-from megahal.util import split_to_sentences
 
-
-emoji_pattern = emoji.get_emoji_regexp()
 url_pattern = re.compile(
     r"http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\(\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+",
     flags=re.IGNORECASE
@@ -15,35 +12,116 @@ url_pattern = re.compile(
 # Tries its best to match hashtags as half-assedly defined by Twitter here:
 # https://help.twitter.com/en/using-twitter/replies-not-showing-up-and-hashtag-problems
 hashtag_pattern = re.compile(r"(?<!\S)(#(?!\d+(?:\s|$))\w+)")
+mention_pattern = re.compile(r"@\w+")
+separator_pattern = re.compile(r"\s*[|•*]\s*")
+retweet_pattern = re.compile(r"^rt : ", flags=re.IGNORECASE)
+line_break_pattern = re.compile(r"[.!?]*[^\S ]+")
+multiple_spaces_pattern = re.compile(r" {2,}")
+quotes_table = str.maketrans("", "", "”\"")
+
+
+def __getattr__(name):
+    # emoji_pattern used to be compiled on import
+    if name == "emoji_pattern":
+        return get_emoji_pattern()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+@lru_cache(maxsize=None)
+def get_emoji_pattern():
+    """Regex matching any emoji; compiled on first call, as it's slow"""
+    import emoji
+    return emoji.get_emoji_regexp()
+
+
+@lru_cache(maxsize=None)
+def get_emoji_table():
+    """Emoji lookup data for strip_emojis(), built on first call
+
+    Returns:
+        tuple: (
+            frozenset of all emojis,
+            frozenset of non-ASCII characters found in emojis (every emoji
+                contains at least one of them),
+            dict of first character -> possible emoji lengths, longest first,
+        )
+    """
+    import emoji
+    emojis = frozenset(emoji.UNICODE_EMOJI)
+    emoji_chars = frozenset(c for e in emojis for c in e if not c.isascii())
+    emoji_lengths = {}
+    for e in emojis:
+        emoji_lengths.setdefault(e[0], set()).add(len(e))
+    return emojis, emoji_chars, {k: sorted(v, reverse=True) for k, v in emoji_lengths.items()}
+
 
+# Max number of distinct phrases strip_phrase() will remember results for
+STRIP_PHRASE_CACHE_SIZE = 4096
 
+
+def strip_emojis(phrase):
+    """Same result as get_emoji_pattern().sub("", phrase), only a lot faster
+
+    The pattern is an alternation of all emojis, longest first, which the
+    regex engine has to try one by one at every position. Here we instead
+    look up the longest emoji starting at each position.
+    """
+    emojis, emoji_chars, emoji_lengths = get_emoji_table()
+    if emoji_chars.isdisjoint(phrase):
+        return phrase
+    parts = []
+    start = idx = 0
+    end = len(phrase)
+    while idx < end:
+        for length in emoji_lengths.get(phrase[idx], ()):
+            if phrase[idx:idx + length] in emojis:
+                parts.append(phrase[start:idx])
+                idx += length
+                start = idx
+                break
+        else:
+            idx += 1
+    parts.append(phrase[start:])
+    return "".join(parts)
+
+
+@lru_cache(maxsize=STRIP_PHRASE_CACHE_SIZE)
 def strip_phrase(phrase):
+    # The steps have to run in this order, since each one works on the
+    # output of the previous (e.g. removing a URL may put a "@" right
+    # before a word). So instead of merging them, we skip the ones that
+    # cannot possibly match.
     # Strip emojis
-    phrase = emoji_pattern.sub("", phrase)
+    phrase = strip_emojis(phrase)
     # Unescape HTML entities
     phrase = html.unescape(phrase)
     # Strip URLs and mentions
-    phrase = url_pattern.sub("", phrase)
-    phrase = re.sub(r"@\w+", "", phrase)
+    if "://" in phrase:
+        phrase = url_pattern.sub("", phrase)
+    if "@" in phrase:
+        phrase = mention_pattern.sub("", phrase)
     # Strip hashtags
-    phrase = hashtag_pattern.sub("", phrase)
+    if "#" in phrase:
+        phrase = hashtag_pattern.sub("", phrase)
     # Strip quotation marks
-    phrase = re.sub(r"[”\"]", "", phrase)
+    phrase = phrase.translate(quotes_table)
     # Strip lines, stars & dots
-    phrase = re.sub(r"\s*[|•*]\s*", " ", phrase)
+    if "|" in phrase or "•" in phrase or "*" in phrase:
+        phrase = separator_pattern.sub(" ", phrase)
     # Remote "RT : ", denoting retweet (it used to be a @handle there before
     # we stripped it above)
-    phrase = re.sub(r"^rt : ", "", phrase, flags=re.IGNORECASE)
-    # Convert non-space whitespace (\n, \t etc) to period + space
-    phrase = re.sub(r"[.!?]*[^\S ]+", ". ", phrase)
-    # Strip superfluous whitespace
-    phrase = re.sub(r"\s{2,}", " ", phrase)
+    phrase = retweet_pattern.sub("", phrase)
+    # Convert non-space whitespace (\n, \t etc) to period + space. All such
+    # characters are non-printable.
+    if not phrase.isprintable():
+        phrase = line_break_pattern.sub(". ", phrase)
+    # Strip superfluous whitespace (only spaces are left by now)
+    if "  " in phrase:
+        phrase = multiple_spaces_pattern.sub(" ", phrase)
     # Remove trailing ellipsis + sentence that might have been cut off with it
-    try:
-        if phrase.strip()[-1] == "…":
-            phrase = " ".join(split_to_sentences(phrase)[:-1])
-    except IndexError:
-        pass
+    if phrase.rstrip().endswith("…"):
+        from megahal.util import split_to_sentences
+        phrase = " ".join(split_to_sentences(phrase)[:-1])
     phrase = phrase.strip()
     # Finish with a period if the sentence is unfinished
     if phrase and phrase[-1] not in ".?!":
@@ -51,6 +129,25 @@ def strip_phrase(phrase):
     return phrase
 
 
+def strip_phrases(phrases):
+    """Run strip_phrase() on every phrase in an iterable, for bulk ingestion
+
+    Bypasses strip_phrase()'s cache, so a big batch won't evict everything
+    else from it, but still only processes each distinct phrase once.
+
+    Returns:
+        list: Stripped phrases, in the same order as `phrases`
+    """
+    results = {}
+    normalize = strip_phrase.__wrapped__
+    stripped = []
+    for phrase in phrases:
+        if phrase not in results:
+            results[phrase] = normalize(phrase)
+        stripped.append(results[phrase])
+    return stripped
+
+
 def parse_time_string_list(string):
     result = []
     times = re.split(r",\s*", string)
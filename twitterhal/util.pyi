@@ -1,15 +1,26 @@
 import datetime
-from typing import Any, List, Pattern
+from typing import Any, Dict, FrozenSet, Iterable, List, Pattern, Tuple
 
 
+STRIP_PHRASE_CACHE_SIZE: int
 emoji_pattern: Pattern[str]
 hashtag_pattern: Pattern[str]
+line_break_pattern: Pattern[str]
+mention_pattern: Pattern[str]
+multiple_spaces_pattern: Pattern[str]
+quotes_table: Dict[int, Any]
+retweet_pattern: Pattern[str]
+separator_pattern: Pattern[str]
 url_pattern: Pattern[str]
 
 
 def camel_case(string: str) -> str: ...
+def get_emoji_pattern() -> Pattern[str]: ...
+def get_emoji_table() -> Tuple[FrozenSet[str], FrozenSet[str], Dict[str, List[int]]]: ...
 def parse_time_string_list(string: str) -> List[datetime.time]: ...
 def print_r(obj: Any, name: str, indent: int): ...
 def size_r(obj: Any) -> int: ...
 def slice_to_redis_range(slice_: slice) -> range: ...
+def strip_emojis(phrase: str) -> str: ...
 def strip_phrase(phrase: str) -> str: ...
+def strip_phrases(phrases: Iterable[str]) -> List[str]: ...